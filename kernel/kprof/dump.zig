@@ -4,6 +4,36 @@
 //! removed when the test runner switched to in-memory result reporting.
 //! What's left is the IPI-driven quiesce hook other cores enter via
 //! `parkForDump`, kept so the kprof IPI handler still has a target.
+//!
+//! Binary dump framing. When the serial dump is reinstated it should
+//! not print each `Record` as a decimal/hex `rec` line: at roughly
+//! 120 bytes of text per 64-byte record, formatting dominated the
+//! dump phase and every other core sat in `parkForDump` for the
+//! duration. `kernel/kprof/tools/parse_kprof.py` instead accepts the
+//! raw per-CPU `CpuLog` buffers, base64-encoded on `blk` lines:
+//!
+//!   [KPROF] begin cpus=<n> mode=<trace|sample> reason=<reason> tsc_hz=<hz>
+//!   [KPROF] name id=<id> name=<name>            (one per TraceId)
+//!   [KPROF] cpu_begin cpu=<c> records=<n> overflowed=<0|1> format=bin rec_size=<64|32>
+//!   [KPROF] blk <base64 of the next chunk of the buffer>
+//!   ...
+//!   [KPROF] cpu_end cpu=<c> crc32=0x<crc32 of the decoded bytes>
+//!   [KPROF] done
+//!
+//! The payload is exactly `base[0..head]` of the CPU's log: `Record`s
+//! back to back in their in-memory (little-endian, `extern struct`)
+//! layout, so the dumper is a bounded memcpy-plus-base64 loop per
+//! CPU with no per-record formatting. `blk` lines may be any length
+//! that is a multiple of 4 base64 characters; `crc32` (IEEE, as
+//! `std.hash.Crc32`) is optional and lets the host drop a block
+//! corrupted on the wire. Binary blocks carry no resolved symbols —
+//! the `sym=` field of text `rec` lines has no counterpart.
+//!
+//! `tsc_hz` on the `begin` line (either framing) is the calibrated
+//! invariant-TSC rate the timer code already holds, so the host can
+//! turn tick deltas into nanoseconds and compare runs across machines
+//! with different TSC frequencies. It is optional; captures without
+//! it stay in ticks unless the host is told the rate.
 
 const log_mod = @import("log.zig");
 const mode = @import("mode.zig");
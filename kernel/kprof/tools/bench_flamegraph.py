@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Micro-benchmark for flamegraph.py's tree build, layout and render.
+
+Generates synthetic folded profiles — kernel-like call stacks that
+share prefixes, with Zipf-distributed sample counts — at a ladder of
+sizes up to `--samples` samples over `--unique` distinct stacks, and
+times `build_tree`, `layout` and `render_svg` on each. Frames below
+`MIN_RENDER_PX` are pruned with their whole subtree, so layout and
+render time should track the visible frame count (the `us/visible`
+column stays flat) rather than the size of the tree.
+
+A last run renders a single stack `--depth` frames deep, well past
+Python's recursion limit.
+
+Usage:
+  bench_flamegraph.py                             # 1M samples, 100k stacks
+  bench_flamegraph.py --samples 200000 --unique 20000
+  bench_flamegraph.py --repeat 5 --seed 7
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import time
+from collections import Counter
+
+from flamegraph import SVG_PAD_X, SVG_WIDTH, build_tree, layout, render_svg
+
+# Size ladder, as fractions of --samples / --unique.
+STEPS = (0.01, 0.1, 1.0)
+
+
+def synthetic_folded(samples: int, unique: int, seed: int) -> Counter[tuple[str, ...]]:
+    """`unique` stacks of 4..48 frames grown from a shared pool of
+    call paths, so neighbouring stacks share their outer frames like
+    real interrupt/syscall chains do. Counts follow 1/rank, at least
+    one per stack, and sum to roughly `samples`."""
+    rng = random.Random(seed)
+    funcs = [f"fn_{i:05d}" for i in range(max(64, unique // 20))]
+    prefixes: list[tuple[str, ...]] = [(rng.choice(funcs),) for _ in range(16)]
+    stacks: set[tuple[str, ...]] = set()
+    while len(stacks) < unique:
+        base = rng.choice(prefixes)
+        depth = rng.randint(4, 48)
+        stack = base[:rng.randint(1, len(base))]
+        while len(stack) < depth:
+            stack += (rng.choice(funcs),)
+        stacks.add(stack)
+        if len(prefixes) < 4096 and rng.random() < 0.05:
+            prefixes.append(stack[:depth // 2])
+
+    ordered = sorted(stacks)
+    rng.shuffle(ordered)
+    weights = [1.0 / (rank + 1) for rank in range(len(ordered))]
+    scale = max(0, samples - len(ordered)) / sum(weights)
+    return Counter({s: 1 + int(w * scale) for s, w in zip(ordered, weights)})
+
+
+def best_time(fn, repeat: int):
+    """(fastest seconds, result of the last call) over `repeat` runs."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def count_nodes(folded: Counter[tuple[str, ...]]) -> int:
+    prefixes: set[tuple[str, ...]] = set()
+    for stack in folded:
+        for i in range(1, len(stack) + 1):
+            prefixes.add(stack[:i])
+    return len(prefixes)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--samples", type=int, default=1_000_000)
+    ap.add_argument("--unique", type=int, default=100_000)
+    ap.add_argument("--depth", type=int, default=20_000,
+                    help="frames in the deep-stack run (default 20000)")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    if min(args.samples, args.unique, args.depth, args.repeat) <= 0:
+        print("bench_flamegraph.py: sizes and --repeat must be positive", file=sys.stderr)
+        return 2
+
+    print(
+        f"{'samples':>10} {'unique':>8} {'nodes':>9} {'visible':>8} "
+        f"{'build ms':>9} {'layout ms':>10} {'render ms':>10} {'us/visible':>11}"
+    )
+    print("-" * 82)
+    for step in STEPS:
+        samples = max(1, int(args.samples * step))
+        unique = max(1, int(args.unique * step))
+        folded = synthetic_folded(samples, unique, args.seed)
+        t_build, root = best_time(lambda: build_tree(folded), args.repeat)
+        px_per_sample = (SVG_WIDTH - 2 * SVG_PAD_X) / root.count
+        t_layout, frames = best_time(lambda: layout(root, px_per_sample), args.repeat)
+        t_render, _ = best_time(lambda: render_svg(root), args.repeat)
+        print(
+            f"{root.count:>10,} {len(folded):>8,} {count_nodes(folded):>9,} {len(frames):>8,} "
+            f"{t_build * 1e3:>9.1f} {t_layout * 1e3:>10.2f} {t_render * 1e3:>10.2f} "
+            f"{t_render * 1e6 / max(1, len(frames)):>11.2f}"
+        )
+
+    deep = Counter({tuple(f"frame_{i}" for i in range(args.depth)): 1})
+    t_deep, svg = best_time(lambda: render_svg(build_tree(deep)), args.repeat)
+    print()
+    print(
+        f"deep stack: {args.depth:,} frames (recursion limit {sys.getrecursionlimit()}) "
+        f"rendered in {t_deep * 1e3:.1f} ms, {svg.count('<rect') - 1:,} frames drawn"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
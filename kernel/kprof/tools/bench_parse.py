@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Micro-benchmark for parse_kprof's `[KPROF] rec` decoders.
+
+Times the generic `KV_RE` decoder (`decode_rec_kv`) against the
+fixed-layout fast path (`decode_rec`) over every `rec` line in the
+given captures, then times a full `parse_sessions` pass over each
+file. Reports lines per second so a change to either decoder can be
+checked against the committed serial captures.
+
+Usage:
+  bench_parse.py                      # baselines/shm_cycle_trace*.log
+  bench_parse.py cap1.log cap2.log    # explicit captures
+  bench_parse.py --repeat 10 ...      # more passes, steadier numbers
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+
+from parse_kprof import KPROF_PREFIX, decode_rec, decode_rec_kv, open_capture, parse_sessions
+
+ZAG_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+DEFAULT_GLOB = os.path.join(ZAG_ROOT, "baselines", "shm_cycle_trace*.log")
+
+REC_PREFIX = KPROF_PREFIX + " rec "
+
+
+def rec_bodies(text: str) -> list[str]:
+    out: list[str] = []
+    for line in text.splitlines():
+        idx = line.find(REC_PREFIX)
+        if idx != -1:
+            out.append(line[idx + len(REC_PREFIX):].strip())
+    return out
+
+
+def best_rate(fn, n_items: int, repeat: int) -> float:
+    """Items per second of the fastest of `repeat` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return n_items / best if best > 0 else float("inf")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("captures", nargs="*")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    paths = args.captures or sorted(glob.glob(DEFAULT_GLOB))
+    if not paths:
+        print(f"bench_parse.py: no captures match {DEFAULT_GLOB}", file=sys.stderr)
+        return 2
+
+    texts = []
+    for path in paths:
+        with open_capture(path) as fh:
+            texts.append((path, fh.read()))
+
+    bodies = [b for _, text in texts for b in rec_bodies(text)]
+    if not bodies:
+        print("bench_parse.py: no [KPROF] rec lines in input", file=sys.stderr)
+        return 2
+
+    def run_generic() -> None:
+        for b in bodies:
+            decode_rec_kv(b)
+
+    def run_fast() -> None:
+        for b in bodies:
+            decode_rec(b)
+
+    generic = best_rate(run_generic, len(bodies), args.repeat)
+    fast = best_rate(run_fast, len(bodies), args.repeat)
+    print(f"rec lines: {len(bodies)} from {len(paths)} capture(s)")
+    print(f"{'decoder':<24} {'lines/s':>14} {'speedup':>8}")
+    print("-" * 48)
+    print(f"{'generic (KV_RE)':<24} {generic:>14,.0f} {1.0:>7.2f}x")
+    print(f"{'fixed-layout fast path':<24} {fast:>14,.0f} {fast / generic:>7.2f}x")
+
+    print()
+    print(f"{'capture':<40} {'lines':>8} {'parse lines/s':>14}")
+    print("-" * 64)
+    for path, text in texts:
+        n_lines = text.count("\n") + 1
+
+        def run_parse() -> None:
+            parse_sessions(io.StringIO(text))
+
+        rate = best_rate(run_parse, n_lines, args.repeat)
+        print(f"{os.path.basename(path):<40} {n_lines:>8} {rate:>14,.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
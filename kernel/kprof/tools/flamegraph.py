@@ -6,6 +6,8 @@ path or stdin and emits a self-contained flame graph SVG on stdout.
 The kernel has already resolved each `ip` to a symbol via its own
 DWARF (post-KASLR) before printing, so this script never touches
 kernel.elf — it just parses names out of the `sym=...` field.
+Records without one (binary-framed dumps carry none) are named by
+their address, `0x...`.
 
 Record grouping, per CPU, in emission order:
 
@@ -23,31 +25,79 @@ samples reaching that frame.
 Usage:
   parse-dump-from-file:   flamegraph.py dump.log > flame.svg
   parse-dump-from-stdin:  ./run.sh | flamegraph.py - > flame.svg
+  line-level leaves:      flamegraph.py --lines kernel.db dump.log > flame.svg
+  differential:           flamegraph.py --diff base.log new.log > diff.svg
+  interactive page:       flamegraph.py --html dump.log > flame.html
+  fold once, keep:        flamegraph.py --emit-folded dump.log > dump.folded
+  combine nightlies:      flamegraph.py -j 8 --folded 'nightly/*.folded' > month.svg
+  one graph per CPU:      flamegraph.py --per-cpu dump.log > cpus.svg
+  stacks over time:       flamegraph.py --chart dump.log > chart.svg
+
+`--diff base.log new.log` folds both captures, scales the base to the
+new capture's sample total and colors each frame of the new graph by
+its change: red for more samples, blue for fewer. Hover titles carry
+both raw counts; `--diff-top K` also prints the K biggest per-function
+deltas on stderr.
+
+Several inputs (or quoted globs) are folded in up to `--jobs`
+processes and their folded counters merged into one graph.
+`--emit-folded` writes the merged counters as `root;...;leaf count`
+lines — the `flamegraph.pl` folded format — instead of drawing, and
+`--folded` reads such files back (compressed or not) in place of
+captures, so runs can be folded once and combined later.
+
+`--html` writes a self-contained page instead of the SVG: click a
+frame to zoom into it, Escape or Reset to zoom out, and a regex search
+box highlights matching frames and reports the share of samples they
+cover. Frames down to `HTML_MIN_PX` are embedded as a name table plus
+integer arrays and drawn on a canvas, so labels appear as zooming
+makes room for them. Combines with `--diff`.
+
+Each stack keeps the CPU and tsc of its leaf sample. `--per-cpu`
+draws one flame graph per CPU side by side, each scaled to that CPU's
+samples, so one core pinned in a handler stands apart from load
+spread over all of them; with `--emit-folded` every stack is rooted at
+a `cpuN` frame, and `--per-cpu --folded` reads those back. `--chart`
+draws a flame chart of one capture instead: tsc on the x axis and a
+lane per CPU in which each sample's stack runs until the next sample
+(capped at `CHART_MAX_SPAN` sampling periods), with identical frames of
+consecutive samples merged, so bursts and idle stretches show in time.
+The axis is in milliseconds when the capture carries `tsc_hz=`.
+
+`--lines` takes the `tools/indexer` database of the sampled kernel,
+infers the KASLR slide from the samples' `sym=` names and stacks a
+`file:line` frame on every leaf (see `kprof_lines.py`).
+
+Captures may be gzip/xz/bzip2 compressed, on disk or on stdin. Lines
+are parsed by the `kprof` package (`parse_kprof`), so a capture file
+shares its `<path>.kpcache` sidecar with `parse_kprof.py` runs over it.
 """
 
 from __future__ import annotations
 
+import argparse
+import glob
+import json
+import os
 import re
+import statistics
 import sys
 from collections import Counter, defaultdict
 from dataclasses import dataclass, field
-from typing import IO, Iterable
-
-
-KPROF_PREFIX = "[KPROF] "
-REC_RE = re.compile(
-    r"^\[KPROF\] rec "
-    r"cpu=(?P<cpu>\d+) "
-    r"tsc=(?P<tsc>\d+) "
-    r"kind=(?P<kind>\d+) "
-    r"id=(?P<id>\d+) "
-    r"ip=0x(?P<ip>[0-9a-fA-F]+) "
-    r"arg=0x(?P<arg>[0-9a-fA-F]+) "
-    r"sym=(?P<sym>\S+)\s*$"
-)
+from typing import IO, Any, Callable, Iterable
 
-KIND_SAMPLE = 4
-KIND_SAMPLE_FRAME = 5
+from kprof import (
+    KIND_SAMPLE,
+    KIND_SAMPLE_FRAME,
+    Record,
+    Session,
+    all_records,
+    header_tsc_hz,
+    load_capture,
+    open_capture,
+    parse_sessions,
+    scan,
+)
 
 
 # ── Parse ────────────────────────────────────────────────────────────
@@ -58,70 +108,136 @@ class InFlight:
     any kind=5 frames with strictly increasing arg depth."""
     frames: list[str] = field(default_factory=list)  # idx 0 = leaf, last = deepest caller
     last_depth: int = 0                              # 0 = leaf, 1 = first caller, ...
+    tsc: int = 0                                     # of the kind=4 leaf record
+
 
+class StackFolder:
+    """Incremental stack assembler. `add` takes records one at a time
+    in emission order; completed stacks, each [leaf, caller1,
+    caller2, ...], collect in `stacks`, and the `(cpu, tsc)` of each
+    one's leaf sample at the same index in `origins`. Also a
+    `parse_kprof` record sink (`feed`/`finish`), so stdin can be
+    folded as it streams.
 
-def parse_stacks(stream: IO[str]) -> list[list[str]]:
-    """Return a list of stacks. Each stack is [leaf, caller1, caller2, ...].
+    With `lines` (a `kprof_lines.LineIndex` whose slide is set), each
+    stack gains a `file:line` frame above its leaf, so the top row of
+    the graph splits every sampled function by source line.
 
-    We key in-flight assembly by CPU so interleaved per-CPU dump
+    In-flight assembly is keyed by CPU so interleaved per-CPU dump
     sections don't contaminate each other (dump order is per-CPU
     contiguous today, but tsc still matters within a CPU)."""
-    per_cpu: dict[int, InFlight] = defaultdict(InFlight)
-    done: list[list[str]] = []
 
-    def flush(cpu: int) -> None:
-        buf = per_cpu.get(cpu)
-        if buf is not None and buf.frames:
-            done.append(buf.frames)
-        per_cpu[cpu] = InFlight()
+    def __init__(self, lines: Any = None) -> None:
+        self.stacks: list[list[str]] = []
+        self.origins: list[tuple[int, int]] = []
+        self.lines = lines
+        self._per_cpu: dict[int, InFlight] = defaultdict(InFlight)
 
-    for line in stream:
-        if not line.startswith(KPROF_PREFIX):
-            continue
-        m = REC_RE.match(line.rstrip("\r\n"))
-        if m is None:
-            continue
+    def _flush(self, cpu: int) -> None:
+        buf = self._per_cpu.get(cpu)
+        if buf is not None and buf.frames:
+            self.stacks.append(buf.frames)
+            self.origins.append((cpu, buf.tsc))
+        self._per_cpu[cpu] = InFlight()
 
-        cpu = int(m.group("cpu"))
-        kind = int(m.group("kind"))
-        arg = int(m.group("arg"), 16)
-        sym = m.group("sym")
+    def add(self, rec: Record) -> None:
+        # Binary-framed captures carry no `sym=`; name those frames by
+        # address, as `parse_kprof.py --sample` does.
+        name = rec.sym or f"0x{rec.ip:x}"
+        cpu = rec.cpu
+        kind = rec.kind
+        arg = rec.arg
 
         if kind == KIND_SAMPLE:
             # Start of a new stack. Flush anything in flight first.
-            flush(cpu)
-            per_cpu[cpu].frames = [sym]
-            per_cpu[cpu].last_depth = 0
+            self._flush(cpu)
+            buf = self._per_cpu[cpu]
+            buf.frames = [name]
+            buf.last_depth = 0
+            buf.tsc = rec.tsc
+            if self.lines is not None:
+                buf.frames.insert(0, self.lines.line(rec.ip) or f"0x{rec.ip:x}")
         elif kind == KIND_SAMPLE_FRAME:
-            buf = per_cpu[cpu]
+            buf = self._per_cpu[cpu]
             # Skip frames that aren't a direct continuation (arg must
             # strictly increase by one; a non-monotonic arg means the
             # emitter moved on without a new kind=4, which shouldn't
             # happen today — drop defensively).
             if not buf.frames or arg != buf.last_depth + 1:
-                continue
-            buf.frames.append(sym)
+                return
+            buf.frames.append(name)
             buf.last_depth = arg
         else:
             # Not a sample record — terminate any in-flight stack.
-            flush(cpu)
+            self._flush(cpu)
+
+    def feed(self, session: Session, rec: Record) -> None:
+        self.add(rec)
 
-    for cpu in list(per_cpu.keys()):
-        flush(cpu)
+    def finish(self, sessions: list[Session] | None = None) -> list[list[str]]:
+        """Flush every stack still in flight and return `stacks`."""
+        for cpu in list(self._per_cpu.keys()):
+            self._flush(cpu)
+        return self.stacks
 
-    return done
+
+def parse_stacks(records: Iterable[Record], lines: Any = None) -> list[list[str]]:
+    """Return a list of stacks. Each stack is [leaf, caller1, caller2, ...]."""
+    folder = StackFolder(lines)
+    for rec in records:
+        folder.add(rec)
+    return folder.finish()
 
 
 # ── Fold ─────────────────────────────────────────────────────────────
 
-def fold(stacks: list[list[str]]) -> Counter[tuple[str, ...]]:
+# Root frame of each CPU's subtree in a per-CPU fold.
+CPU_FRAME = "cpu{}"
+CPU_FRAME_RE = re.compile(r"cpu(\d+)")
+
+def fold(
+    stacks: list[list[str]], origins: list[tuple[int, int]] | None = None,
+) -> Counter[tuple[str, ...]]:
     """Each stack is [leaf, caller1, caller2, ...]. We fold on the
     tuple (deepest_caller, ..., caller1, leaf) so the "root" of the
     flame graph is the outermost stack frame — standard orientation
-    used by Brendan Gregg's flamegraph.pl."""
+    used by Brendan Gregg's flamegraph.pl.
+
+    With `origins` (`StackFolder.origins`), every stack is rooted at a
+    `cpuN` frame for the CPU it was sampled on, so each CPU folds into
+    its own subtree (see `cpu_trees`)."""
+    folded: Counter[tuple[str, ...]] = Counter()
+    if origins is None:
+        for s in stacks:
+            folded[tuple(reversed(s))] += 1
+        return folded
+    for s, (cpu, _) in zip(stacks, origins):
+        folded[(CPU_FRAME.format(cpu), *reversed(s))] += 1
+    return folded
+
+
+def write_folded(folded: Counter[tuple[str, ...]], out: IO[str]) -> None:
+    """Folded stacks in the `flamegraph.pl` / `stackcollapse` text form,
+    one `root;caller;...;leaf count` line per stack, sorted."""
+    for stack, count in sorted(folded.items()):
+        out.write(f"{';'.join(stack)} {count}\n")
+
+
+def read_folded(path: str) -> Counter[tuple[str, ...]]:
+    """Inverse of `write_folded`, from a file (possibly compressed) or
+    `-` for stdin. Malformed lines are skipped with a warning."""
     folded: Counter[tuple[str, ...]] = Counter()
-    for s in stacks:
-        folded[tuple(reversed(s))] += 1
+    with open_capture(path) as fh:
+        for lineno, line in enumerate(fh, 1):
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            stack, _, count = line.rpartition(" ")
+            if not stack or not count.isdigit():
+                print(f"flamegraph.py: {path}:{lineno}: not a folded stack line, skipping",
+                      file=sys.stderr)
+                continue
+            folded[tuple(stack.split(";"))] += int(count)
     return folded
 
 
@@ -132,6 +248,7 @@ class Node:
     name: str
     count: int = 0
     children: dict[str, "Node"] = field(default_factory=dict)
+    base: int = 0  # --diff: samples reaching this frame in the base capture
 
 
 def build_tree(folded: Counter[tuple[str, ...]]) -> Node:
@@ -149,6 +266,33 @@ def build_tree(folded: Counter[tuple[str, ...]]) -> Node:
     return root
 
 
+def add_base(root: Node, base: Counter[tuple[str, ...]]) -> None:
+    """Record the base capture's counts on the frames of `root` (built
+    from the new capture). Base-only paths have no frame to land on;
+    they show up in `frame_deltas` instead."""
+    for stack, count in base.items():
+        root.base += count
+        cur = root
+        for name in stack:
+            cur = cur.children.get(name)
+            if cur is None:
+                break
+            cur.base += count
+
+
+def cpu_trees(root: Node) -> list[tuple[int, Node]]:
+    """`(cpu, subtree)` for each CPU of a tree built from a per-CPU
+    fold, in CPU order. A root frame that is not `cpuN` (folded input
+    written without `--per-cpu`) raises ValueError."""
+    trees: list[tuple[int, Node]] = []
+    for name, child in root.children.items():
+        m = CPU_FRAME_RE.fullmatch(name)
+        if m is None:
+            raise ValueError(f"stack root {name!r} is not a per-CPU frame")
+        trees.append((int(m.group(1)), child))
+    return sorted(trees, key=lambda t: t[0])
+
+
 # ── Render ───────────────────────────────────────────────────────────
 
 # Layout constants. These are deliberately close to flamegraph.pl's
@@ -184,105 +328,809 @@ def escape_xml(s: str) -> str:
     )
 
 
-def render_svg(root: Node) -> str:
-    if root.count == 0:
-        return "<!-- no samples -->\n"
+@dataclass
+class Frame:
+    """One drawn rectangle: `x` and `w` in pixels from the left of the
+    plot, `depth` 0 for the outermost caller."""
+    name: str
+    count: int
+    x: float
+    w: float
+    depth: int
+    base: int = 0
 
-    plot_w = SVG_WIDTH - 2 * SVG_PAD_X
-    total = root.count
-    px_per_sample = plot_w / total
 
-    # Figure out depth so we can size the SVG. Depth of the tree is
-    # the length of the longest stack.
-    def depth_of(n: Node) -> int:
-        if not n.children:
-            return 1
-        return 1 + max(depth_of(c) for c in n.children.values())
+def layout(root: Node, px_per_sample: float, min_px: float = MIN_RENDER_PX) -> list[Frame]:
+    """Visible frames of the tree under `root`, in drawing order
+    (depth-first, children sorted by name). Iterative, so stack depth
+    is not bounded by the recursion limit. A child's width never
+    exceeds its parent's, so a frame narrower than `min_px` hides its
+    whole subtree and is not descended into: the cost is linear in
+    the visible frames plus their direct children."""
+    frames: list[Frame] = []
+    # Frames still to be emitted, with their nodes; popped in pre-order.
+    todo: list[tuple[Frame, Node]] = []
 
-    max_depth = depth_of(root) - 1  # exclude synthetic <root>
-    svg_h = SVG_PAD_TOP + max_depth * FRAME_HEIGHT + 40
+    def push_children(node: Node, x_px: float, depth: int) -> None:
+        visible: list[tuple[Frame, Node]] = []
+        for name, child in sorted(node.children.items()):
+            w = child.count * px_per_sample
+            if w >= min_px:
+                visible.append((Frame(name, child.count, x_px, w, depth, child.base), child))
+            x_px += w
+        todo.extend(reversed(visible))
 
-    out: list[str] = []
+    push_children(root, 0.0, 0)
+    while todo:
+        frame, node = todo.pop()
+        frames.append(frame)
+        push_children(node, frame.x, frame.depth + 1)
+    return frames
+
+
+def _svg_open(out: list[str], height: int, heading: str) -> None:
     out.append(
         f'<svg version="1.1" xmlns="http://www.w3.org/2000/svg" '
-        f'width="{SVG_WIDTH}" height="{svg_h}" '
-        f'viewBox="0 0 {SVG_WIDTH} {svg_h}" '
+        f'width="{SVG_WIDTH}" height="{height}" '
+        f'viewBox="0 0 {SVG_WIDTH} {height}" '
         f'font-family="Verdana, sans-serif" font-size="{FONT_SIZE}">'
     )
     out.append(
-        f'<rect x="0" y="0" width="{SVG_WIDTH}" height="{svg_h}" fill="#eeeeec"/>'
+        f'<rect x="0" y="0" width="{SVG_WIDTH}" height="{height}" fill="#eeeeec"/>'
     )
     out.append(
         f'<text x="{SVG_WIDTH // 2}" y="24" text-anchor="middle" '
-        f'font-size="16" font-weight="bold">Kprof flame graph '
-        f'({total} samples)</text>'
+        f'font-size="16" font-weight="bold">{escape_xml(heading)}</text>'
+    )
+
+
+def _svg_box(out: list[str], name: str, x: float, y: int, w: float, color: str, hover: str) -> None:
+    """One frame rectangle at absolute `x`, `y`, labelled with `name`
+    when it is wide enough."""
+    out.append(
+        f'<g><title>{escape_xml(hover)}</title>'
+        f'<rect x="{x:.2f}" y="{y}" '
+        f'width="{w:.2f}" height="{FRAME_HEIGHT - 1}" '
+        f'fill="{color}" stroke="#00000022" stroke-width="0.5"/>'
     )
+    # Text fits only when the frame is wide enough.
+    if w >= 40:
+        text_x = x + 3
+        text_y = y + FRAME_HEIGHT - 4
+        label = name
+        # rough per-char budget at FONT_SIZE=12
+        max_chars = max(1, int((w - 6) / 6))
+        if len(label) > max_chars:
+            label = label[: max_chars - 1] + "…"
+        out.append(
+            f'<text x="{text_x:.2f}" y="{text_y}" '
+            f'fill="#000">{escape_xml(label)}</text>'
+        )
+    out.append('</g>')
+
+
+def render_svg(
+    root: Node,
+    heading: str | None = None,
+    fill: Callable[[Frame], str] | None = None,
+    title: Callable[[Frame], str] | None = None,
+) -> str:
+    """Flame graph SVG of `root`. `fill` and `title` override each
+    frame's color (default `palette` of its name) and hover text."""
+    if root.count == 0:
+        return "<!-- no samples -->\n"
+
+    plot_w = SVG_WIDTH - 2 * SVG_PAD_X
+    total = root.count
+    px_per_sample = plot_w / total
+    frames = layout(root, px_per_sample)
+
+    # Size the SVG to the deepest frame that is actually drawn.
+    max_depth = max((f.depth for f in frames), default=-1) + 1
+    svg_h = SVG_PAD_TOP + max_depth * FRAME_HEIGHT + 40
+
+    out: list[str] = []
+    _svg_open(out, svg_h, heading or f"Kprof flame graph ({total} samples)")
 
     # Classic flame graph layout: outermost caller at the bottom,
-    # leaves at the top. `depth = 0` corresponds to the direct
-    # children of `<root>` (i.e. the outermost caller of any sample).
-    def draw(node: Node, x_px: float, depth: int) -> None:
-        for name, child in sorted(node.children.items()):
-            w = child.count * px_per_sample
-            if w >= MIN_RENDER_PX:
-                y = SVG_PAD_TOP + (max_depth - 1 - depth) * FRAME_HEIGHT
-                fill = palette(name)
-                title = escape_xml(f"{name} — {child.count}/{total} samples")
-                out.append(
-                    f'<g><title>{title}</title>'
-                    f'<rect x="{SVG_PAD_X + x_px:.2f}" y="{y}" '
-                    f'width="{w:.2f}" height="{FRAME_HEIGHT - 1}" '
-                    f'fill="{fill}" stroke="#00000022" stroke-width="0.5"/>'
-                )
-                # Text fits only when the frame is wide enough.
-                if w >= 40:
-                    text_x = SVG_PAD_X + x_px + 3
-                    text_y = y + FRAME_HEIGHT - 4
-                    label = name
-                    # rough per-char budget at FONT_SIZE=12
-                    max_chars = max(1, int((w - 6) / 6))
-                    if len(label) > max_chars:
-                        label = label[: max_chars - 1] + "…"
-                    out.append(
-                        f'<text x="{text_x:.2f}" y="{text_y}" '
-                        f'fill="#000">{escape_xml(label)}</text>'
-                    )
-                out.append('</g>')
-            draw(child, x_px, depth + 1)
-            x_px += w
+    # leaves at the top.
+    for f in frames:
+        y = SVG_PAD_TOP + (max_depth - 1 - f.depth) * FRAME_HEIGHT
+        color = fill(f) if fill is not None else palette(f.name)
+        hover = title(f) if title is not None else f"{f.name} — {f.count}/{total} samples"
+        _svg_box(out, f.name, SVG_PAD_X + f.x, y, f.w, color, hover)
+
+    out.append('</svg>\n')
+    return "\n".join(out)
+
+
+# ── Per-CPU ──────────────────────────────────────────────────────────
+
+PANEL_GAP = 10       # px between per-CPU panels and between chart lanes
+PANEL_LABEL_H = 20   # px of CPU label above each panel or lane
+PANELS_PER_ROW = 8   # more CPUs than this wrap onto further rows
+
+
+def render_per_cpu(trees: list[tuple[int, Node]], heading: str | None = None) -> str:
+    """One flame graph per CPU, side by side. Every panel is scaled to
+    its own CPU's samples, so a function that pins one core fills that
+    panel alone, while load spread over the machine shows up in every
+    panel; the labels give each CPU's share of all samples. Panels
+    share one depth axis so their outermost callers line up."""
+    trees = [(cpu, node) for cpu, node in trees if node.count]
+    if not trees:
+        return "<!-- no samples -->\n"
+
+    total = sum(node.count for _, node in trees)
+    cols = min(len(trees), PANELS_PER_ROW)
+    rows = -(-len(trees) // cols)
+    panel_w = (SVG_WIDTH - 2 * SVG_PAD_X - (cols - 1) * PANEL_GAP) / cols
+    panels = [(cpu, node, layout(node, panel_w / node.count)) for cpu, node in trees]
+    max_depth = max((f.depth for _, _, frames in panels for f in frames), default=-1) + 1
+    row_h = PANEL_LABEL_H + max_depth * FRAME_HEIGHT + PANEL_GAP
+    svg_h = SVG_PAD_TOP + rows * row_h + 30
+
+    out: list[str] = []
+    _svg_open(out, svg_h, heading or (
+        f"Kprof per-CPU flame graphs ({total} samples on {len(trees)} CPUs)"
+    ))
+    for i, (cpu, node, frames) in enumerate(panels):
+        x0 = SVG_PAD_X + (i % cols) * (panel_w + PANEL_GAP)
+        top = SVG_PAD_TOP + (i // cols) * row_h
+        out.append(
+            f'<text x="{x0 + panel_w / 2:.2f}" y="{top + 14}" text-anchor="middle" '
+            f'font-weight="bold">{escape_xml(CPU_FRAME.format(cpu))} — {node.count} samples '
+            f'({100 * node.count / total:.1f}%)</text>'
+        )
+        for f in frames:
+            y = top + PANEL_LABEL_H + (max_depth - 1 - f.depth) * FRAME_HEIGHT
+            hover = f"{f.name} — {f.count}/{node.count} samples on cpu{cpu}"
+            _svg_box(out, f.name, x0 + f.x, y, f.w, palette(f.name), hover)
 
-    draw(root, 0.0, 0)
     out.append('</svg>\n')
     return "\n".join(out)
 
 
+# ── Chart ────────────────────────────────────────────────────────────
+
+# A sample is drawn from its tsc to the next sample on its CPU, but for
+# at most this many median sampling periods, so idle stretches and
+# gaps between dumps stay empty instead of stretching the last stack.
+CHART_MAX_SPAN = 4
+CHART_TICKS = 10  # labelled marks on the tsc axis
+
+
+@dataclass
+class ChartFrame:
+    """One run of consecutive samples on `cpu` that share `name` at
+    `depth` (0 = outermost caller) and every frame below it, over tsc
+    [`start`, `end`)."""
+    name: str
+    cpu: int
+    depth: int
+    start: int
+    end: int
+    samples: int = 1
+
+
+def chart_frames(stacks: list[list[str]], origins: list[tuple[int, int]]) -> list[ChartFrame]:
+    """Flame chart runs of `stacks` (`StackFolder.stacks` and
+    `.origins`): per CPU, samples in tsc order, each frame merged with
+    the same frame of the previous sample while the path below it is
+    unchanged and no gap separates the two."""
+    by_cpu: dict[int, list[tuple[int, tuple[str, ...]]]] = defaultdict(list)
+    for stack, (cpu, tsc) in zip(stacks, origins):
+        by_cpu[cpu].append((tsc, tuple(reversed(stack))))
+    gaps: list[int] = []
+    for samples in by_cpu.values():
+        samples.sort(key=lambda s: s[0])
+        gaps.extend(b[0] - a[0] for a, b in zip(samples, samples[1:]) if b[0] > a[0])
+    period = int(statistics.median(gaps)) if gaps else 1
+    max_span = CHART_MAX_SPAN * period
+
+    runs: list[ChartFrame] = []
+    for cpu in sorted(by_cpu):
+        samples = by_cpu[cpu]
+        open_runs: list[ChartFrame] = []  # one per depth, outermost first
+        for i, (tsc, stack) in enumerate(samples):
+            nxt = samples[i + 1][0] if i + 1 < len(samples) else tsc + period
+            end = min(nxt, tsc + max_span)
+            keep = 0
+            if open_runs and open_runs[0].end == tsc:
+                while (keep < len(open_runs) and keep < len(stack)
+                       and open_runs[keep].name == stack[keep]):
+                    keep += 1
+            runs.extend(open_runs[keep:])
+            del open_runs[keep:]
+            for run in open_runs:
+                run.end = end
+                run.samples += 1
+            open_runs.extend(
+                ChartFrame(name, cpu, depth, tsc, end)
+                for depth, name in enumerate(stack[keep:], keep)
+            )
+        runs.extend(open_runs)
+    return runs
+
+
+def tsc_span(ticks: float, tsc_hz: int = 0) -> str:
+    """`ticks` of TSC as milliseconds when the rate is known."""
+    if tsc_hz:
+        return f"{ticks / tsc_hz * 1e3:.3f} ms"
+    return f"{ticks:,.0f} tsc"
+
+
+def render_chart(runs: list[ChartFrame], heading: str | None = None, tsc_hz: int = 0) -> str:
+    """Flame chart SVG of `runs` (see `chart_frames`): tsc on the x
+    axis, one lane per CPU with its outermost callers on top, so each
+    CPU's stack sequence reads left to right and bursts show up as
+    columns of activity between empty stretches."""
+    if not runs:
+        return "<!-- no samples -->\n"
+
+    plot_w = SVG_WIDTH - 2 * SVG_PAD_X
+    t0 = min(r.start for r in runs)
+    t1 = max(r.end for r in runs)
+    px_per_tsc = plot_w / max(1, t1 - t0)
+    visible = [r for r in runs if (r.end - r.start) * px_per_tsc >= MIN_RENDER_PX]
+
+    samples: Counter[int] = Counter()
+    depth: dict[int, int] = {}
+    for r in runs:
+        if r.depth == 0:
+            samples[r.cpu] += r.samples
+        depth.setdefault(r.cpu, 0)
+    for r in visible:
+        depth[r.cpu] = max(depth[r.cpu], r.depth + 1)
+    tops: dict[int, int] = {}
+    y = SVG_PAD_TOP
+    for cpu in sorted(depth):
+        tops[cpu] = y
+        y += PANEL_LABEL_H + depth[cpu] * FRAME_HEIGHT + PANEL_GAP
+    axis_y = y
+    svg_h = axis_y + 30
+
+    out: list[str] = []
+    _svg_open(out, svg_h, heading or (
+        f"Kprof flame chart ({samples.total()} samples on {len(depth)} CPUs "
+        f"over {tsc_span(t1 - t0, tsc_hz)})"
+    ))
+    for cpu, top in tops.items():
+        out.append(
+            f'<text x="{SVG_PAD_X}" y="{top + 14}" font-weight="bold">'
+            f'{escape_xml(CPU_FRAME.format(cpu))} — {samples[cpu]} samples</text>'
+        )
+    for r in visible:
+        x = SVG_PAD_X + (r.start - t0) * px_per_tsc
+        y = tops[r.cpu] + PANEL_LABEL_H + r.depth * FRAME_HEIGHT
+        hover = (f"{r.name} — cpu{r.cpu}, {r.samples} samples, "
+                 f"{tsc_span(r.end - r.start, tsc_hz)} at +{tsc_span(r.start - t0, tsc_hz)}")
+        _svg_box(out, r.name, x, y, (r.end - r.start) * px_per_tsc, palette(r.name), hover)
+
+    out.append(
+        f'<line x1="{SVG_PAD_X}" y1="{axis_y}" x2="{SVG_PAD_X + plot_w}" y2="{axis_y}" '
+        f'stroke="#555" stroke-width="1"/>'
+    )
+    for k in range(CHART_TICKS + 1):
+        x = SVG_PAD_X + plot_w * k / CHART_TICKS
+        anchor = "start" if k == 0 else "end" if k == CHART_TICKS else "middle"
+        out.append(
+            f'<line x1="{x:.2f}" y1="{axis_y}" x2="{x:.2f}" y2="{axis_y + 5}" stroke="#555"/>'
+            f'<text x="{x:.2f}" y="{axis_y + 18}" text-anchor="{anchor}">'
+            f'+{tsc_span((t1 - t0) * k / CHART_TICKS, tsc_hz)}</text>'
+        )
+
+    out.append('</svg>\n')
+    return "\n".join(out)
+
+
+# ── Diff ─────────────────────────────────────────────────────────────
+
+# Relative change at which a --diff frame reaches full color.
+DIFF_SATURATE = 1.0
+
+
+def diff_fill(scale: float) -> Callable[[Frame], str]:
+    """Frame color for `--diff`: red where the new capture has more
+    samples than the base (scaled by `scale` to equal totals), blue
+    where it has fewer, fading to white for no change."""
+    def fill(f: Frame) -> str:
+        base = f.base * scale
+        change = (f.count - base) / max(f.count, base, 1)
+        hue = 0 if change >= 0 else 220
+        lit = 100 - round(50 * min(1.0, abs(change) / DIFF_SATURATE))
+        return f"hsl({hue},80%,{lit}%)"
+    return fill
+
+
+def diff_title(scale: float) -> Callable[[Frame], str]:
+    def title(f: Frame) -> str:
+        base = f.base * scale
+        change = f"{(f.count - base) * 100.0 / base:+.1f}% normalized" if base else "new"
+        return f"{f.name} — base {f.base} → new {f.count} samples ({change})"
+    return title
+
+
+@dataclass
+class FrameDelta:
+    """Per-function sample counts of a `--diff`, base side scaled to
+    the new capture's total. `self` counts leaf samples, `total` each
+    sample with the function anywhere on its stack once."""
+    name: str
+    base_self: float = 0.0
+    new_self: int = 0
+    base_total: float = 0.0
+    new_total: int = 0
+
+    @property
+    def self_delta(self) -> float:
+        return self.new_self - self.base_self
+
+    @property
+    def total_delta(self) -> float:
+        return self.new_total - self.base_total
+
+
+def frame_deltas(
+    base: Counter[tuple[str, ...]], new: Counter[tuple[str, ...]], scale: float,
+) -> list[FrameDelta]:
+    """Per-function deltas between two folded captures, biggest
+    self-sample change first, then biggest inclusive change. Functions
+    whose counts did not move are left out."""
+    rows: dict[str, FrameDelta] = {}
+
+    def row(name: str) -> FrameDelta:
+        r = rows.get(name)
+        if r is None:
+            r = rows[name] = FrameDelta(name)
+        return r
+
+    for stack, count in base.items():
+        row(stack[-1]).base_self += count * scale
+        for name in set(stack):
+            row(name).base_total += count * scale
+    for stack, count in new.items():
+        row(stack[-1]).new_self += count
+        for name in set(stack):
+            row(name).new_total += count
+    moved = [r for r in rows.values() if abs(r.self_delta) > 1e-9 or abs(r.total_delta) > 1e-9]
+    return sorted(moved, key=lambda r: (-abs(r.self_delta), -abs(r.total_delta), r.name))
+
+
+def render_delta_table(rows: list[FrameDelta], top: int, out: IO[str]) -> None:
+    rows = rows[:top]
+    width = max([len("function")] + [len(r.name) for r in rows])
+    header = (
+        f"{'function':<{width}} {'base self':>10} {'new self':>9} {'delta':>9} "
+        f"{'base total':>11} {'new total':>10} {'delta':>9}"
+    )
+    print(f"--- top {len(rows)} frame deltas (base normalized to new total) ---", file=out)
+    print(header, file=out)
+    print("-" * len(header), file=out)
+    for r in rows:
+        print(
+            f"{r.name:<{width}} {r.base_self:>10.1f} {r.new_self:>9} {r.self_delta:>+9.1f} "
+            f"{r.base_total:>11.1f} {r.new_total:>10} {r.total_delta:>+9.1f}",
+            file=out,
+        )
+
+
+# ── Interactive ──────────────────────────────────────────────────────
+
+# `--html` embeds every frame at least this wide at full width, so
+# zooming reveals detail the static SVG prunes while the page stays
+# bounded on huge profiles.
+HTML_MIN_PX = 0.01
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>$TITLE</title>
+<style>
+body{margin:0;font:12px Verdana,sans-serif;background:#eeeeec}
+#bar{display:flex;gap:8px;align-items:center;padding:8px 10px}
+#bar h1{font-size:16px;margin:0 auto 0 0}
+#bar input{width:22em}
+#info{padding:0 10px 6px;height:1.4em;white-space:nowrap;overflow:hidden}
+#c{display:block;width:100%}
+</style></head><body>
+<div id="bar"><h1>$TITLE</h1>
+<input id="q" placeholder="search (regex)" spellcheck="false">
+<span id="pct"></span><button id="reset">Reset zoom</button></div>
+<div id="info">Click a frame to zoom, Escape to reset, Ctrl+F to search.</div>
+<canvas id="c"></canvas>
+<script id="kprof-data" type="application/json">$DATA</script>
+<script>
+"use strict";
+const D = JSON.parse(document.getElementById("kprof-data").textContent);
+const N = D.n.length, FH = 16, PAD = 10;
+let maxDepth = 0;
+for (let i = 0; i < N; i++) if (D.d[i] > maxDepth) maxDepth = D.d[i];
+// Frames per depth in x order, for hit testing by binary search.
+const rows = [];
+for (let i = 0; i < N; i++) (rows[D.d[i]] = rows[D.d[i]] || []).push(i);
+
+function palette(name) {
+  let h = 0;
+  for (const ch of name) h = (h * 131 + ch.codePointAt(0)) % 4294967296;
+  return "hsl(" + h % 60 + "," + (55 + Math.floor(h / 256) % 10) + "%," +
+    (45 + Math.floor(h / 65536) % 10) + "%)";
+}
+function diffFill(i) {
+  const base = D.b[i] * D.scale, n = D.w[i];
+  const change = (n - base) / Math.max(n, base, 1);
+  const lit = 100 - Math.round(50 * Math.min(1, Math.abs(change) / D.saturate));
+  return "hsl(" + (change >= 0 ? 0 : 220) + ",80%," + lit + "%)";
+}
+const colors = D.b ? null : D.names.map(palette);
+function title(i) {
+  const name = D.names[D.n[i]], n = D.w[i];
+  if (D.b) {
+    const base = D.b[i] * D.scale;
+    const change = base ? ((n - base) * 100 / base).toFixed(1) + "% normalized" : "new";
+    return name + " \\u2014 base " + D.b[i] + " \\u2192 new " + n + " samples (" +
+      (base && n >= base ? "+" : "") + change + ")";
+  }
+  return name + " \\u2014 " + n + "/" + D.total + " samples (" +
+    (n * 100 / D.total).toFixed(2) + "%)";
+}
+
+const canvas = document.getElementById("c"), ctx = canvas.getContext("2d");
+const info = document.getElementById("info"), q = document.getElementById("q");
+const pct = document.getElementById("pct");
+let z0 = 0, z1 = D.total, zDepth = 0, matched = null, width = 0, height = 0;
+
+function resize() {
+  const r = window.devicePixelRatio || 1;
+  width = canvas.clientWidth;
+  height = (maxDepth + 1) * FH + 2 * PAD;
+  canvas.width = width * r;
+  canvas.height = height * r;
+  canvas.style.height = height + "px";
+  ctx.setTransform(r, 0, 0, r, 0, 0);
+  draw();
+}
+function draw() {
+  const scale = (width - 2 * PAD) / (z1 - z0);
+  ctx.clearRect(0, 0, width, height);
+  ctx.font = "12px Verdana, sans-serif";
+  ctx.textBaseline = "middle";
+  for (let i = 0; i < N; i++) {
+    const x0 = Math.max(D.x[i], z0), x1 = Math.min(D.x[i] + D.w[i], z1);
+    if (x1 <= x0) continue;
+    const w = (x1 - x0) * scale;
+    if (w < 0.2) continue;
+    const x = PAD + (x0 - z0) * scale, y = height - PAD - (D.d[i] + 1) * FH;
+    ctx.fillStyle = matched && matched[i] ? "#e600e6" :
+      colors ? colors[D.n[i]] : diffFill(i);
+    ctx.globalAlpha = D.d[i] < zDepth ? 0.5 : 1;
+    ctx.fillRect(x, y, w - 0.5, FH - 1);
+    ctx.globalAlpha = 1;
+    // Labels are laid out only for frames wide enough to show some.
+    if (w > 24) {
+      let label = D.names[D.n[i]];
+      const room = w - 6;
+      if (ctx.measureText(label).width > room) {
+        let lo = 0, hi = label.length;
+        while (lo < hi) {
+          const mid = (lo + hi + 1) >> 1;
+          if (ctx.measureText(label.slice(0, mid) + "\\u2026").width <= room) lo = mid;
+          else hi = mid - 1;
+        }
+        label = lo ? label.slice(0, lo) + "\\u2026" : "";
+      }
+      if (label) {
+        ctx.fillStyle = "#000";
+        ctx.fillText(label, x + 3, y + FH / 2);
+      }
+    }
+  }
+}
+function frameAt(ev) {
+  const rect = canvas.getBoundingClientRect();
+  const depth = Math.floor((height - PAD - (ev.clientY - rect.top)) / FH);
+  const row = rows[depth];
+  if (!row) return -1;
+  const s = z0 + (ev.clientX - rect.left - PAD) * (z1 - z0) / (width - 2 * PAD);
+  let lo = 0, hi = row.length - 1;
+  while (lo < hi) {
+    const mid = (lo + hi + 1) >> 1;
+    if (D.x[row[mid]] <= s) lo = mid; else hi = mid - 1;
+  }
+  const i = row[lo];
+  return D.x[i] <= s && s < D.x[i] + D.w[i] ? i : -1;
+}
+function zoom(i) {
+  if (i < 0) { z0 = 0; z1 = D.total; zDepth = 0; }
+  else { z0 = D.x[i]; z1 = D.x[i] + D.w[i]; zDepth = D.d[i]; }
+  draw();
+}
+function search() {
+  let re = null;
+  try { re = q.value ? new RegExp(q.value) : null; } catch (e) { pct.textContent = "bad regex"; return; }
+  if (!re) { matched = null; pct.textContent = ""; draw(); return; }
+  const hit = D.names.map(name => re.test(name));
+  matched = new Uint8Array(N);
+  // Matched samples: the union of matched frames' extents, so nested
+  // matches are not counted twice. Frames come in depth-first order.
+  let covered = 0, end = -1;
+  for (let i = 0; i < N; i++) {
+    if (!hit[D.n[i]]) continue;
+    matched[i] = 1;
+    if (D.x[i] >= end) { covered += D.w[i]; end = D.x[i] + D.w[i]; }
+  }
+  pct.textContent = "matched " + (covered * 100 / D.total).toFixed(2) + "%";
+  draw();
+}
+canvas.addEventListener("click", ev => zoom(frameAt(ev)));
+canvas.addEventListener("mousemove", ev => {
+  const i = frameAt(ev);
+  info.textContent = i < 0 ? "" : title(i);
+  canvas.style.cursor = i < 0 ? "default" : "pointer";
+});
+document.getElementById("reset").addEventListener("click", () => zoom(-1));
+q.addEventListener("input", search);
+document.addEventListener("keydown", ev => {
+  if (ev.key === "Escape") { zoom(-1); }
+  else if (ev.key === "f" && (ev.ctrlKey || ev.metaKey)) { ev.preventDefault(); q.focus(); }
+});
+window.addEventListener("resize", resize);
+resize();
+</script></body></html>
+"""
+
+
+def render_html(root: Node, heading: str | None = None, scale: float | None = None) -> str:
+    """Self-contained interactive flame graph: click to zoom, reset,
+    regex search with the share of samples matched, and labels laid
+    out for whatever is wide enough at the current zoom. Frames are
+    embedded as a string table of names plus flat integer arrays
+    (name index, depth, x and width in samples, and with `scale` the
+    `--diff` base counts) and drawn on a canvas."""
+    total = root.count
+    frames = layout(root, 1.0, HTML_MIN_PX * total / (SVG_WIDTH - 2 * SVG_PAD_X))
+    names: dict[str, int] = {}
+    data: dict[str, Any] = {
+        "total": total,
+        "n": [names.setdefault(f.name, len(names)) for f in frames],
+        "d": [f.depth for f in frames],
+        "x": [int(f.x) for f in frames],
+        "w": [f.count for f in frames],
+    }
+    data["names"] = list(names)
+    if scale is not None:
+        data.update(b=[f.base for f in frames], scale=scale, saturate=DIFF_SATURATE)
+    blob = json.dumps(data, separators=(",", ":")).replace("</", "<\\/")
+    heading = heading or f"Kprof flame graph ({total} samples)"
+    return (
+        HTML_TEMPLATE.replace("$TITLE", escape_xml(heading)).replace("$DATA", blob)
+    )
+
+
 # ── CLI ──────────────────────────────────────────────────────────────
 
-def main(argv: list[str]) -> int:
-    if len(argv) != 2:
-        print("usage: flamegraph.py <path|-> > out.svg", file=sys.stderr)
-        return 2
+def capture_folder(path: str, lines: Any = None) -> tuple[StackFolder, list[Session]]:
+    """Stacks of the capture at `path` (`-` for stdin), with
+    `file:line` leaves when `lines` is given, and its sessions."""
+    folder = StackFolder(lines)
+    if lines is None and path == "-":
+        # Nothing to cache: fold while the capture streams in.
+        return folder, scan(path, folder)
 
-    path = argv[1]
     if path == "-":
-        stacks = parse_stacks(sys.stdin)
+        with open_capture(path) as fh:
+            sessions = parse_sessions(fh)
     else:
-        with open(path, "r", encoding="utf-8", errors="replace") as fh:
-            stacks = parse_stacks(fh)
+        sessions = load_capture(path)
+    if lines is not None:
+        # The slide is inferred from every sample before folding, so
+        # the capture is read whole even from stdin.
+        slide = lines.infer_slide(
+            (r.ip, r.sym) for r in all_records(sessions)
+            if r.sym and r.kind in (KIND_SAMPLE, KIND_SAMPLE_FRAME)
+        )
+        if slide is None:
+            print(f"flamegraph.py: {path}: no sample symbol matches the indexer database; "
+                  "assuming KASLR slide 0", file=sys.stderr)
+        lines.slide = slide.slide if slide is not None else 0
+    for rec in all_records(sessions):
+        folder.add(rec)
+    folder.finish()
+    return folder, sessions
+
+
+def capture_stacks(path: str, lines: Any = None) -> list[list[str]]:
+    """Sample stacks of the capture at `path` (`-` for stdin), with
+    `file:line` leaves when `lines` is given."""
+    return capture_folder(path, lines)[0].stacks
+
+
+_worker_lines: dict[str, Any] = {}
+
 
-    if not stacks:
+def _fold_capture(task: tuple[str, str | None, bool, bool]) -> Counter[tuple[str, ...]]:
+    path, lines_db, folded_input, per_cpu = task
+    if folded_input:
+        return read_folded(path)
+    lines = None
+    if lines_db is not None:
+        # One index per worker process, reused across its captures.
+        import kprof_lines
+
+        lines = _worker_lines.get(lines_db)
+        if lines is None:
+            lines = _worker_lines[lines_db] = kprof_lines.LineIndex(lines_db)
+    folder, _ = capture_folder(path, lines)
+    return fold(folder.stacks, folder.origins if per_cpu else None)
+
+
+def fold_inputs(
+    paths: list[str],
+    jobs: int = 1,
+    lines_db: str | None = None,
+    folded_input: bool = False,
+    per_cpu: bool = False,
+) -> Counter[tuple[str, ...]]:
+    """Merged folded stacks of every capture (or, with `folded_input`,
+    every folded file) in `paths`, parsed in up to `jobs` processes.
+    `per_cpu` roots each capture's stacks at their `cpuN` frame."""
+    tasks = [(path, lines_db, folded_input, per_cpu) for path in paths]
+    merged: Counter[tuple[str, ...]] = Counter()
+    if jobs <= 1 or len(tasks) == 1:
+        for task in tasks:
+            merged.update(_fold_capture(task))
+        return merged
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Workers don't share our stdin; fold `-` here.
+    pooled = [task for task in tasks if task[0] != "-"]
+    for task in tasks:
+        if task[0] == "-":
+            merged.update(_fold_capture(task))
+    if not pooled:
+        return merged
+    with ProcessPoolExecutor(max_workers=min(jobs, len(pooled))) as pool:
+        for folded in pool.map(_fold_capture, pooled):
+            merged.update(folded)
+    return merged
+
+
+def expand_paths(patterns: list[str]) -> list[str]:
+    """Paths named by `patterns`, expanding any that is not an existing
+    file as a glob. A pattern matching nothing is an error."""
+    paths: list[str] = []
+    for pattern in patterns:
+        if pattern == "-" or os.path.exists(pattern):
+            paths.append(pattern)
+            continue
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise FileNotFoundError(f"no such capture: {pattern}")
+        paths.extend(matches)
+    return paths
+
+
+def main(argv: list[str]) -> int:
+    ap = argparse.ArgumentParser(
+        prog="flamegraph.py", description="Render kprof sample captures as a flame graph SVG.",
+    )
+    ap.add_argument("paths", nargs="+", metavar="path",
+                    help="capture file or glob, or - for stdin; several are merged")
+    ap.add_argument("--folded", action="store_true",
+                    help="inputs (and --diff BASE) are folded stacks, as written by "
+                         "--emit-folded, rather than captures")
+    ap.add_argument("--emit-folded", action="store_true",
+                    help="write the merged folded stacks (root;...;leaf count) "
+                         "instead of a graph")
+    ap.add_argument("--jobs", "-j", type=int, default=1, metavar="N",
+                    help="parse up to N inputs in parallel processes")
+    ap.add_argument("--lines", metavar="DB",
+                    help="tools/indexer database of the sampled kernel: add a "
+                         "file:line frame above every leaf (see kprof_lines.py)")
+    ap.add_argument("--diff", metavar="BASE",
+                    help="differential graph: frames of the inputs colored by their "
+                         "change against the BASE capture (or glob), red for more "
+                         "samples, blue for fewer")
+    ap.add_argument("--html", action="store_true",
+                    help="write a self-contained interactive HTML page (zoom, "
+                         "search) instead of a static SVG")
+    ap.add_argument("--diff-top", type=int, metavar="K",
+                    help="with --diff, also print the K biggest per-function sample "
+                         "deltas on stderr")
+    view = ap.add_mutually_exclusive_group()
+    view.add_argument("--per-cpu", action="store_true",
+                      help="one flame graph per CPU, side by side (with --emit-folded, "
+                           "root every stack at a cpuN frame)")
+    view.add_argument("--chart", action="store_true",
+                      help="flame chart of one capture: tsc on the x axis, one lane of "
+                           "stacks in sample order per CPU")
+    args = ap.parse_args(argv[1:])
+    if args.diff_top is not None and (not args.diff or args.diff_top <= 0):
+        ap.error("--diff-top takes a positive count and --diff")
+    if args.jobs < 1:
+        ap.error("--jobs must be positive")
+    if args.emit_folded and (args.diff or args.html):
+        ap.error("--emit-folded takes no --diff or --html")
+    if args.folded and args.lines:
+        ap.error("--lines needs captures, not --folded input")
+    if (args.per_cpu or args.chart) and (args.diff or args.html):
+        ap.error("--per-cpu and --chart take no --diff or --html")
+    if args.chart and (args.folded or args.emit_folded):
+        ap.error("--chart needs a capture's tsc, which folded stacks do not keep")
+    try:
+        paths = expand_paths(args.paths)
+        base_paths = expand_paths([args.diff]) if args.diff else []
+    except FileNotFoundError as exc:
+        ap.error(str(exc))
+    if (paths + base_paths).count("-") > 1:
+        ap.error("only one input can be stdin")
+    if args.chart and len(paths) > 1:
+        # Each capture's tsc counts from its own boot.
+        ap.error("--chart draws a single capture")
+
+    if args.lines:
+        import sqlite3
+
+        import kprof_lines
+
+        try:
+            # Loaded once here; worker processes inherit it.
+            _worker_lines[args.lines] = kprof_lines.LineIndex(args.lines)
+        except (sqlite3.Error, ValueError) as exc:
+            print(f"flamegraph.py: error: --lines {args.lines}: {exc}", file=sys.stderr)
+            return 2
+
+    if args.chart:
+        folder, sessions = capture_folder(paths[0], _worker_lines.get(args.lines))
+        if not folder.stacks:
+            print("no sample stacks found in input", file=sys.stderr)
+            return 1
+        sys.stdout.write(render_chart(
+            chart_frames(folder.stacks, folder.origins), tsc_hz=header_tsc_hz(sessions),
+        ))
+        print(
+            f"flamegraph.py: {len(folder.stacks)} sample stacks, "
+            f"{len(fold(folder.stacks))} unique, on {len({c for c, _ in folder.origins})} CPUs",
+            file=sys.stderr,
+        )
+        return 0
+
+    base = fold_inputs(base_paths, args.jobs, args.lines, args.folded) if base_paths else None
+    folded = fold_inputs(paths, args.jobs, args.lines, args.folded, args.per_cpu)
+    if not folded or base is not None and not base:
         print("no sample stacks found in input", file=sys.stderr)
         return 1
 
-    folded = fold(stacks)
     tree = build_tree(folded)
-    sys.stdout.write(render_svg(tree))
+    if args.emit_folded:
+        write_folded(folded, sys.stdout)
+    elif args.per_cpu:
+        try:
+            trees = cpu_trees(tree)
+        except ValueError as exc:
+            print(f"flamegraph.py: error: --per-cpu: {exc}", file=sys.stderr)
+            return 2
+        sys.stdout.write(render_per_cpu(trees))
+    elif base is None:
+        sys.stdout.write(render_html(tree) if args.html else render_svg(tree))
+    else:
+        add_base(tree, base)
+        scale = tree.count / tree.base
+        heading = (f"Kprof differential flame graph (base {tree.base} → new {tree.count} "
+                   "samples; red = more, blue = fewer)")
+        if args.html:
+            sys.stdout.write(render_html(tree, heading, scale))
+        else:
+            sys.stdout.write(render_svg(
+                tree, heading, fill=diff_fill(scale), title=diff_title(scale),
+            ))
+        if args.diff_top:
+            render_delta_table(frame_deltas(base, folded, scale), args.diff_top, sys.stderr)
 
     # Also emit a short per-run summary on stderr so the pipeline
     # isn't totally opaque.
     print(
-        f"flamegraph.py: {len(stacks)} sample stacks, "
-        f"{len(folded)} unique, {tree.count} total samples",
+        f"flamegraph.py: {tree.count} samples, {len(folded)} unique stacks"
+        + (f" from {len(paths)} inputs" if len(paths) > 1 else ""),
         file=sys.stderr,
     )
     return 0
@@ -0,0 +1,103 @@
+"""Importable face of the kprof host tools.
+
+`parse_kprof.py` stays the implementation (and the CLI); this package
+re-exports the pieces other scripts build on, so they can write
+
+    import sys; sys.path.insert(0, "kernel/kprof/tools")
+    import kprof
+
+    for session, rec in kprof.iter_records(kprof.open_capture(path)):
+        ...
+
+or run several consumers over one read of the capture:
+
+    stats = kprof.StreamingScopeStats()
+    folder = kprof.StackFolder()
+    sessions = kprof.scan(path, stats, folder)
+
+`iter_records` is the one lazy reader: it decodes text and binary
+blocks, every record kind including `sample_frame`, and pulls from
+the stream only as far as the caller iterates. `parse_sessions`,
+`load_capture` (with its `.kpcache` sidecar and `--jobs` split) and
+`scan` are built on it. A sink is anything with `feed(session, rec)`
+and `finish(sessions)` (`RecordSink`); `Fanout` combines several.
+`LineIndex` maps sampled ips to source lines and basic blocks through
+a `tools/indexer` database. `flamegraph.py` reads captures through
+this package, so `StackFolder` is bound on first use.
+"""
+
+from parse_kprof import (
+    KIND_NAMES,
+    KIND_SAMPLE,
+    KIND_SAMPLE_FRAME,
+    KIND_TRACE_ENTER,
+    KIND_TRACE_EXIT,
+    KIND_TRACE_POINT,
+    CpuBlock,
+    Fanout,
+    OpenScopes,
+    Record,
+    RecordSink,
+    ScopeStats,
+    Session,
+    SteadyState,
+    StreamingScopeStats,
+    TimelineWriter,
+    all_records,
+    completed_sessions,
+    compute_pooled_scope_stats,
+    header_tsc_hz,
+    iter_records,
+    json_report,
+    load_capture,
+    merged_names,
+    open_capture,
+    parse_sessions,
+    resolve_tsc_clock,
+    scan,
+)
+from kprof_lines import LineIndex, Slide
+
+__all__ = [
+    "KIND_NAMES",
+    "KIND_SAMPLE",
+    "KIND_SAMPLE_FRAME",
+    "KIND_TRACE_ENTER",
+    "KIND_TRACE_EXIT",
+    "KIND_TRACE_POINT",
+    "CpuBlock",
+    "Fanout",
+    "LineIndex",
+    "OpenScopes",
+    "Record",
+    "RecordSink",
+    "ScopeStats",
+    "Session",
+    "Slide",
+    "StackFolder",
+    "SteadyState",
+    "StreamingScopeStats",
+    "TimelineWriter",
+    "all_records",
+    "completed_sessions",
+    "compute_pooled_scope_stats",
+    "header_tsc_hz",
+    "iter_records",
+    "json_report",
+    "load_capture",
+    "merged_names",
+    "open_capture",
+    "parse_sessions",
+    "resolve_tsc_clock",
+    "scan",
+]
+
+
+def __getattr__(name: str):
+    # flamegraph imports this package, so importing it eagerly here
+    # would be circular whichever module is loaded first.
+    if name == "StackFolder":
+        from flamegraph import StackFolder
+
+        return StackFolder
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
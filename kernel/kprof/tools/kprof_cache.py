@@ -0,0 +1,266 @@
+"""Sidecar cache of parsed kprof captures.
+
+`parse_kprof.load_capture` stores the sessions it parses from
+`capture.log` in `capture.log.kpcache` and reuses them on the next
+run, so `--trace`, `--sample`, `--json` and `flamegraph.py` over the
+same file tokenize it only once.
+
+File layout (all integers little-endian):
+
+    magic    b"KPCACHE\\0"
+    u32      length of the JSON header that follows
+    header   {"version", "size", "mtime_ns", "blake2b", "warnings": [...],
+              "sessions": [...]}
+    columns  per session, one packed array per `Record` field
+
+Each session's header entry carries its metadata (cpus, mode,
+reason, tsc_hz, done, names, per-CPU block summaries), its record count and
+the table of symbol strings its `sym` column indexes into; `warnings`
+are the parse warnings, which a cache hit re-issues so the output
+does not depend on whether the cache existed. Columns
+use the widths of `kernel/kprof/record.zig`'s `Record` (u8 cpu/kind,
+u32 id, u64 everything else) and are written in `COLUMNS` order.
+
+A cache is used only if it was written by this `CACHE_VERSION` for a
+capture of the same size, and either the same mtime or — after a
+`touch` or a fresh checkout — the same blake2b content hash. Anything
+else is treated as a miss and overwritten after the capture is
+re-parsed. Bump `CACHE_VERSION` whenever `parse_sessions` would build
+different sessions (or warnings) from the same input.
+
+A capture whose fields do not fit those widths (the text parser takes
+any integer) is parsed as usual but not cached.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from itertools import repeat
+
+import parse_kprof
+from parse_kprof import CpuBlock, Session, _make_record
+
+CACHE_SUFFIX = ".kpcache"
+CACHE_VERSION = 4
+
+MAGIC = b"KPCACHE\0"
+HEADER_LEN = struct.Struct("<I")
+
+# (Record field, array typecode) in on-disk order. `sym` is stored as
+# an index into the session's symbol table.
+COLUMNS = (
+    ("cpu", "B"),
+    ("tsc", "Q"),
+    ("kind", "B"),
+    ("id", "I"),
+    ("ip", "Q"),
+    ("arg", "Q"),
+    ("cycles", "Q"),
+    ("cache_misses", "Q"),
+    ("branch_misses", "Q"),
+    ("sym", "I"),
+)
+
+assert array("I").itemsize == 4 and array("Q").itemsize == 8
+
+_HASH_CHUNK = 1 << 20
+
+
+def cache_path(path: str) -> str:
+    return path + CACHE_SUFFIX
+
+
+def content_hash(path: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _to_disk(arr: array) -> bytes:
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _from_disk(typecode: str, buf: bytes) -> array:
+    arr = array(typecode)
+    arr.frombytes(buf)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+def _encode_session(session: Session) -> tuple[dict, list[bytes]]:
+    recs = session.records
+    sym_index: dict[str, int] = {}
+    for rec in recs:
+        if rec.sym and rec.sym not in sym_index:
+            sym_index[rec.sym] = len(sym_index) + 1
+    syms = [""] + list(sym_index)
+
+    blobs: list[bytes] = []
+    for pos, (name, code) in enumerate(COLUMNS[:-1]):
+        blobs.append(_to_disk(array(code, [rec[pos] for rec in recs])))
+    if len(syms) > 1:
+        blobs.append(_to_disk(array("I", [sym_index.get(rec.sym, 0) for rec in recs])))
+
+    meta = {
+        "cpus": session.cpus,
+        "mode": session.mode,
+        "reason": session.reason,
+        "tsc_hz": session.tsc_hz,
+        "done": session.done,
+        "record_count": session.record_count,
+        "names": [[nid, name] for nid, name in session.names.items()],
+        "cpu_blocks": [
+            [b.cpu, b.declared_records, b.overflowed, b.closed, b.rec_size]
+            for b in session.cpu_blocks.values()
+        ],
+        "records": len(recs),
+        "syms": syms if len(syms) > 1 else [],
+    }
+    return meta, blobs
+
+
+def _decode_session(meta: dict, buf: memoryview, off: int) -> tuple[Session, int]:
+    n = meta["records"]
+    cols: dict[str, array] = {}
+    for name, code in COLUMNS:
+        if name == "sym" and not meta["syms"]:
+            continue
+        width = array(code).itemsize * n
+        cols[name] = _from_disk(code, buf[off:off + width])
+        off += width
+
+    syms = meta["syms"]
+    sym_col = [syms[i] for i in cols["sym"]] if syms else repeat("", n)
+    records = list(map(_make_record, zip(
+        cols["cpu"], cols["tsc"], cols["kind"], cols["id"], cols["ip"], cols["arg"],
+        cols["cycles"], cols["cache_misses"], cols["branch_misses"], sym_col,
+    )))
+    session = Session(
+        cpus=meta["cpus"],
+        mode=meta["mode"],
+        reason=meta["reason"],
+        tsc_hz=meta["tsc_hz"],
+        names={nid: name for nid, name in meta["names"]},
+        records=records,
+        cpu_blocks={
+            cpu: CpuBlock(
+                cpu=cpu, declared_records=declared, overflowed=overflowed,
+                closed=closed, rec_size=rec_size,
+            )
+            for cpu, declared, overflowed, closed, rec_size in meta["cpu_blocks"]
+        },
+        done=meta["done"],
+        record_count=meta["record_count"],
+    )
+    if parse_kprof._columnar is not None:
+        # The numpy backend can take the columns as they are instead
+        # of rebuilding them from `records`.
+        session.columns = parse_kprof._columnar.fields_array(cols, n)
+    return session, off
+
+
+def load(path: str) -> list[Session] | None:
+    """Sessions cached for `path`, or None if there is no valid cache.
+    The warnings of the parse that wrote the cache are re-issued on a
+    hit. A cache whose mtime is stale but whose content hash still
+    matches is refreshed in place."""
+    try:
+        st = os.stat(path)
+        with open(cache_path(path), "rb") as fh:
+            data = fh.read()
+    except OSError:
+        return None
+    if data[:len(MAGIC)] != MAGIC:
+        return None
+    off = len(MAGIC)
+    try:
+        (hlen,) = HEADER_LEN.unpack_from(data, off)
+        off += HEADER_LEN.size
+        header = json.loads(data[off:off + hlen])
+    except (struct.error, ValueError):
+        return None
+    off += hlen
+    if header.get("version") != CACHE_VERSION or header.get("size") != st.st_size:
+        return None
+    stale = header.get("mtime_ns") != st.st_mtime_ns
+    if stale and header.get("blake2b") != content_hash(path):
+        return None
+
+    view = memoryview(data)
+    sessions: list[Session] = []
+    try:
+        for meta in header["sessions"]:
+            session, off = _decode_session(meta, view, off)
+            sessions.append(session)
+    except (KeyError, ValueError, IndexError):
+        return None
+    if off != len(data):
+        return None
+    warnings = header.get("warnings", [])
+    for msg in warnings:
+        parse_kprof.warn(msg)
+    if stale:
+        store(path, sessions, st, header["blake2b"], warnings)
+    return sessions
+
+
+def store(
+    path: str,
+    sessions: list[Session],
+    before: os.stat_result,
+    digest: str | None = None,
+    warnings: list[str] | None = None,
+) -> None:
+    """Write the cache for `path`, whose `os.stat` was `before` when
+    parsing started, with the `warnings` its parse issued. Nothing is
+    written if the capture has changed since (e.g. it is still being
+    captured) or a record field is too wide for its column. Best
+    effort: a read-only capture directory just means no cache."""
+    try:
+        encoded = [_encode_session(s) for s in sessions]
+    except (OverflowError, ValueError):
+        # e.g. `tsc=-5` or `cpu=300`, which only the text parser accepts.
+        return
+    try:
+        digest = digest or content_hash(path)
+        st = os.stat(path)
+        if (st.st_size, st.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+            return
+        header = json.dumps({
+            "version": CACHE_VERSION,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "blake2b": digest,
+            "warnings": warnings or [],
+            "sessions": [meta for meta, _ in encoded],
+        }, separators=(",", ":")).encode()
+        target = cache_path(path)
+        fd, tmp = tempfile.mkstemp(
+            prefix=os.path.basename(target) + ".", dir=os.path.dirname(target) or ".",
+        )
+        try:
+            os.chmod(tmp, st.st_mode & 0o666)
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(MAGIC)
+                fh.write(HEADER_LEN.pack(len(header)))
+                fh.write(header)
+                for _, blobs in encoded:
+                    for blob in blobs:
+                        fh.write(blob)
+            os.replace(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except OSError:
+        pass
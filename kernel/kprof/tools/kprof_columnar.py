@@ -0,0 +1,388 @@
+"""Columnar NumPy backend for parse_kprof.
+
+Selected with `parse_kprof.py --backend numpy`. Records of each session
+are packed into a structured array whose fields mirror the kernel's
+trace-mode `Record` extern struct (`kernel/kprof/record.zig`), and
+enter/exit pairing, per-scope deltas, percentiles and trace-point
+histograms are computed with sort/group operations over whole columns
+instead of a Python loop per record.
+
+Output is identical to the pure-Python path: the same pairs are
+formed (LIFO per (cpu, id) within a session, orphan exits dropped),
+the same nearest-rank / `statistics.median` rules are applied, and
+ties keep the same first-seen order. Counter values are handled as
+int64, so snapshots must stay below 2**63 — true of any TSC or PMC
+value a running machine produces.
+
+NumPy is an optional dependency; importing this module without it
+raises ImportError, which parse_kprof turns into a CLI error.
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+from operator import itemgetter
+
+import numpy as np
+
+from parse_kprof import (
+    KIND_TRACE_ENTER,
+    KIND_TRACE_EXIT,
+    KIND_TRACE_POINT,
+    MetricStats,
+    DerivedStats,
+    PointTally,
+    RatioStats,
+    ScopeStats,
+    Session,
+    SteadyState,
+    detect_warmup,
+    merged_names,
+    warn,
+)
+
+# Mirrors `Record` in kernel/kprof/record.zig under
+# `-Dkernel_profile=trace` (64 bytes, little-endian).
+RECORD_DTYPE = np.dtype([
+    ("tsc", "<u8"),
+    ("kind", "u1"),
+    ("cpu", "u1"),
+    ("_pad", "<u2"),
+    ("id", "<u4"),
+    ("ip", "<u8"),
+    ("arg", "<u8"),
+    ("cycles", "<u8"),
+    ("cache_misses", "<u8"),
+    ("branch_misses", "<u8"),
+    ("_pad2", "<u8"),
+])
+
+# `-Dkernel_profile=sample` variant: base fields only (32 bytes).
+SAMPLE_RECORD_DTYPE = np.dtype([
+    ("tsc", "<u8"),
+    ("kind", "u1"),
+    ("cpu", "u1"),
+    ("_pad", "<u2"),
+    ("id", "<u4"),
+    ("ip", "<u8"),
+    ("arg", "<u8"),
+])
+
+assert RECORD_DTYPE.itemsize == 64
+assert SAMPLE_RECORD_DTYPE.itemsize == 32
+
+# `parse_kprof.Record` field order, up to the PMC snapshots.
+_RECORD_FIELDS = (
+    "cpu", "tsc", "kind", "id", "ip", "arg",
+    "cycles", "cache_misses", "branch_misses",
+)
+
+
+def binary_block_array(buf: bytes, rec_size: int) -> np.ndarray:
+    """Map a raw per-CPU log buffer from the binary dump framing.
+    Trace-mode buffers are viewed in place; 32-byte sample records are
+    widened into `RECORD_DTYPE` with zeroed PMC fields."""
+    if rec_size == RECORD_DTYPE.itemsize:
+        return np.frombuffer(buf, dtype=RECORD_DTYPE)
+    narrow = np.frombuffer(buf, dtype=SAMPLE_RECORD_DTYPE)
+    wide = np.zeros(len(narrow), dtype=RECORD_DTYPE)
+    for name in SAMPLE_RECORD_DTYPE.names:
+        wide[name] = narrow[name]
+    return wide
+
+
+def fields_array(fields: dict, n: int) -> np.ndarray:
+    """`RECORD_DTYPE` array of `n` records from per-field buffers (as
+    stored by `kprof_cache`); fields not given stay zero."""
+    arr = np.zeros(n, dtype=RECORD_DTYPE)
+    for name in _RECORD_FIELDS:
+        if name in fields:
+            arr[name] = np.frombuffer(fields[name], dtype=RECORD_DTYPE[name])
+    return arr
+
+
+def session_array(session: Session) -> np.ndarray:
+    """Structured array of `session.records`, built once and cached
+    on the session. Sessions dumped entirely in the binary framing
+    are mapped from their raw buffers without touching `records`."""
+    if session.columns is None and session.raw_blocks and (
+        sum(len(buf) // size for size, buf in session.raw_blocks) == len(session.records)
+    ):
+        blocks = [binary_block_array(buf, size) for size, buf in session.raw_blocks]
+        session.columns = blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+    if session.columns is None:
+        recs = session.records
+        n = len(recs)
+        arr = np.zeros(n, dtype=RECORD_DTYPE)
+        # One typed pass per field is several times faster than
+        # building a tuple per record for a structured fromiter.
+        for pos, name in enumerate(_RECORD_FIELDS):
+            arr[name] = np.fromiter(map(itemgetter(pos), recs), RECORD_DTYPE[name], n)
+        session.columns = arr
+    return session.columns
+
+
+def _concat(sessions: list[Session]) -> tuple[np.ndarray, np.ndarray]:
+    """All records of `sessions` back to back, plus the index of the
+    session each one came from."""
+    arrays = [session_array(s) for s in sessions]
+    if not arrays:
+        return np.zeros(0, dtype=RECORD_DTYPE), np.zeros(0, dtype=np.int64)
+    if len(arrays) == 1:
+        return arrays[0], np.zeros(len(arrays[0]), dtype=np.int64)
+    sess = np.repeat(np.arange(len(arrays), dtype=np.int64), [len(a) for a in arrays])
+    return np.concatenate(arrays), sess
+
+
+def _group_starts(key: np.ndarray) -> np.ndarray:
+    """Boolean mask marking the first element of every run of equal
+    keys in an already-sorted array."""
+    start = np.ones(len(key), dtype=bool)
+    start[1:] = key[1:] != key[:-1]
+    return start
+
+
+def _stitch_chains(recs: np.ndarray, sess: np.ndarray, idx: np.ndarray) -> np.ndarray:
+    """Chain number of every scope record in `idx` for `stitch`
+    pairing: records of one CPU stay in one chain across sessions
+    unless the TSC goes backwards from the CPU's last scope record in
+    one session to its first in a later one — the same break rule as
+    `parse_kprof.OpenScopes`. Chain numbers are only unique together
+    with the CPU."""
+    cpu = recs["cpu"][idx]
+    by_cpu = np.argsort(cpu, kind="stable")
+    c, s, t = cpu[by_cpu], sess[idx][by_cpu], recs["tsc"][idx][by_cpu]
+    brk = np.zeros(len(c), dtype=bool)
+    brk[1:] = (c[1:] == c[:-1]) & (s[1:] != s[:-1]) & (t[1:] < t[:-1])
+    chain = np.empty(len(c), dtype=np.int64)
+    chain[by_cpu] = np.cumsum(brk)
+    return chain
+
+
+def pair_scopes(recs: np.ndarray, sess: np.ndarray, stitch: bool = False):
+    """Vectorized LIFO pairing of enter/exit records per
+    (session, cpu, id) — or, with `stitch`, per (chain, cpu, id) so
+    enters open at a session boundary pair with exits after it.
+
+    Within each group the enter/exit sequence is a walk of +1/-1
+    steps. Clamping the running sum at zero gives the nesting depth
+    the Python stack would have; an exit taken at depth zero is an
+    orphan. Every enter that lifts depth L to L+1 is then closed by
+    the next exit that lowers L+1 to L, so sorting the surviving
+    events by (group, level, position) leaves each pair adjacent.
+
+    Returns (enter_idx, exit_idx, orphan_enters, orphan_exits) with
+    indices into `recs`, pairs ordered by exit position."""
+    kind = recs["kind"]
+    idx = np.flatnonzero((kind == KIND_TRACE_ENTER) | (kind == KIND_TRACE_EXIT))
+    empty = np.zeros(0, dtype=np.int64)
+    if len(idx) == 0:
+        return empty, empty, 0, 0
+
+    # One packed int64 key per (session, cpu, id); a stable sort keeps
+    # record order inside each group.
+    group_of = _stitch_chains(recs, sess, idx) if stitch else sess[idx]
+    key = (group_of << 40) | (recs["cpu"][idx].astype(np.int64) << 32) | recs["id"][idx]
+    order = np.argsort(key, kind="stable")
+    idx, key = idx[order], key[order]
+    is_enter = kind[idx] == KIND_TRACE_ENTER
+    step = np.where(is_enter, 1, -1)
+
+    start = _group_starts(key)
+    group = np.cumsum(start) - 1
+    n = len(idx)
+
+    # Running sum restarted at every group.
+    cs = np.cumsum(step)
+    first = np.flatnonzero(start)
+    cs = cs - (cs[first] - step[first])[group]
+
+    # Running minimum per group (including the implicit 0 before the
+    # first event): offset each group far below every earlier one so
+    # a single global accumulate never carries a min across groups.
+    big = 2 * n + 2
+    shifted = cs - group * big
+    runmin = np.minimum.accumulate(shifted) + group * big
+    runmin = np.minimum(runmin, 0)
+    depth_after = cs - runmin
+    depth_before = np.where(start, 0, np.roll(depth_after, 1))
+
+    orphan_exit = (~is_enter) & (depth_before == 0)
+    valid = ~orphan_exit
+    level = np.where(is_enter, depth_before, depth_after)
+
+    v_idx = idx[valid]
+    v_bucket = group[valid] * (int(level.max()) + 1) + level[valid]
+    v_enter = is_enter[valid]
+    # Events are still in (group, position) order, so a stable sort on
+    # (group, level) yields (group, level, position).
+    order = np.argsort(v_bucket, kind="stable")
+    v_idx, v_bucket, v_enter = v_idx[order], v_bucket[order], v_enter[order]
+
+    same = v_bucket[1:] == v_bucket[:-1]
+    pair = v_enter[:-1] & ~v_enter[1:] & same
+    enter_idx = v_idx[:-1][pair]
+    exit_idx = v_idx[1:][pair]
+
+    by_exit = np.argsort(exit_idx, kind="stable")
+    enter_idx, exit_idx = enter_idx[by_exit], exit_idx[by_exit]
+
+    orphan_enters = int(is_enter.sum()) - len(enter_idx)
+    return enter_idx, exit_idx, orphan_enters, int(orphan_exit.sum())
+
+
+def _metric(sorted_vals: np.ndarray) -> MetricStats:
+    n = len(sorted_vals)
+    if n == 0:
+        return MetricStats(count=0, total=0, min_v=0, median=0, p95=0, p99=0, max_v=0)
+
+    def at(k: int) -> int:
+        return int(sorted_vals[k])
+
+    def pct(p: float) -> int:
+        if n == 1:
+            return at(0)
+        # Nearest-rank, as `parse_kprof.percentile`.
+        return at(max(0, min(n - 1, int(round((p / 100.0) * (n - 1))))))
+
+    if n % 2:
+        median = at(n // 2)
+    else:
+        # `statistics.median` averages the middle pair as a float.
+        median = int((at(n // 2 - 1) + at(n // 2)) / 2)
+    return MetricStats(
+        count=n,
+        total=int(sorted_vals.sum()),
+        min_v=at(0),
+        median=median,
+        p95=pct(95),
+        p99=pct(99),
+        max_v=at(n - 1),
+    )
+
+
+def _ratio(num: np.ndarray, den: np.ndarray, scale: float = 1.0) -> RatioStats:
+    """Columnar `parse_kprof._ratio_from`."""
+    m = den > 0
+    num, den = num[m], den[m]
+    vals = np.sort((num * scale) / den)
+    n = len(vals)
+    if n == 0:
+        return RatioStats(count=0, pooled=0.0, min_v=0.0, median=0.0, p95=0.0, p99=0.0, max_v=0.0)
+
+    def pct(p: float) -> float:
+        return float(vals[max(0, min(n - 1, int(round((p / 100.0) * (n - 1)))))])
+
+    median = float(vals[n // 2]) if n % 2 else (float(vals[n // 2 - 1]) + float(vals[n // 2])) / 2
+    return RatioStats(
+        count=n,
+        pooled=int(num.sum()) * scale / int(den.sum()),
+        min_v=float(vals[0]),
+        median=median,
+        p95=pct(95),
+        p99=pct(99),
+        max_v=float(vals[-1]),
+    )
+
+
+def _derived(tsc: np.ndarray, cycles: np.ndarray, cmiss: np.ndarray, bmiss: np.ndarray):
+    """Columnar `parse_kprof.derived_from_deltas`."""
+    if not cycles.any():
+        return None
+    return DerivedStats(
+        cycles_per_tsc=_ratio(cycles, tsc),
+        cmiss_per_kcycle=_ratio(cmiss, cycles, 1000.0),
+        bmiss_per_call=_ratio(bmiss, np.ones(len(bmiss), dtype=np.int64)),
+    )
+
+
+def pooled_scope_stats(
+    sessions: list[Session], stitch: bool = False, steady: SteadyState | None = None,
+) -> tuple[list[ScopeStats], int, int, int]:
+    """Columnar `compute_pooled_scope_stats`. Warmup detection works on
+    a few dozen window medians per scope, so it reuses
+    `parse_kprof.detect_warmup` on each scope's columns."""
+    recs, sess = _concat(sessions)
+    enter_idx, exit_idx, orphan_enters, orphan_exits = pair_scopes(recs, sess, stitch)
+    stitched = int((sess[enter_idx] != sess[exit_idx]).sum())
+
+    def delta(field: str) -> np.ndarray:
+        col = recs[field]
+        return col[exit_idx].astype(np.int64) - col[enter_idx].astype(np.int64)
+
+    dtsc = delta("tsc")
+    neg = dtsc < 0
+    if neg.any():
+        for i in np.flatnonzero(neg):
+            e = exit_idx[i]
+            warn(f"negative tsc delta on id={int(recs['id'][e])} cpu={int(recs['cpu'][e])}, skipping")
+        keep = ~neg
+        enter_idx, exit_idx, dtsc = enter_idx[keep], exit_idx[keep], dtsc[keep]
+
+    ids = recs["id"][exit_idx].astype(np.int64)
+    columns = (
+        dtsc,
+        np.maximum(0, delta("cycles")),
+        np.maximum(0, delta("cache_misses")),
+        np.maximum(0, delta("branch_misses")),
+    )
+
+    # Scope order before the total-based sort is the order each id was
+    # first paired, matching dict insertion order in the Python path.
+    uniq, first = np.unique(ids, return_index=True)
+    uniq = uniq[np.argsort(first, kind="stable")]
+
+    by_id = np.argsort(ids, kind="stable")
+    s_ids = ids[by_id]
+    bounds = {int(t): np.searchsorted(s_ids, [t, t + 1]) for t in uniq}
+    sorted_cols = [col[by_id] for col in columns]
+    s_at = recs["tsc"][exit_idx][by_id]
+
+    names = merged_names(sessions)
+    out: list[ScopeStats] = []
+    for tid in uniq:
+        t = int(tid)
+        lo, hi = bounds[t]
+        cols = [col[lo:hi] for col in sorted_cols]
+        warmup = None
+        if steady is not None:
+            warmup = detect_warmup(s_at[lo:hi].tolist(), cols[0].tolist(), steady.window_tsc)
+            if warmup.calls:
+                keep = np.array(warmup.keep, dtype=bool)
+                cols = [col[keep] for col in cols]
+        metrics = [_metric(np.sort(col)) for col in cols]
+        out.append(ScopeStats(
+            name=names.get(t, f"id_{t}"),
+            tsc=metrics[0],
+            cycles=metrics[1],
+            cache_misses=metrics[2],
+            branch_misses=metrics[3],
+            warmup=warmup,
+            derived=_derived(*cols),
+            id=t,
+        ))
+    out.sort(key=lambda s: s.tsc.total, reverse=True)
+    return out, orphan_enters, orphan_exits, stitched
+
+
+def trace_points(sessions: list[Session]) -> dict[int, PointTally]:
+    """Columnar `collect_trace_points`. Tallies keep first-seen order
+    for ids and args so `most_common` breaks ties the same way."""
+    recs, _ = _concat(sessions)
+    pts = recs[recs["kind"] == KIND_TRACE_POINT]
+    out: dict[int, PointTally] = {}
+    if len(pts) == 0:
+        return out
+    ids = pts["id"].astype(np.int64)
+    by_id = np.argsort(ids, kind="stable")
+    s_ids, s_args = ids[by_id], pts["arg"][by_id]
+    uniq, first = np.unique(ids, return_index=True)
+    for tid in uniq[np.argsort(first, kind="stable")]:
+        lo, hi = np.searchsorted(s_ids, [tid, tid + 1])
+        sel = s_args[lo:hi]
+        vals, v_first, counts = np.unique(sel, return_index=True, return_counts=True)
+        order = np.argsort(v_first, kind="stable")
+        tally = PointTally(count=len(sel))
+        tally.args = Counter({int(vals[i]): int(counts[i]) for i in order})
+        out[int(tid)] = tally
+    return out
@@ -0,0 +1,224 @@
+"""Source-line and basic-block attribution of kprof samples.
+
+`parse_kprof.py --sample --lines DB` and `flamegraph.py --lines DB`
+resolve sampled `ip`s against a `tools/indexer` database built for the
+same kernel (one file per arch and commit). Three of its tables are
+used, all at link-time addresses:
+
+    bin_symbol   function start, size and entity (qualified name)
+    dwarf_line   coalesced [addr_lo, addr_hi] ranges per file:line
+    bin_inst     disassembly, read only when basic blocks are wanted
+
+The kernel prints post-KASLR `ip`s, so the slide is inferred first.
+Every sampled address whose `sym=` names exactly one `bin_symbol`
+function bounds the slide to the window that puts it inside that
+function; the slide is the `SLIDE_ALIGN`-aligned value covered by the
+most such windows (see `LineIndex.infer_slide`).
+
+Each table is loaded once into sorted arrays and every lookup is a
+bisect, so attributing a capture runs no SQL per sample. Basic blocks
+are split at function entries, after jumps and returns, and at every
+jump target found in the disassembly operands.
+
+Like the indexer's own frontends, a database without
+`meta('schema_complete','true')` is refused.
+"""
+
+from __future__ import annotations
+
+import re
+import sqlite3
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterable
+from urllib.parse import quote
+
+# KASLR slides are whole pages.
+SLIDE_ALIGN = 0x1000
+
+# SQLite integers are signed; the indexer stores addresses bit-cast.
+_MASK = (1 << 64) - 1
+
+# Mnemonics that end a basic block besides x86 `j*` (x86-64 and
+# aarch64 objdump spellings). Calls return to the next instruction and
+# do not split blocks.
+BLOCK_END = frozenset({
+    "ret", "retq", "iret", "iretq", "sysret", "sysretq", "ud2",
+    "b", "br", "cbz", "cbnz", "tbz", "tbnz", "eret",
+})
+# x86 prefixes objdump prints in the mnemonic column.
+_PREFIXES = frozenset({"bnd", "notrack", "rep", "repz", "repnz", "data16"})
+TARGET_RE = re.compile(r"\b([0-9a-f]{6,16}) <")
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    # Read-only, so a mistyped path fails instead of creating a file.
+    return sqlite3.connect(f"file:{quote(db_path)}?mode=ro", uri=True)
+
+
+def _ends_block(mnemonic: str, operands: str) -> bool:
+    if mnemonic in _PREFIXES:
+        mnemonic = operands.split(" ", 1)[0]
+    return mnemonic.startswith(("j", "b.")) or mnemonic in BLOCK_END
+
+
+@dataclass
+class Slide:
+    """Inferred KASLR slide: runtime ip = link address + `slide`.
+    `matched` of the `candidates` sampled frames with an
+    unambiguous `sym=` fall inside their function under it."""
+    slide: int
+    matched: int
+    candidates: int
+
+
+class LineIndex:
+    """In-memory view of one indexer database. Set `slide` (see
+    `infer_slide`) before resolving runtime addresses."""
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self.slide = 0
+        conn = _connect(db_path)
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            if meta.get("schema_complete") != "true":
+                raise ValueError(f"{db_path}: indexer database is incomplete")
+            self.commit = meta.get("commit_sha", "")
+            self.arch = meta.get("arch", "")
+
+            syms = sorted(
+                (addr & _MASK, size & _MASK, name)
+                for addr, size, name in conn.execute(
+                    "SELECT b.addr, b.size, e.qualified_name"
+                    " FROM bin_symbol b JOIN entity e ON e.id = b.entity_id"
+                )
+            )
+            self.sym_lo = array("Q", (a for a, _, _ in syms))
+            self.sym_hi = array("Q", (a + s - 1 for a, s, _ in syms))
+            self.sym_name = [n for _, _, n in syms]
+            # `sym=` is the bare function name; qualified names are
+            # dotted module paths.
+            self._by_short: dict[str, list[int]] = {}
+            for i, name in enumerate(self.sym_name):
+                self._by_short.setdefault(name.rsplit(".", 1)[-1], []).append(i)
+
+            files = dict(conn.execute("SELECT id, path FROM file"))
+            lines = sorted(
+                (lo & _MASK, hi & _MASK, fid, line)
+                for lo, hi, fid, line in conn.execute(
+                    "SELECT addr_lo, addr_hi, file_id, line FROM dwarf_line"
+                )
+            )
+            self.line_lo = array("Q", (r[0] for r in lines))
+            self.line_hi = array("Q", (r[1] for r in lines))
+            self.line_name = [
+                f"{files.get(fid, f'file_{fid}')}:{line}" for _, _, fid, line in lines
+            ]
+        finally:
+            conn.close()
+        self._block_lo: array | None = None
+
+    # ── Slide ────────────────────────────────────────────────────────
+
+    def infer_slide(self, samples: Iterable[tuple[int, str]]) -> Slide | None:
+        """Slide that places the most `(ip, sym)` samples inside the
+        `bin_symbol` function named `sym`. Samples whose name is
+        missing or matches no or several functions are ignored. None
+        if no sample could be used."""
+        events: Counter[int] = Counter()
+        candidates = 0
+        for (ip, sym), n in Counter(samples).items():
+            hits = self._by_short.get(sym)
+            if not hits or len(hits) != 1:
+                continue
+            i = hits[0]
+            # ip - slide must land in [sym_lo, sym_hi].
+            events[ip - self.sym_hi[i]] += n
+            events[ip - self.sym_lo[i] + 1] -= n
+            candidates += n
+        if not candidates:
+            return None
+
+        points = sorted(events)
+        best: tuple[int, bool, int] | None = None
+        cover = 0
+        for lo, hi in zip(points, points[1:]):
+            cover += events[lo]
+            aligned = -(-lo // SLIDE_ALIGN) * SLIDE_ALIGN
+            key = (cover, aligned < hi, aligned if aligned < hi else lo)
+            if best is None or key[:2] > best[:2]:
+                best = key
+        return Slide(slide=best[2], matched=best[0], candidates=candidates)
+
+    # ── Lookups (runtime addresses) ──────────────────────────────────
+
+    def function_at(self, ip: int) -> int | None:
+        addr = ip - self.slide
+        i = bisect_right(self.sym_lo, addr) - 1
+        if i >= 0 and addr <= self.sym_hi[i]:
+            return i
+        return None
+
+    def line(self, ip: int) -> str | None:
+        """`path:line` of `ip`, or None outside the line table."""
+        addr = ip - self.slide
+        i = bisect_right(self.line_lo, addr) - 1
+        if i >= 0 and addr <= self.line_hi[i]:
+            return self.line_name[i]
+        return None
+
+    def block(self, ip: int) -> str | None:
+        """`function+0xoff` of the start of the basic block holding
+        `ip`, or None outside every function."""
+        fn = self.function_at(ip)
+        if fn is None:
+            return None
+        blocks = self._blocks()
+        addr = ip - self.slide
+        # Function entries are leaders, so this never leaves `fn`.
+        lo = blocks[bisect_right(blocks, addr) - 1]
+        short = self.sym_name[fn].rsplit(".", 1)[-1]
+        return f"{short}+0x{lo - self.sym_lo[fn]:x}"
+
+    def _blocks(self) -> array:
+        if self._block_lo is not None:
+            return self._block_lo
+        conn = _connect(self.db_path)
+        try:
+            insts = sorted(
+                (addr & _MASK, mnemonic, operands)
+                for addr, mnemonic, operands in conn.execute(
+                    "SELECT addr, mnemonic, operands FROM bin_inst"
+                )
+            )
+        finally:
+            conn.close()
+        leaders = set(self.sym_lo)
+        ended = False
+        for addr, mnemonic, operands in insts:
+            if ended:
+                leaders.add(addr)
+            ended = _ends_block(mnemonic, operands)
+            if ended:
+                m = TARGET_RE.search(operands)
+                if m is not None:
+                    leaders.add(int(m.group(1), 16))
+        self._block_lo = array("Q", sorted(leaders))
+        return self._block_lo
+
+    def label(self, ip: int, by: str) -> str | None:
+        """Label of `ip` for a `--by line` / `--by block` histogram."""
+        return self.line(ip) if by == "line" else self.block(ip)
+
+
+def open_index(db_path: str, samples: Iterable[tuple[int, str]]) -> tuple[LineIndex, Slide | None]:
+    """Load `db_path` and set its slide from `samples` (`(ip, sym)`
+    pairs); the slide stays 0 if none can be inferred."""
+    index = LineIndex(db_path)
+    slide = index.infer_slide(samples)
+    if slide is not None:
+        index.slide = slide.slide
+    return index, slide
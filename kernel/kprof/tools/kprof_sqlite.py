@@ -0,0 +1,233 @@
+"""SQLite export of parsed kprof captures.
+
+`parse_kprof.py --sqlite out.db capture.log` loads every session of
+the capture into `out.db` so ad hoc questions become plain SQL:
+
+    SELECT cpu, MAX(tsc) FROM scopes
+     WHERE name = 'handle_page_fault' AND enter_tsc BETWEEN :t1 AND :t2
+     GROUP BY cpu ORDER BY 2 DESC;
+
+Tables (created if missing, so several captures can share one file):
+
+    captures    id, path, imported_at (unix time)
+    sessions    id, capture_id, seq (0-based in the capture), cpus, mode,
+                reason, tsc_hz, done, record_count
+    names       session_id, id, name
+    cpu_blocks  session_id, cpu, declared_records, overflowed, closed,
+                rec_size
+    records     session_id, cpu, tsc, kind, id, ip, arg, cycles,
+                cache_misses, branch_misses, sym — in capture order
+    scopes      one row per paired enter/exit: session_id (of the
+                exit), enter_session_id, id, name, cpu, enter_tsc,
+                exit_tsc, tsc, cycles, cache_misses, branch_misses
+
+`scopes` is paired exactly as the reports pair (see
+`parse_kprof.OpenScopes`), including stitching across rolling dumps
+unless `--no-stitch` is given. SQLite integers are signed 64-bit, so
+u64 values at or above 2**63 — kernel addresses in `ip` and `arg`,
+but any tsc or counter can get there too — are stored as their two's
+complement; `printf('0x%x', ip)` prints them back.
+
+Rows go in with batched `executemany` inside one transaction, with
+WAL journaling and `synchronous=OFF`; indexes are built after the
+bulk load.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import time
+from itertools import islice
+from typing import Iterable
+
+from parse_kprof import (
+    KIND_TRACE_ENTER,
+    KIND_TRACE_EXIT,
+    OpenScopes,
+    Record,
+    Session,
+)
+
+BATCH = 50_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    imported_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    capture_id INTEGER NOT NULL REFERENCES captures(id),
+    seq INTEGER NOT NULL,
+    cpus INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    tsc_hz INTEGER NOT NULL,
+    done INTEGER NOT NULL,
+    record_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS names (
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (session_id, id)
+);
+CREATE TABLE IF NOT EXISTS cpu_blocks (
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    cpu INTEGER NOT NULL,
+    declared_records INTEGER NOT NULL,
+    overflowed INTEGER NOT NULL,
+    closed INTEGER NOT NULL,
+    rec_size INTEGER NOT NULL,
+    PRIMARY KEY (session_id, cpu)
+);
+CREATE TABLE IF NOT EXISTS records (
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    cpu INTEGER NOT NULL,
+    tsc INTEGER NOT NULL,
+    kind INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    ip INTEGER NOT NULL,
+    arg INTEGER NOT NULL,
+    cycles INTEGER NOT NULL,
+    cache_misses INTEGER NOT NULL,
+    branch_misses INTEGER NOT NULL,
+    sym TEXT
+);
+CREATE TABLE IF NOT EXISTS scopes (
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    enter_session_id INTEGER NOT NULL REFERENCES sessions(id),
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    cpu INTEGER NOT NULL,
+    enter_tsc INTEGER NOT NULL,
+    exit_tsc INTEGER NOT NULL,
+    tsc INTEGER NOT NULL,
+    cycles INTEGER NOT NULL,
+    cache_misses INTEGER NOT NULL,
+    branch_misses INTEGER NOT NULL
+);
+"""
+
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS records_session_cpu_tsc ON records(session_id, cpu, tsc)",
+    "CREATE INDEX IF NOT EXISTS records_kind_id ON records(kind, id)",
+    "CREATE INDEX IF NOT EXISTS scopes_name_tsc ON scopes(name, tsc)",
+    "CREATE INDEX IF NOT EXISTS scopes_cpu_enter ON scopes(cpu, enter_tsc)",
+    "CREATE INDEX IF NOT EXISTS sessions_capture ON sessions(capture_id, seq)",
+)
+
+_SIGN = 1 << 63
+_WRAP = 1 << 64
+
+
+def _i64(v: int) -> int:
+    # Only u64 values wrap; anything wider still overflows in sqlite3.
+    return v - _WRAP if _SIGN <= v < _WRAP else v
+
+
+def _record_rows(session_id: int, records: list[Record]) -> Iterable[tuple]:
+    for cpu, tsc, kind, rid, ip, arg, cyc, cmiss, bmiss, sym in records:
+        yield (
+            session_id, cpu, _i64(tsc), kind, rid, _i64(ip), _i64(arg),
+            _i64(cyc), _i64(cmiss), _i64(bmiss), sym or None,
+        )
+
+
+def _scope_rows(sessions: list[Session], ids: list[int], stitch: bool) -> Iterable[tuple]:
+    scopes = OpenScopes(stitch)
+    for session, session_id in zip(sessions, ids):
+        names = session.names
+        for rec in session.records:
+            if rec.kind == KIND_TRACE_ENTER:
+                scopes.push(rec, (rec, session_id))
+            elif rec.kind == KIND_TRACE_EXIT:
+                opened = scopes.pop(rec)
+                if opened is None:
+                    continue
+                enter, enter_session = opened
+                if rec.tsc < enter.tsc:
+                    continue
+                yield (
+                    session_id, enter_session, rec.id, names.get(rec.id, f"id_{rec.id}"),
+                    rec.cpu, _i64(enter.tsc), _i64(rec.tsc), _i64(rec.tsc - enter.tsc),
+                    _i64(max(0, rec.cycles - enter.cycles)),
+                    _i64(max(0, rec.cache_misses - enter.cache_misses)),
+                    _i64(max(0, rec.branch_misses - enter.branch_misses)),
+                )
+        scopes.end_session()
+
+
+def _insert_batched(conn: sqlite3.Connection, sql: str, rows: Iterable[tuple]) -> int:
+    it = iter(rows)
+    total = 0
+    while True:
+        batch = list(islice(it, BATCH))
+        if not batch:
+            return total
+        conn.executemany(sql, batch)
+        total += len(batch)
+
+
+def export(db_path: str, capture: str, sessions: list[Session], stitch: bool = True) -> dict:
+    """Append `sessions` (parsed from `capture`) to the database at
+    `db_path`. Returns the row counts written per table."""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.executescript(SCHEMA)
+        conn.execute("BEGIN")
+        capture_id = conn.execute(
+            "INSERT INTO captures (path, imported_at) VALUES (?, ?)", (capture, time.time()),
+        ).lastrowid
+        ids: list[int] = []
+        counts = {"sessions": len(sessions), "names": 0, "cpu_blocks": 0}
+        for seq, s in enumerate(sessions):
+            ids.append(conn.execute(
+                "INSERT INTO sessions (capture_id, seq, cpus, mode, reason, tsc_hz, done,"
+                " record_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (capture_id, seq, s.cpus, s.mode, s.reason, s.tsc_hz, int(s.done), s.record_count),
+            ).lastrowid)
+            conn.executemany(
+                "INSERT INTO names (session_id, id, name) VALUES (?, ?, ?)",
+                [(ids[-1], nid, name) for nid, name in s.names.items()],
+            )
+            conn.executemany(
+                "INSERT INTO cpu_blocks (session_id, cpu, declared_records, overflowed,"
+                " closed, rec_size) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (ids[-1], b.cpu, b.declared_records, b.overflowed, int(b.closed), b.rec_size)
+                    for b in s.cpu_blocks.values()
+                ],
+            )
+            counts["names"] += len(s.names)
+            counts["cpu_blocks"] += len(s.cpu_blocks)
+        counts["records"] = sum(
+            _insert_batched(
+                conn,
+                "INSERT INTO records (session_id, cpu, tsc, kind, id, ip, arg, cycles,"
+                " cache_misses, branch_misses, sym) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                _record_rows(session_id, s.records),
+            )
+            for s, session_id in zip(sessions, ids)
+        )
+        counts["scopes"] = _insert_batched(
+            conn,
+            "INSERT INTO scopes (session_id, enter_session_id, id, name, cpu, enter_tsc,"
+            " exit_tsc, tsc, cycles, cache_misses, branch_misses)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            _scope_rows(sessions, ids, stitch),
+        )
+        for sql in INDEXES:
+            # Inside the transaction: `executescript` would commit first.
+            conn.execute(sql)
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return counts
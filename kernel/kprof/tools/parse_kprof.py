@@ -1,9 +1,24 @@
 #!/usr/bin/env python3
 """Post-processor for the Zag kernel `[KPROF]` profiling dump format.
 
-Reads a serial capture (file path or `-` for stdin), filters to lines
-beginning with `[KPROF]`, parses them into records, and reports either
-trace-scope statistics or a sample histogram.
+Reads a serial capture (file path or `-` for stdin, plain or gzip /
+xz / bzip2 compressed), filters to lines beginning with `[KPROF]`,
+parses them into records, and reports either trace-scope statistics
+or a sample histogram. Each flag's semantics are in `--help` and in
+the docstrings of the functions behind it; other scripts use this
+module through the `kprof` package next to it.
+
+Usage:
+  last cycle's scopes:    parse_kprof.py serial.log
+  every cycle, pooled:    parse_kprof.py --all-sessions --self serial.log
+  regression baseline:    parse_kprof.py --json --all-sessions --steady-state serial.log
+  wall time:              parse_kprof.py --tsc-mhz 2400 --units ns serial.log
+  sample histogram:       parse_kprof.py --sample --by caller --lines kernel.db serial.log
+  tail latency:           parse_kprof.py --outliers sysProcCreate --top 5 serial.log
+  bounded memory:         parse_kprof.py --stream --json serial.log.xz
+  Perfetto trace:         parse_kprof.py --timeline serial.log > trace.json
+  live run:               parse_kprof.py --follow --stable 2 serial.log
+  SQL:                    parse_kprof.py --sqlite kprof.db serial.log
 
 See `kernel/kprof/dump.zig` for the canonical emit format and
 `kernel/kprof/record.zig` for record kinds.
@@ -11,24 +26,41 @@ See `kernel/kprof/dump.zig` for the canonical emit format and
 
 from __future__ import annotations
 
+import argparse
+import base64
+import binascii
+import bz2
+import contextlib
+import gzip
+import heapq
+import io
 import json
+import lzma
+import mmap
+import os
 import re
+import stat
 import statistics
+import struct
 import sys
+import time
+import zlib
 from collections import Counter, defaultdict
-from dataclasses import dataclass, field
-from typing import Iterable
+from dataclasses import dataclass, field, replace
+from typing import IO, Any, Callable, Iterable, Iterator, NamedTuple, Protocol
 
 KIND_TRACE_ENTER = 1
 KIND_TRACE_EXIT = 2
 KIND_TRACE_POINT = 3
 KIND_SAMPLE = 4
+KIND_SAMPLE_FRAME = 5
 
 KIND_NAMES = {
     KIND_TRACE_ENTER: "trace_enter",
     KIND_TRACE_EXIT: "trace_exit",
     KIND_TRACE_POINT: "trace_point",
     KIND_SAMPLE: "sample",
+    KIND_SAMPLE_FRAME: "sample_frame",
 }
 
 KPROF_PREFIX = "[KPROF]"
@@ -36,9 +68,19 @@ KPROF_PREFIX = "[KPROF]"
 # Token patterns: key=<int>, key=<hex>, key=<word>.
 KV_RE = re.compile(r"(\w+)=(0x[0-9a-fA-F]+|-?\d+|\S+)")
 
+# The exact layout the kernel prints `rec` lines in: the six base
+# fields, then the three PMC snapshots (trace mode only), then the
+# resolved symbol (absent in older captures). Anything else falls
+# back to the generic `KV_RE` decoder.
+REC_FAST_RE = re.compile(
+    r"cpu=(\d+) tsc=(\d+) kind=(\d+) id=(\d+) "
+    r"ip=0x([0-9a-fA-F]+) arg=0x([0-9a-fA-F]+)"
+    r"(?: cyc=(\d+) cmiss=(\d+) bmiss=(\d+))?"
+    r"(?: sym=(\S+))?$"
+)
 
-@dataclass
-class Record:
+
+class Record(NamedTuple):
     cpu: int
     tsc: int
     kind: int
@@ -51,6 +93,8 @@ class Record:
     cycles: int = 0
     cache_misses: int = 0
     branch_misses: int = 0
+    # Kernel-resolved symbol for `ip`, or "" when the line has none.
+    sym: str = ""
 
     def to_json(self) -> dict:
         return {
@@ -73,6 +117,10 @@ class CpuBlock:
     declared_records: int = 0
     overflowed: int = 0
     closed: bool = False
+    # Binary framing only: bytes per record and the base64 payload
+    # collected from `blk` lines until `cpu_end` decodes it.
+    rec_size: int = 0
+    payload: list[str] = field(default_factory=list, repr=False)
 
 
 @dataclass
@@ -80,14 +128,74 @@ class Session:
     cpus: int = 0
     mode: str = ""
     reason: str = ""
+    # TSC rate from the optional `tsc_hz=` header field; 0 if absent.
+    tsc_hz: int = 0
     names: dict[int, str] = field(default_factory=dict)
     records: list[Record] = field(default_factory=list)
     cpu_blocks: dict[int, CpuBlock] = field(default_factory=dict)
     done: bool = False
-
-
-def warn(msg: str) -> None:
-    print(f"parse_kprof: warning: {msg}", file=sys.stderr)
+    # Counts every parsed `rec` line, including ones handed to an
+    # `on_record` sink instead of being kept in `records`.
+    record_count: int = 0
+    # Columnar copy of `records`, built lazily by the numpy backend.
+    columns: Any = field(default=None, repr=False, compare=False)
+    # Decoded binary blocks as (rec_size, raw bytes), in record order.
+    # When every record came from one, the numpy backend maps these
+    # directly instead of rebuilding columns from `records`.
+    raw_blocks: list[tuple[int, bytes]] = field(default_factory=list, repr=False)
+
+
+# Columnar backend module (`kprof_columnar`) once selected with
+# `set_backend("numpy")`; None means the pure-Python path.
+_columnar: Any = None
+
+BACKENDS = ("python", "numpy")
+
+
+def set_backend(name: str) -> None:
+    """Select the statistics backend. Raises ImportError if the numpy
+    backend is requested and NumPy is not installed."""
+    global _columnar
+    if name == "numpy":
+        import kprof_columnar
+        _columnar = kprof_columnar
+    elif name == "python":
+        _columnar = None
+    else:
+        raise ValueError(f"unknown backend {name!r}")
+
+
+# Warnings collected by the innermost `record_warnings`, or None, and
+# whether it prints them.
+_recorded: list[str] | None = None
+_echo = True
+
+
+def warn(msg: str, record: bool = True) -> None:
+    """Print a warning. Unless `record` is false (the warning is about
+    how the capture was read, not about its content), it is also kept
+    by an enclosing `record_warnings`."""
+    if _echo or not record:
+        print(f"parse_kprof: warning: {msg}", file=sys.stderr)
+    if record and _recorded is not None:
+        _recorded.append(msg)
+
+
+@contextlib.contextmanager
+def record_warnings(echo: bool = True) -> Iterator[list[str]]:
+    """Collect the warnings issued inside the block so they can be
+    cached with what was parsed and replayed. With `echo` false they
+    are not printed, e.g. on a second pass that would repeat them."""
+    global _recorded, _echo
+    outer, outer_echo = _recorded, _echo
+    seen: list[str] = []
+    _recorded, _echo = seen, echo and _echo
+    try:
+        yield seen
+    finally:
+        _recorded, _echo = outer, outer_echo
+        if outer is not None:
+            outer.extend(seen)
 
 
 def parse_int(value: str) -> int:
@@ -100,6 +208,126 @@ def parse_kv(rest: str) -> dict[str, str]:
     return {m.group(1): m.group(2) for m in KV_RE.finditer(rest)}
 
 
+def decode_rec_kv(rest: str) -> Record:
+    """Generic `rec` decoder: any key order, decimal or hex values,
+    optional PMC and symbol fields. Raises KeyError/ValueError on
+    lines missing a base field."""
+    kv = parse_kv(rest)
+    return Record(
+        cpu=int(kv["cpu"]),
+        tsc=parse_int(kv["tsc"]),
+        kind=int(kv["kind"]),
+        id=int(kv["id"]),
+        ip=parse_int(kv["ip"]),
+        arg=parse_int(kv["arg"]),
+        cycles=parse_int(kv.get("cyc", "0")),
+        cache_misses=parse_int(kv.get("cmiss", "0")),
+        branch_misses=parse_int(kv.get("bmiss", "0")),
+        sym=kv.get("sym", ""),
+    )
+
+
+_make_record = Record._make
+
+
+def decode_rec(rest: str) -> Record:
+    """Decode the body of a `[KPROF] rec` line. Lines in the kernel's
+    fixed layout take one anchored regex match and positional int
+    conversions; anything else goes through `decode_rec_kv`."""
+    m = REC_FAST_RE.match(rest)
+    if m is None:
+        return decode_rec_kv(rest)
+    cpu, tsc, kind, tid, ip, arg, cyc, cmiss, bmiss, sym = m.groups()
+    if cyc is None:
+        return _make_record((
+            int(cpu), int(tsc), int(kind), int(tid), int(ip, 16), int(arg, 16),
+            0, 0, 0, sym or "",
+        ))
+    return _make_record((
+        int(cpu), int(tsc), int(kind), int(tid), int(ip, 16), int(arg, 16),
+        int(cyc), int(cmiss), int(bmiss), sym or "",
+    ))
+
+
+# Little-endian layouts of the kernel's `Record` extern struct
+# (kernel/kprof/record.zig): 64 bytes under -Dkernel_profile=trace,
+# 32 bytes otherwise. Padding fields are skipped with `x`.
+TRACE_RECORD = struct.Struct("<QBB2xIQQQQQ8x")
+SAMPLE_RECORD = struct.Struct("<QBB2xIQQ")
+RECORD_STRUCTS = {TRACE_RECORD.size: TRACE_RECORD, SAMPLE_RECORD.size: SAMPLE_RECORD}
+
+
+def decode_binary_block(buf: bytes, rec_size: int) -> list[Record]:
+    """Unpack a raw per-CPU log buffer into Records. A trailing partial
+    record (truncated capture) is ignored."""
+    layout = RECORD_STRUCTS[rec_size]
+    view = memoryview(buf)[: len(buf) - len(buf) % rec_size]
+    if rec_size == TRACE_RECORD.size:
+        return [
+            _make_record((cpu, tsc, kind, tid, ip, arg, cyc, cmiss, bmiss, ""))
+            for tsc, kind, cpu, tid, ip, arg, cyc, cmiss, bmiss in layout.iter_unpack(view)
+        ]
+    return [
+        _make_record((cpu, tsc, kind, tid, ip, arg, 0, 0, 0, ""))
+        for tsc, kind, cpu, tid, ip, arg in layout.iter_unpack(view)
+    ]
+
+
+def _finish_binary_block(block: CpuBlock, crc: str | None) -> tuple[bytes, list[Record]] | None:
+    """Decode a block's collected base64 payload. Returns None (after
+    warning) if the payload is corrupt."""
+    text = "".join(block.payload)
+    block.payload = []
+    try:
+        buf = base64.b64decode(text, validate=True)
+    except (binascii.Error, ValueError) as exc:
+        warn(f"cpu{block.cpu}: bad base64 payload ({exc}), dropping block")
+        return None
+    if crc is not None and zlib.crc32(buf) != parse_int(crc):
+        warn(f"cpu{block.cpu}: payload crc mismatch, dropping block")
+        return None
+    if len(buf) % block.rec_size:
+        warn(f"cpu{block.cpu}: payload is not a whole number of records, truncating")
+        buf = buf[: len(buf) - len(buf) % block.rec_size]
+    return buf, decode_binary_block(buf, block.rec_size)
+
+
+# Compressed captures are recognized by content, not file extension,
+# so a compressed stream on stdin works too.
+COMPRESSION_MAGIC = (
+    (b"\x1f\x8b", gzip.open),
+    (b"\xfd7zXZ\x00", lzma.open),
+    (b"BZh", bz2.open),
+)
+
+
+def _decompressor_for(head: bytes):
+    for magic, opener in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return opener
+    return None
+
+
+def is_compressed(path: str) -> bool:
+    with open(path, "rb") as fh:
+        return _decompressor_for(fh.read(8)) is not None
+
+
+def open_capture(path: str) -> IO[str]:
+    """Open a serial capture (`-` for stdin) for line iteration.
+
+    gzip, xz and bzip2 input is decompressed incrementally as lines
+    are read, so memory stays bounded by the decoder's window rather
+    than the capture size. Text is decoded the same way as a plain
+    `open(path, "r", errors="replace")`."""
+    raw = sys.stdin.buffer if path == "-" else open(path, "rb")
+    if not isinstance(raw, io.BufferedReader):
+        raw = io.BufferedReader(raw)
+    opener = _decompressor_for(raw.peek(8)[:8])
+    binary = opener(raw, "rb") if opener is not None else raw
+    return io.TextIOWrapper(binary, encoding="utf-8", errors="replace")
+
+
 def iter_kprof_lines(stream: Iterable[str]) -> Iterable[str]:
     for raw in stream:
         line = raw.rstrip("\r\n")
@@ -109,9 +337,28 @@ def iter_kprof_lines(stream: Iterable[str]) -> Iterable[str]:
         yield line[idx:]
 
 
-def parse_session(stream: Iterable[str]) -> Session | None:
-    session: Session | None = None
+def iter_records(
+    stream: Iterable[str],
+    sessions: list[Session] | None = None,
+    resume: Session | None = None,
+) -> Iterator[tuple[Session, Record]]:
+    """Lazily decode a capture into `(session, record)` pairs, in
+    emission order, reading `stream` only as far as the consumer
+    pulls. Every record kind is passed through, including
+    `sample_frame`. Records are not stored on their session; each
+    session object is appended to `sessions` (if given) when its
+    `begin` line is read and filled in (names, CPU blocks, `done`,
+    `record_count`) as parsing proceeds.
+
+    `resume` is a session already in progress when `stream` starts
+    (see `parse_sessions`)."""
+    if sessions is None:
+        sessions = []
+    session: Session | None = resume
     current_cpu: int | None = None
+    # Inside a binary block that is being skipped; its `blk` lines are
+    # ignored without a warning each.
+    dropping = False
 
     for line in iter_kprof_lines(stream):
         body = line[len(KPROF_PREFIX):].strip()
@@ -122,20 +369,34 @@ def parse_session(stream: Iterable[str]) -> Session | None:
         rest = parts[1] if len(parts) > 1 else ""
 
         try:
-            if verb == "begin":
+            if verb == "rec":
+                if session is None:
+                    continue
+                rec = decode_rec(rest)
+                # Counted once decoded, so a malformed line is not.
+                session.record_count += 1
+                yield session, rec
+            elif verb == "blk":
+                if session is None or dropping:
+                    continue
+                block = session.cpu_blocks.get(current_cpu) if current_cpu is not None else None
+                if block is None or not block.rec_size:
+                    warn("blk line outside a binary cpu block, ignoring")
+                    continue
+                block.payload.append(rest.strip())
+            elif verb == "begin":
                 kv = parse_kv(rest)
                 session = Session(
                     cpus=int(kv.get("cpus", "0")),
                     mode=kv.get("mode", ""),
                     reason=kv.get("reason", ""),
+                    tsc_hz=int(kv.get("tsc_hz", "0")),
                 )
-                continue
-
-            if session is None:
+                sessions.append(session)
+            elif session is None:
                 # Stray KPROF line before any begin — ignore.
                 continue
-
-            if verb == "name":
+            elif verb == "name":
                 kv = parse_kv(rest)
                 # name= field can contain non-numeric so KV_RE catches \S+.
                 nid = int(kv["id"])
@@ -144,31 +405,41 @@ def parse_session(stream: Iterable[str]) -> Session | None:
                 kv = parse_kv(rest)
                 cpu = int(kv["cpu"])
                 current_cpu = cpu
+                rec_size = 0
+                dropping = False
+                if kv.get("format") == "bin":
+                    # Required rather than guessed from the session mode:
+                    # a `--jobs` piece can start at this line, before the
+                    # `begin` that sets the mode.
+                    if "rec_size" in kv:
+                        rec_size = int(kv["rec_size"])
+                        if rec_size not in RECORD_STRUCTS:
+                            raise ValueError(f"unsupported rec_size {rec_size}")
+                    else:
+                        warn(f"cpu{cpu}: binary block without rec_size, dropping it")
+                        dropping = True
                 session.cpu_blocks[cpu] = CpuBlock(
                     cpu=cpu,
                     declared_records=int(kv.get("records", "0")),
                     overflowed=int(kv.get("overflowed", "0")),
+                    rec_size=rec_size,
                 )
             elif verb == "cpu_end":
                 kv = parse_kv(rest)
                 cpu = int(kv["cpu"])
-                if cpu in session.cpu_blocks:
-                    session.cpu_blocks[cpu].closed = True
+                block = session.cpu_blocks.get(cpu)
+                if block is not None:
+                    block.closed = True
+                    if block.rec_size:
+                        decoded = _finish_binary_block(block, kv.get("crc32"))
+                        if decoded is not None:
+                            buf, recs = decoded
+                            session.raw_blocks.append((block.rec_size, buf))
+                            session.record_count += len(recs)
+                            for rec in recs:
+                                yield session, rec
                 current_cpu = None
-            elif verb == "rec":
-                kv = parse_kv(rest)
-                rec = Record(
-                    cpu=int(kv["cpu"]),
-                    tsc=parse_int(kv["tsc"]),
-                    kind=int(kv["kind"]),
-                    id=int(kv["id"]),
-                    ip=parse_int(kv["ip"]),
-                    arg=parse_int(kv["arg"]),
-                    cycles=parse_int(kv.get("cyc", "0")),
-                    cache_misses=parse_int(kv.get("cmiss", "0")),
-                    branch_misses=parse_int(kv.get("bmiss", "0")),
-                )
-                session.records.append(rec)
+                dropping = False
             elif verb == "done":
                 session.done = True
             else:
@@ -177,7 +448,223 @@ def parse_session(stream: Iterable[str]) -> Session | None:
             warn(f"could not parse line {line!r}: {exc}")
             continue
 
-    return session
+    for s in sessions:
+        for block in s.cpu_blocks.values():
+            if block.payload:
+                warn(f"cpu{block.cpu}: binary block never closed, dropping its payload")
+                block.payload = []
+
+
+def parse_sessions(
+    stream: Iterable[str],
+    on_record: Callable[[Session, Record], None] | None = None,
+    resume: Session | None = None,
+) -> list[Session]:
+    """Parse every `[KPROF] begin…done` cycle in the capture, in
+    emission order. A trailing cycle cut off by the capture ending
+    is returned with `done=False`.
+
+    With `on_record`, each record is handed to the callback together
+    with its session instead of being appended to `session.records`,
+    so the returned sessions carry only metadata and memory stays
+    flat regardless of capture size. Several consumers can share the
+    one pass through a `Fanout`.
+
+    `resume` is a session already in progress when `stream` starts —
+    used to parse a piece of a capture that begins mid-session. It is
+    returned as the first element so the caller can fold it back into
+    the real session."""
+    sessions: list[Session] = [] if resume is None else [resume]
+    records = iter_records(stream, sessions, resume)
+    if on_record is None:
+        for session, rec in records:
+            session.records.append(rec)
+    else:
+        for session, rec in records:
+            on_record(session, rec)
+    return sessions
+
+
+def parse_session(stream: Iterable[str]) -> Session | None:
+    """Parse the capture and return only its last session — the
+    rolling dump that was in progress when the capture ended."""
+    sessions = parse_sessions(stream)
+    return sessions[-1] if sessions else None
+
+
+# Lines a capture can be split in front of without cutting a session's
+# per-CPU record block in half. Pairing is per (cpu, id), and each CPU's
+# records sit between its cpu_begin/cpu_end, so pieces starting at
+# either marker parse independently.
+SPLIT_RE = re.compile(rb"\[KPROF\] (?:begin|cpu_begin) ")
+
+# Aim for a few pieces per worker so one long session doesn't leave
+# the rest of the pool idle.
+PIECES_PER_JOB = 4
+
+
+def split_capture(path: str, jobs: int) -> list[tuple[int, int]]:
+    """Byte ranges covering `path`, each starting at the beginning of
+    the file or of a `[KPROF] begin` / `cpu_begin` line."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return [(0, 0)]
+    target = max(1, size // max(1, jobs * PIECES_PER_JOB))
+    cuts = [0]
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for m in SPLIT_RE.finditer(mm):
+            # Cut at the start of the line holding the marker; serial
+            # junk may precede `[KPROF]` on the same line.
+            line_start = mm.rfind(b"\n", 0, m.start()) + 1
+            if line_start - cuts[-1] >= target:
+                cuts.append(line_start)
+    cuts.append(size)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def _parse_piece(task: tuple[str, int, int]) -> tuple[list[Session], list[str]]:
+    path, start, end = task
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = mm[start:end]
+    # Same newline and decode-error handling as open(path, "r", ...).
+    text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8", errors="replace")
+    # Every piece after the first may start inside a session; parse it
+    # against a placeholder that the caller folds back in.
+    with record_warnings() as seen:
+        sessions = parse_sessions(text, resume=Session() if start else None)
+    # Plain tuples pickle several times faster than NamedTuples; the
+    # parent rebuilds the Records.
+    for session in sessions:
+        session.records = list(map(tuple, session.records))
+    return sessions, seen
+
+
+def parse_sessions_parallel(path: str, jobs: int) -> list[Session]:
+    """`parse_sessions` over a capture file using `jobs` processes."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    if jobs <= 1:
+        tasks = [(path, 0, 0)]
+    elif is_compressed(path):
+        # Byte offsets into a compressed stream aren't line boundaries.
+        warn("--jobs ignored for a compressed capture, parsing serially", record=False)
+        tasks = [(path, 0, 0)]
+    else:
+        tasks = [(path, start, end) for start, end in split_capture(path, jobs)]
+    if len(tasks) == 1:
+        with open_capture(path) as fh:
+            return parse_sessions(fh)
+
+    sessions: list[Session] = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for (_, start, _), (pieces, seen) in zip(tasks, pool.map(_parse_piece, tasks)):
+            # The worker printed these; keep them for the cache too.
+            if _recorded is not None:
+                _recorded.extend(seen)
+            for piece in pieces:
+                piece.records = list(map(_make_record, piece.records))
+            if start and pieces:
+                tail = pieces[0]
+                pieces = pieces[1:]
+                if sessions:
+                    _fold_into(sessions[-1], tail)
+                # else: records before the first begin, which the
+                # serial parser ignores too.
+            sessions.extend(pieces)
+    return sessions
+
+
+def _fold_into(session: Session, tail: Session) -> None:
+    session.names.update(tail.names)
+    session.records.extend(tail.records)
+    session.raw_blocks.extend(tail.raw_blocks)
+    session.cpu_blocks.update(tail.cpu_blocks)
+    session.record_count += tail.record_count
+    session.done = session.done or tail.done
+
+
+def load_capture(path: str, jobs: int = 1, cache: bool = True) -> list[Session]:
+    """Every session in the capture file at `path`, parsed with `jobs`
+    processes — or, with `cache`, loaded from the `kprof_cache`
+    sidecar written by an earlier run over the same content. The
+    sidecar keeps the parse warnings too; a cache hit repeats them."""
+    if not cache:
+        return parse_sessions_parallel(path, jobs)
+    import kprof_cache
+
+    sessions = kprof_cache.load(path)
+    if sessions is None:
+        before = os.stat(path)
+        with record_warnings() as seen:
+            sessions = parse_sessions_parallel(path, jobs)
+        kprof_cache.store(path, sessions, before, warnings=seen)
+    return sessions
+
+
+class RecordSink(Protocol):
+    """A single-pass consumer of a capture: `feed` sees every record
+    with its session, in emission order, and `finish` is called once
+    with the parsed sessions after the last record. `StreamingScopeStats`,
+    `TimelineWriter` and `flamegraph.StackFolder` are sinks."""
+
+    def feed(self, session: Session, rec: Record) -> None: ...
+
+    def finish(self, sessions: list[Session]) -> None: ...
+
+
+class Fanout:
+    """Sink that hands every record to each of `sinks` in turn, so
+    several reports share one read of the capture."""
+
+    def __init__(self, *sinks: RecordSink) -> None:
+        self.sinks = sinks
+        self._feeds = tuple(s.feed for s in sinks)
+
+    def feed(self, session: Session, rec: Record) -> None:
+        for feed in self._feeds:
+            feed(session, rec)
+
+    def finish(self, sessions: list[Session]) -> None:
+        for sink in self.sinks:
+            sink.finish(sessions)
+
+
+def scan(path: str, *sinks: RecordSink) -> list[Session]:
+    """Stream the capture at `path` (`-` for stdin) once through every
+    sink and finish them. Records are not kept, so memory stays flat;
+    the returned sessions carry metadata only."""
+    fan = sinks[0] if len(sinks) == 1 else Fanout(*sinks)
+    with open_capture(path) as fh:
+        sessions = parse_sessions(fh, fan.feed)
+    fan.finish(sessions)
+    return sessions
+
+
+def completed_sessions(sessions: list[Session]) -> list[Session]:
+    """Sessions worth pooling: every cycle that reached `[KPROF] done`
+    with profiling enabled. A capture killed mid-dump leaves its last
+    cycle truncated; that one is dropped with a warning rather than
+    skewing the pooled counts. If nothing completed, fall back to
+    whatever was captured so the caller still gets output."""
+    enabled = [s for s in sessions if s.mode != "none"]
+    done = [s for s in enabled if s.done]
+    if len(done) != len(enabled):
+        dropped = len(enabled) - len(done)
+        if done:
+            warn(f"dropping {dropped} incomplete session(s) from pooled stats")
+        else:
+            warn("no session reached [KPROF] done — pooling incomplete sessions")
+            return enabled
+    return done
+
+
+def merged_names(sessions: list[Session]) -> dict[int, str]:
+    """Union of every session's id→name table. The table is emitted
+    in full at each dump so later sessions only ever add entries."""
+    names: dict[int, str] = {}
+    for s in sessions:
+        names.update(s.names)
+    return names
 
 
 def percentile(sorted_vals: list[int], pct: float) -> int:
@@ -212,6 +699,220 @@ class MetricStats:
         }
 
 
+@dataclass
+class RatioStats:
+    """Distribution of a per-call ratio between two deltas of the same
+    call, scaled by a constant. Calls whose denominator is zero are
+    left out. `pooled` is the ratio of the summed deltas, i.e. the
+    call-weighted mean."""
+    count: int
+    pooled: float
+    min_v: float
+    median: float
+    p95: float
+    p99: float
+    max_v: float
+
+    def to_json(self) -> dict:
+        return {
+            "count":  self.count,
+            "pooled": round(self.pooled, 4),
+            "min":    round(self.min_v, 4),
+            "median": round(self.median, 4),
+            "p95":    round(self.p95, 4),
+            "p99":    round(self.p99, 4),
+            "max":    round(self.max_v, 4),
+        }
+
+
+def _ratio_from(nums: list[int], dens: list[int], scale: float = 1.0) -> RatioStats:
+    pairs = [(n, d) for n, d in zip(nums, dens) if d > 0]
+    vals = sorted(n * scale / d for n, d in pairs)
+    if not vals:
+        return RatioStats(count=0, pooled=0.0, min_v=0.0, median=0.0, p95=0.0, p99=0.0, max_v=0.0)
+    return RatioStats(
+        count=len(vals),
+        pooled=sum(n for n, _ in pairs) * scale / sum(d for _, d in pairs),
+        min_v=vals[0],
+        median=statistics.median(vals),
+        p95=percentile(vals, 95),
+        p99=percentile(vals, 99),
+        max_v=vals[-1],
+    )
+
+
+@dataclass
+class DerivedStats:
+    """Per-call metrics relating a scope's four deltas:
+
+      * cycles_per_tsc   — cycles / tsc; below the core:TSC clock ratio
+                           when the CPU halted or clocked down inside
+                           the scope
+      * cmiss_per_kcycle — cache misses per 1000 cycles; rises when a
+                           scope turns memory-bound
+      * bmiss_per_call   — branch mispredicts per call; rises when it
+                           turns control-flow-bound
+    """
+    cycles_per_tsc: RatioStats
+    cmiss_per_kcycle: RatioStats
+    bmiss_per_call: RatioStats
+
+    def to_json(self) -> dict:
+        return {
+            "cycles_per_tsc":   self.cycles_per_tsc.to_json(),
+            "cmiss_per_kcycle": self.cmiss_per_kcycle.to_json(),
+            "bmiss_per_call":   self.bmiss_per_call.to_json(),
+        }
+
+
+def derived_from_deltas(
+    tsc: list[int], cycles: list[int], cache_misses: list[int], branch_misses: list[int],
+) -> DerivedStats | None:
+    """`DerivedStats` of one scope's aligned per-call deltas, or None
+    if the capture has no PMC data (sample mode, or counters off)."""
+    if not any(cycles):
+        return None
+    return DerivedStats(
+        cycles_per_tsc=_ratio_from(cycles, tsc),
+        cmiss_per_kcycle=_ratio_from(cache_misses, cycles, 1000.0),
+        bmiss_per_call=_ratio_from(branch_misses, [1] * len(branch_misses)),
+    )
+
+
+# Warmup detection (`--steady-state`): each scope's calls are cut into
+# windows in TSC order, the per-window tsc medians are smoothed with a
+# rolling median, and a single change point is searched for in the
+# first half of that series.
+WARMUP_WINDOWS = 16     # windows per scope unless --window-tsc is given
+WARMUP_MIN_CALLS = 64   # scopes with fewer calls are never split
+WARMUP_SMOOTH = 3       # rolling-median width, in windows
+WARMUP_SHIFT = 0.10     # level change a warmup must show, relative to steady state
+WARMUP_GAIN = 0.50      # share of the series' deviation the split must explain
+
+
+@dataclass
+class SteadyState:
+    """Request to report steady-state stats: leading warmup calls of
+    every scope are set aside (see `detect_warmup`). `window_tsc` fixes
+    the window width in TSC ticks; 0 splits each scope's calls into
+    `WARMUP_WINDOWS` windows of equal call count."""
+    window_tsc: int = 0
+
+
+@dataclass
+class LatencyWindow:
+    start_tsc: int      # exit tsc of the window's first call
+    calls: int
+    median: int         # median tsc delta of the window's calls
+
+
+@dataclass
+class Warmup:
+    """What `detect_warmup` found for one scope. `calls` leading calls
+    (by exit tsc) ran in the first `windows` windows, before
+    `end_tsc`; `median` is their tsc median. `keep` flags the calls
+    that remain, in the order the deltas were given."""
+    calls: int
+    windows: int
+    end_tsc: int
+    median: int
+    series: list[LatencyWindow]
+    keep: list[bool] = field(repr=False)
+
+    def to_json(self) -> dict:
+        return {
+            "calls": self.calls,
+            "windows": self.windows,
+            "end_tsc": self.end_tsc,
+            "median": self.median,
+            "series": [[w.start_tsc, w.calls, w.median] for w in self.series],
+        }
+
+
+def latency_windows(
+    at: list[int], deltas: list[int], window_tsc: int = 0,
+) -> tuple[list[int], list[LatencyWindow]]:
+    """Cut calls ending at tsc `at` with tsc cost `deltas` into time
+    windows. Returns the call indices in tsc order and one
+    `LatencyWindow` per non-empty window, which covers the next
+    `calls` of those indices."""
+    order = sorted(range(len(at)), key=at.__getitem__)
+    bounds: list[int] = []
+    if window_tsc > 0:
+        base = at[order[0]] if order else 0
+        last = None
+        for pos, i in enumerate(order):
+            w = (at[i] - base) // window_tsc
+            if w != last:
+                bounds.append(pos)
+                last = w
+    else:
+        step = -(-len(order) // WARMUP_WINDOWS) or 1
+        bounds = list(range(0, len(order), step))
+    bounds.append(len(order))
+    series = []
+    for lo, hi in zip(bounds, bounds[1:]):
+        chunk = [deltas[i] for i in order[lo:hi]]
+        series.append(LatencyWindow(
+            start_tsc=at[order[lo]],
+            calls=hi - lo,
+            median=int(statistics.median(chunk)),
+        ))
+    return order, series
+
+
+def _abs_dev(vals: list[float]) -> float:
+    mid = statistics.median(vals)
+    return sum(abs(v - mid) for v in vals)
+
+
+def detect_warmup(at: list[int], deltas: list[int], window_tsc: int = 0) -> Warmup:
+    """Find the warmup phase of one scope's calls (exit tsc `at`, tsc
+    cost `deltas`).
+
+    The window medians from `latency_windows` are smoothed with a
+    centred rolling median of `WARMUP_SMOOTH` windows. The change point
+    is the split k (at most half the series) that minimizes the summed
+    absolute deviation of both sides from their own median. The first
+    k windows are warmup only if the split explains at least
+    `WARMUP_GAIN` of the unsplit deviation and the two levels differ
+    by more than `WARMUP_SHIFT` of the steady one; otherwise no call
+    is excluded."""
+    order, series = latency_windows(at, deltas, window_tsc)
+    k = 0
+    if len(at) >= WARMUP_MIN_CALLS and len(series) >= 2 * WARMUP_SMOOTH:
+        meds = [w.median for w in series]
+        half = WARMUP_SMOOTH // 2
+        smooth = [
+            statistics.median(meds[max(0, i - half):i + half + 1])
+            for i in range(len(meds))
+        ]
+        whole = _abs_dev(smooth)
+        best, best_cost = 0, whole
+        for split in range(1, len(smooth) // 2 + 1):
+            cost = _abs_dev(smooth[:split]) + _abs_dev(smooth[split:])
+            if cost < best_cost:
+                best, best_cost = split, cost
+        if best and whole > 0 and best_cost <= (1 - WARMUP_GAIN) * whole:
+            before = statistics.median(smooth[:best])
+            after = statistics.median(smooth[best:])
+            if abs(before - after) > WARMUP_SHIFT * after:
+                k = best
+
+    cut = sum(w.calls for w in series[:k])
+    keep = [True] * len(at)
+    for i in order[:cut]:
+        keep[i] = False
+    return Warmup(
+        calls=cut,
+        windows=k,
+        end_tsc=series[k].start_tsc if k else 0,
+        median=int(statistics.median([deltas[i] for i in order[:cut]])) if cut else 0,
+        series=series,
+        keep=keep,
+    )
+
+
 @dataclass
 class ScopeStats:
     name: str
@@ -219,6 +920,13 @@ class ScopeStats:
     cycles: MetricStats
     cache_misses: MetricStats
     branch_misses: MetricStats
+    # Set when steady-state stats were asked for: the metrics above
+    # then cover only the calls after the warmup.
+    warmup: Warmup | None = None
+    # Ratios between the four metrics, per call (None without PMC data).
+    derived: DerivedStats | None = None
+    # Trace id; two ids may share a name.
+    id: int | None = None
 
 
 def _metric_from(deltas: list[int]) -> MetricStats:
@@ -234,12 +942,119 @@ def _metric_from(deltas: list[int]) -> MetricStats:
     )
 
 
-def compute_scope_stats(session: Session) -> tuple[list[ScopeStats], int, int]:
-    """Pair enters/exits per (cpu, id) in order. Returns
-    (stats, orphan_enters, orphan_exits).
-
-    For each paired scope we compute deltas across four metrics
-    simultaneously so the dump can be explored with one tool:
+@dataclass
+class ScopeDeltas:
+    """Raw per-call deltas for every paired scope, keyed by trace id.
+    Insertion order is the order each id was first paired, which keeps
+    tie-breaking in the sorted report stable. `at` holds each call's
+    exit tsc, for warmup detection."""
+    tsc: dict[int, list[int]] = field(default_factory=lambda: defaultdict(list))
+    cycles: dict[int, list[int]] = field(default_factory=lambda: defaultdict(list))
+    cache_misses: dict[int, list[int]] = field(default_factory=lambda: defaultdict(list))
+    branch_misses: dict[int, list[int]] = field(default_factory=lambda: defaultdict(list))
+    at: dict[int, list[int]] = field(default_factory=lambda: defaultdict(list))
+    orphan_enters: int = 0
+    orphan_exits: int = 0
+
+    def merge(self, other: "ScopeDeltas") -> None:
+        for mine, theirs in (
+            (self.tsc, other.tsc),
+            (self.at, other.at),
+            (self.cycles, other.cycles),
+            (self.cache_misses, other.cache_misses),
+            (self.branch_misses, other.branch_misses),
+        ):
+            for tid, deltas in theirs.items():
+                mine[tid].extend(deltas)
+        self.orphan_enters += other.orphan_enters
+        self.orphan_exits += other.orphan_exits
+
+
+class OpenScopes:
+    """Enters waiting for their exit, LIFO per (cpu, id).
+
+    Pairing normally restarts at every session. With `stitch`, enters
+    still open when a rolling dump ends are carried into the next
+    session instead, so a scope that straddles the dump — its exit
+    lands after the per-CPU log was reset — still pairs. A CPU's
+    carried enters are dropped as orphans if its first scope record in
+    the next session has an earlier TSC than its last one before the
+    boundary (a reboot, or sessions that were not adjacent).
+    `stitched` counts pairs whose enter came from an earlier session.
+
+    Call `end_session` at each session boundary and `finish` once at
+    the end; `push` takes any payload to hand back from `pop`."""
+
+    def __init__(self, stitch: bool = False) -> None:
+        self.stitch = stitch
+        self.stacks: dict[tuple[int, int], list] = defaultdict(list)
+        self.orphan_enters = 0
+        self.stitched = 0
+        # Per key, how many entries at the bottom of its stack were
+        # carried over a boundary.
+        self._carried: dict[tuple[int, int], int] = {}
+        self._unchecked: set[int] = set()
+        self._last_tsc: dict[int, int] = {}
+
+    def _check(self, cpu: int, tsc: int) -> None:
+        self._unchecked.discard(cpu)
+        if tsc >= self._last_tsc.get(cpu, tsc):
+            return
+        for key in [k for k in self._carried if k[0] == cpu]:
+            # Nothing has been pushed on this CPU since the boundary,
+            # so the carried entries are the whole stack.
+            self.orphan_enters += len(self.stacks[key])
+            self.stacks[key].clear()
+            del self._carried[key]
+
+    def push(self, rec: Record, item: Any) -> None:
+        cpu = rec.cpu
+        if self.stitch:
+            if cpu in self._unchecked:
+                self._check(cpu, rec.tsc)
+            self._last_tsc[cpu] = rec.tsc
+        self.stacks[(cpu, rec.id)].append(item)
+
+    def pop(self, rec: Record) -> Any:
+        """The payload pushed by the enter matching exit `rec`, or None
+        for an orphan exit."""
+        cpu = rec.cpu
+        if self.stitch:
+            if cpu in self._unchecked:
+                self._check(cpu, rec.tsc)
+            self._last_tsc[cpu] = rec.tsc
+        key = (cpu, rec.id)
+        stack = self.stacks.get(key)
+        if not stack:
+            return None
+        carried = self._carried.get(key)
+        if carried and len(stack) <= carried:
+            self.stitched += 1
+            self._carried[key] = carried - 1
+        return stack.pop()
+
+    def end_session(self) -> None:
+        if not self.stitch:
+            self.orphan_enters += sum(len(v) for v in self.stacks.values())
+            self.stacks.clear()
+            return
+        self._carried = {key: len(v) for key, v in self.stacks.items() if v}
+        self._unchecked = {cpu for cpu, _ in self._carried}
+
+    def finish(self) -> int:
+        """Count whatever is still open as orphans; returns the total
+        orphan enters."""
+        self.orphan_enters += sum(len(v) for v in self.stacks.values())
+        self.stacks.clear()
+        self._carried = {}
+        self._unchecked = set()
+        return self.orphan_enters
+
+
+def collect_scope_deltas(session: Session, scopes: OpenScopes | None = None) -> ScopeDeltas:
+    """Pair enters/exits per (cpu, id) in order and collect per-call
+    deltas across four metrics simultaneously so the dump can be
+    explored with one tool:
 
       * tsc          — wall cycles via RDTSC
       * cycles       — PMC-counted cycles-not-halted
@@ -248,59 +1063,1131 @@ def compute_scope_stats(session: Session) -> tuple[list[ScopeStats], int, int]:
 
     Under sample mode the three PMC fields are zero and their deltas
     are trivially zero, which is harmless.
+
+    `scopes` carries open enters in from earlier sessions (see
+    `OpenScopes`); the caller then owns the orphan-enter count.
+    Without it the session is paired on its own.
     """
-    pending: dict[tuple[int, int], list[Record]] = defaultdict(list)
-    tsc_deltas: dict[int, list[int]] = defaultdict(list)
-    cyc_deltas: dict[int, list[int]] = defaultdict(list)
-    cmiss_deltas: dict[int, list[int]] = defaultdict(list)
-    bmiss_deltas: dict[int, list[int]] = defaultdict(list)
-    orphan_exits = 0
+    own = scopes is None
+    if scopes is None:
+        scopes = OpenScopes()
+    out = ScopeDeltas()
 
     for rec in session.records:
-        key = (rec.cpu, rec.id)
         if rec.kind == KIND_TRACE_ENTER:
-            pending[key].append(rec)
+            scopes.push(rec, rec)
         elif rec.kind == KIND_TRACE_EXIT:
-            stack = pending.get(key)
-            if not stack:
-                orphan_exits += 1
+            enter = scopes.pop(rec)
+            if enter is None:
+                out.orphan_exits += 1
                 continue
-            enter = stack.pop()
             dtsc = rec.tsc - enter.tsc
             if dtsc < 0:
                 warn(f"negative tsc delta on id={rec.id} cpu={rec.cpu}, skipping")
                 continue
-            tsc_deltas[rec.id].append(dtsc)
-            cyc_deltas[rec.id].append(max(0, rec.cycles - enter.cycles))
-            cmiss_deltas[rec.id].append(max(0, rec.cache_misses - enter.cache_misses))
-            bmiss_deltas[rec.id].append(max(0, rec.branch_misses - enter.branch_misses))
+            out.tsc[rec.id].append(dtsc)
+            out.cycles[rec.id].append(max(0, rec.cycles - enter.cycles))
+            out.cache_misses[rec.id].append(max(0, rec.cache_misses - enter.cache_misses))
+            out.branch_misses[rec.id].append(max(0, rec.branch_misses - enter.branch_misses))
+            out.at[rec.id].append(rec.tsc)
+
+    if own:
+        out.orphan_enters = scopes.finish()
+    return out
 
-    orphan_enters = sum(len(v) for v in pending.values())
 
+def scope_stats_from_deltas(
+    deltas: ScopeDeltas, names: dict[int, str], steady: SteadyState | None = None,
+) -> list[ScopeStats]:
     out: list[ScopeStats] = []
-    for tid, deltas in tsc_deltas.items():
+    for tid, tsc in deltas.tsc.items():
+        columns = (tsc, deltas.cycles[tid], deltas.cache_misses[tid], deltas.branch_misses[tid])
+        warmup = None
+        if steady is not None:
+            warmup = detect_warmup(deltas.at[tid], tsc, steady.window_tsc)
+            if warmup.calls:
+                columns = tuple(
+                    [d for d, keep in zip(col, warmup.keep) if keep] for col in columns
+                )
         out.append(
             ScopeStats(
-                name=session.names.get(tid, f"id_{tid}"),
-                tsc=_metric_from(deltas),
-                cycles=_metric_from(cyc_deltas[tid]),
-                cache_misses=_metric_from(cmiss_deltas[tid]),
-                branch_misses=_metric_from(bmiss_deltas[tid]),
+                name=names.get(tid, f"id_{tid}"),
+                tsc=_metric_from(columns[0]),
+                cycles=_metric_from(columns[1]),
+                cache_misses=_metric_from(columns[2]),
+                branch_misses=_metric_from(columns[3]),
+                warmup=warmup,
+                derived=derived_from_deltas(*columns),
+                id=tid,
             )
         )
     out.sort(key=lambda s: s.tsc.total, reverse=True)
-    return out, orphan_enters, orphan_exits
+    return out
 
 
-def report_trace(session: Session) -> None:
-    stats, orphan_enters, orphan_exits = compute_scope_stats(session)
+def compute_scope_stats(session: Session) -> tuple[list[ScopeStats], int, int]:
+    """Pair enters/exits per (cpu, id) in order. Returns
+    (stats, orphan_enters, orphan_exits). See `collect_scope_deltas`
+    for the metrics carried per scope."""
+    return compute_pooled_scope_stats([session])[:3]
+
+
+def compute_pooled_scope_stats(
+    sessions: list[Session], stitch: bool = False, steady: SteadyState | None = None,
+) -> tuple[list[ScopeStats], int, int, int]:
+    """Same as `compute_scope_stats`, pooled over several sessions.
+    Returns (stats, orphan_enters, orphan_exits, stitched).
+
+    By default pairing happens within each session. A rolling dump
+    resets every per-CPU log, but the kernel keeps running through it:
+    a scope open when the dump fires exits after it, in the next
+    session. With `stitch`, consecutive `sessions` are treated as one
+    stream per CPU so those exits pair with the enters carried over
+    (see `OpenScopes`); `stitched` is how many pairs that recovered.
+    The per-call deltas of every session are pooled before the
+    percentiles are taken, so N cycles give N times the samples of
+    the last one alone.
+
+    With `steady`, each scope's warmup calls are detected and left out
+    of its stats (see `detect_warmup`); `ScopeStats.warmup` says what
+    was dropped."""
+    if _columnar is not None:
+        return _columnar.pooled_scope_stats(sessions, stitch, steady)
+    scopes = OpenScopes(stitch)
+    pooled = ScopeDeltas()
+    for session in sessions:
+        pooled.merge(collect_scope_deltas(session, scopes))
+        scopes.end_session()
+    stats = scope_stats_from_deltas(pooled, merged_names(sessions), steady)
+    return stats, scopes.finish(), pooled.orphan_exits, scopes.stitched
+
+
+@dataclass
+class CallNode:
+    """One path through the per-CPU scope nesting tree: how often its
+    innermost scope closed under exactly this chain of open scopes,
+    and the tsc it spent there inclusive and exclusive of children."""
+    count: int = 0
+    tsc: int = 0
+    self_tsc: int = 0
+
+
+@dataclass
+class ScopeTree:
+    """Exclusive (self) per-call deltas, keyed by trace id like
+    `ScopeDeltas`, plus the scope call tree keyed by id path from the
+    outermost open scope down."""
+    self_deltas: ScopeDeltas = field(default_factory=ScopeDeltas)
+    calls: dict[tuple[int, ...], CallNode] = field(default_factory=dict)
+
+
+def collect_scope_tree(sessions: list[Session], stitch: bool = False) -> ScopeTree:
+    """Rebuild each CPU's scope nesting from enter/exit order and
+    split every call's deltas into time spent in nested scopes and
+    time of its own.
+
+    Calls are first paired exactly as `compute_pooled_scope_stats`
+    pairs them (LIFO per (cpu, id), per session unless `stitch`), so
+    both see the same calls. Only
+    paired enters then take part in the nesting: a scope that never
+    exits — typically a scheduler switch that resumes another thread —
+    would otherwise sit between a caller and its callees for the rest
+    of the session. A closed call's inclusive deltas are charged to
+    the scope open just below it; its self deltas are its inclusive
+    ones minus everything charged to it, clamped at zero like the
+    inclusive PMC deltas. Calls with a negative tsc delta are skipped
+    here too. Closing a scope that is not innermost (the CPU switched
+    threads inside it) re-parents the scopes still open above it."""
+    records = [rec for session in sessions for rec in session.records]
+    out = ScopeTree()
+    own = out.self_deltas
+
+    # exit index -> enter index, for every pair.
+    partner: dict[int, int] = {}
+    scopes = OpenScopes(stitch)
+    i = 0
+    for session in sessions:
+        for rec in session.records:
+            if rec.kind == KIND_TRACE_ENTER:
+                scopes.push(rec, i)
+            elif rec.kind == KIND_TRACE_EXIT:
+                e = scopes.pop(rec)
+                if e is None:
+                    own.orphan_exits += 1
+                else:
+                    partner[i] = e
+            i += 1
+        scopes.end_session()
+    own.orphan_enters = scopes.finish()
+    paired = set(partner.values())
+
+    # Per CPU: [enter index, id path, child tsc, cycles, cmiss, bmiss].
+    stacks: dict[int, list[list]] = defaultdict(list)
+    for i, rec in enumerate(records):
+        if rec.kind == KIND_TRACE_ENTER:
+            if i not in paired:
+                continue
+            stack = stacks[rec.cpu]
+            path = (stack[-1][1] if stack else ()) + (rec.id,)
+            stack.append([i, path, 0, 0, 0, 0])
+        elif rec.kind == KIND_TRACE_EXIT:
+            e = partner.get(i)
+            if e is None:
+                continue
+            stack = stacks[rec.cpu]
+            pos = len(stack) - 1
+            while stack[pos][0] != e:
+                pos -= 1
+            _, path, c_tsc, c_cyc, c_cmiss, c_bmiss = stack.pop(pos)
+            # Scopes still open above the closed one now nest directly
+            # in what was below it.
+            for j in range(pos, len(stack)):
+                stack[j][1] = (stack[j - 1][1] if j else ()) + (records[stack[j][0]].id,)
+
+            enter = records[e]
+            dtsc = rec.tsc - enter.tsc
+            if dtsc < 0:
+                continue
+            dcyc = max(0, rec.cycles - enter.cycles)
+            dcmiss = max(0, rec.cache_misses - enter.cache_misses)
+            dbmiss = max(0, rec.branch_misses - enter.branch_misses)
+            self_tsc = max(0, dtsc - c_tsc)
+            own.tsc[rec.id].append(self_tsc)
+            own.cycles[rec.id].append(max(0, dcyc - c_cyc))
+            own.cache_misses[rec.id].append(max(0, dcmiss - c_cmiss))
+            own.branch_misses[rec.id].append(max(0, dbmiss - c_bmiss))
+
+            node = out.calls.get(path)
+            if node is None:
+                node = out.calls[path] = CallNode()
+            node.count += 1
+            node.tsc += dtsc
+            node.self_tsc += self_tsc
+
+            if pos:
+                parent = stack[pos - 1]
+                parent[2] += dtsc
+                parent[3] += dcyc
+                parent[4] += dcmiss
+                parent[5] += dbmiss
+
+    return out
+
+
+def compute_self_scope_stats(
+    sessions: list[Session], stitch: bool = False,
+) -> tuple[list[ScopeStats], dict[tuple[int, ...], CallNode]]:
+    """Exclusive counterpart of `compute_pooled_scope_stats`: per-scope
+    stats of self deltas, ranked by self tsc total, and the pooled
+    call tree."""
+    tree = collect_scope_tree(sessions, stitch)
+    return scope_stats_from_deltas(tree.self_deltas, merged_names(sessions)), tree.calls
+
+
+def call_tree_children(
+    calls: dict[tuple[int, ...], CallNode],
+) -> dict[tuple[int, ...], list[tuple[int, ...]]]:
+    """Child paths of every call-tree path (`()` is the root), each
+    list ordered by inclusive tsc, largest first. A path whose
+    enclosing scope never closed still hangs under that scope's
+    path, which then has no `CallNode` of its own."""
+    children: dict[tuple[int, ...], list[tuple[int, ...]]] = defaultdict(list)
+    seen = set(calls)
+    for path in calls:
+        while path:
+            parent = path[:-1]
+            children[parent].append(path)
+            if parent in seen:
+                break
+            seen.add(parent)
+            path = parent
+    empty = CallNode()
+
+    def inclusive(path: tuple[int, ...]) -> int:
+        return calls.get(path, empty).tsc
+
+    for kids in children.values():
+        kids.sort(key=inclusive, reverse=True)
+    return children
+
+
+UNITS = ("ticks", "ns", "us")
+_UNIT_SCALE = {"ns": 1e9, "us": 1e6}
+
+
+@dataclass
+class TscClock:
+    """TSC rate used to express tick deltas as wall time. `source` is
+    where it came from: "cli" (`--tsc-mhz`), "header" (the sessions'
+    `tsc_hz=` field) or "calibrated" (see `calibrate_tsc_hz`)."""
+    hz: float
+    source: str
+
+    def convert(self, ticks: int, unit: str) -> float:
+        return ticks * _UNIT_SCALE[unit] / self.hz
+
+
+@dataclass
+class TimeUnit:
+    """How tsc values are printed in text reports: raw ticks, or
+    converted through `clock` to ns / µs."""
+    name: str = "ticks"
+    clock: TscClock | None = None
+
+    @property
+    def converted(self) -> bool:
+        return self.name != "ticks" and self.clock is not None
+
+    def fmt(self, ticks: int) -> str:
+        if not self.converted:
+            return str(ticks)
+        value = self.clock.convert(ticks, self.name)
+        return f"{value:.0f}" if self.name == "ns" else f"{value:.3f}"
+
+    def title(self, title: str) -> str:
+        return f"{title} ({self.name})" if self.converted else title
+
+
+TICKS = TimeUnit()
+
+
+def header_tsc_hz(sessions: list[Session]) -> int:
+    """The `tsc_hz=` rate the sessions were dumped with, or 0. Every
+    dump of one boot reports the same rate; if they disagree the last
+    one wins, with a warning."""
+    rates = {s.tsc_hz for s in sessions if s.tsc_hz}
+    if len(rates) > 1:
+        warn(f"sessions disagree on tsc_hz ({sorted(rates)}), using the last")
+    for s in reversed(sessions):
+        if s.tsc_hz:
+            return s.tsc_hz
+    return 0
+
+
+# Lowest cycles/tsc of a scope `calibrate_tsc_hz` trusts. The cycles
+# PMC counts unhalted core cycles only, so scopes that halt (idle,
+# waits) fall far below the core/TSC clock ratio and would inflate the
+# calibrated rate by the same factor.
+CALIBRATE_MIN_RATIO = 0.5
+
+
+def calibrate_tsc_hz(stats: list[ScopeStats], cpu_mhz: float) -> float:
+    """Estimate the TSC rate from paired scopes that carry PMC cycle
+    deltas: both counters ran over the same intervals, so the TSC rate
+    is the core clock (`cpu_mhz`, the rate the cycles PMC counts at)
+    scaled by tsc over cycles. That holds only while the core never
+    halts, so scopes whose own cycles/tsc is below
+    `CALIBRATE_MIN_RATIO` are left out and the others' tsc/cycles are
+    averaged weighted by call count. Returns 0 if no scope has PMC
+    cycles (e.g. sample mode) or, with a warning, if every such scope
+    was left out."""
+    weighted = 0.0
+    calls = 0
+    measured = False
+    for s in stats:
+        if not s.cycles.total or not s.tsc.total:
+            continue
+        measured = True
+        if s.cycles.total >= CALIBRATE_MIN_RATIO * s.tsc.total:
+            weighted += s.tsc.count * s.tsc.total / s.cycles.total
+            calls += s.tsc.count
+    if not measured:
+        return 0.0
+    if not calls:
+        warn(f"PMC cycles cover less than {CALIBRATE_MIN_RATIO:g} of tsc in every scope "
+             f"(the core halted inside them); not calibrating the TSC rate from --cpu-mhz")
+        return 0.0
+    return cpu_mhz * 1e6 * weighted / calls
+
+
+def resolve_tsc_clock(
+    sessions: list[Session],
+    tsc_mhz: float | None = None,
+    cpu_mhz: float | None = None,
+    stats: list[ScopeStats] | None = None,
+) -> TscClock | None:
+    """Pick the TSC rate: `--tsc-mhz`, else the sessions' `tsc_hz=`
+    header, else a calibration against `cpu_mhz` over `stats` (pooled
+    scope stats of `sessions` if not given). None if nothing applies."""
+    if tsc_mhz:
+        return TscClock(tsc_mhz * 1e6, "cli")
+    hz = header_tsc_hz(sessions)
+    if hz:
+        return TscClock(float(hz), "header")
+    if cpu_mhz:
+        if stats is None:
+            stats = compute_pooled_scope_stats(sessions)[0]
+        hz = calibrate_tsc_hz(stats, cpu_mhz)
+        if hz:
+            return TscClock(hz, "calibrated")
+    return None
+
+
+# Significant bits kept per histogram bucket. Values below
+# 2**HIST_SIG_BITS get an exact bucket each; above that every power of
+# two is split into 2**(HIST_SIG_BITS - 1) equal-width buckets.
+HIST_SIG_BITS = 8
+
+# Most distinct trace-point args tracked per id in streaming mode.
+# Past this, new args are still counted but no longer tallied
+# individually, and `distinct_args` is reported as a lower bound.
+MAX_POINT_ARGS = 4096
+
+
+def _bucket_of(value: int) -> int:
+    if value < (1 << HIST_SIG_BITS):
+        return value
+    shift = value.bit_length() - HIST_SIG_BITS
+    return (shift << (HIST_SIG_BITS - 1)) + (value >> shift)
+
+
+def _bucket_value(idx: int) -> int:
+    """Representative (midpoint) value of a bucket."""
+    if idx < (1 << HIST_SIG_BITS):
+        return idx
+    shift = (idx >> (HIST_SIG_BITS - 1)) - 1
+    mantissa = idx - (shift << (HIST_SIG_BITS - 1))
+    low = mantissa << shift
+    high = ((mantissa + 1) << shift) - 1
+    return low + (high - low) // 2
+
+
+class LogHistogram:
+    """Mergeable HDR-style histogram of non-negative integer deltas.
+
+    `count`, `total`, `min` and `max` are exact. Quantiles are read
+    back as the midpoint of the bucket holding the requested rank, so
+    for values below 2**HIST_SIG_BITS they are exact and above that
+    the relative error is at most 2**-HIST_SIG_BITS (0.39% at the
+    default 8 bits). The median of an even count averages two such
+    reads and carries the same bound. Bucket count is capped at
+    roughly 64 * 2**(HIST_SIG_BITS - 1) for 64-bit inputs no matter
+    how many values are added.
+    """
+
+    __slots__ = ("buckets", "count", "total", "min_v", "max_v")
+
+    def __init__(self) -> None:
+        self.buckets: dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min_v = 0
+        self.max_v = 0
+
+    def add(self, value: int) -> None:
+        idx = _bucket_of(value)
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+        if self.count == 0:
+            self.min_v = self.max_v = value
+        elif value < self.min_v:
+            self.min_v = value
+        elif value > self.max_v:
+            self.max_v = value
+        self.count += 1
+        self.total += value
+
+    def merge(self, other: "LogHistogram") -> None:
+        if other.count == 0:
+            return
+        for idx, n in other.buckets.items():
+            self.buckets[idx] = self.buckets.get(idx, 0) + n
+        if self.count == 0:
+            self.min_v, self.max_v = other.min_v, other.max_v
+        else:
+            self.min_v = min(self.min_v, other.min_v)
+            self.max_v = max(self.max_v, other.max_v)
+        self.count += other.count
+        self.total += other.total
+
+    def _values_at(self, ranks: list[int]) -> list[int]:
+        # `ranks` must be ascending 0-based positions in sorted order.
+        out: list[int] = []
+        want = iter(ranks)
+        rank = next(want, None)
+        seen = 0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            while rank is not None and rank < seen:
+                out.append(min(self.max_v, max(self.min_v, _bucket_value(idx))))
+                rank = next(want, None)
+            if rank is None:
+                break
+        return out
+
+    def to_metric(self) -> MetricStats:
+        n = self.count
+        if n == 0:
+            return MetricStats(count=0, total=0, min_v=0, median=0, p95=0, p99=0, max_v=0)
+
+        def rank(pct: float) -> int:
+            # Same nearest-rank rule as `percentile`.
+            return max(0, min(n - 1, int(round((pct / 100.0) * (n - 1)))))
+
+        mid_lo, mid_hi = (n - 1) // 2, n // 2
+        ranks = sorted({mid_lo, mid_hi, rank(95), rank(99)})
+        at = dict(zip(ranks, self._values_at(ranks)))
+        # The extreme ranks are known exactly.
+        at[0] = self.min_v
+        at[n - 1] = self.max_v
+        return MetricStats(
+            count=n,
+            total=self.total,
+            min_v=self.min_v,
+            median=int((at[mid_lo] + at[mid_hi]) / 2),
+            p95=at[rank(95)],
+            p99=at[rank(99)],
+            max_v=self.max_v,
+        )
+
+
+@dataclass
+class PointTally:
+    """Occurrence count and per-arg histogram for one trace-point id.
+    `saturated` is set once `MAX_POINT_ARGS` distinct args have been
+    seen; only the streaming engine caps the tally."""
+    count: int = 0
+    args: Counter[int] = field(default_factory=Counter)
+    saturated: bool = False
+
+    def add(self, arg: int, cap: int | None = None) -> None:
+        self.count += 1
+        if arg in self.args or cap is None or len(self.args) < cap:
+            self.args[arg] += 1
+        else:
+            self.saturated = True
+
+    def merge(self, other: "PointTally", cap: int | None = None) -> None:
+        self.count += other.count
+        for arg, n in other.args.items():
+            if arg in self.args or cap is None or len(self.args) < cap:
+                self.args[arg] += n
+            else:
+                self.saturated = True
+        self.saturated = self.saturated or other.saturated
+
+
+def collect_trace_points(sessions: list[Session]) -> dict[int, PointTally]:
+    if _columnar is not None:
+        return _columnar.trace_points(sessions)
+    points: dict[int, PointTally] = defaultdict(PointTally)
+    for rec in all_records(sessions):
+        if rec.kind == KIND_TRACE_POINT:
+            points[rec.id].add(rec.arg)
+    return points
+
+
+@dataclass
+class StreamAccumulator:
+    """Histogram-backed counterpart of `ScopeDeltas` + trace points
+    for one or more sessions. Per scope id, `scopes` holds four
+    histograms in (tsc, cycles, cache_misses, branch_misses) order."""
+    scopes: dict[int, tuple[LogHistogram, ...]] = field(default_factory=dict)
+    points: dict[int, PointTally] = field(default_factory=dict)
+    names: dict[int, str] = field(default_factory=dict)
+    orphan_enters: int = 0
+    orphan_exits: int = 0
+    records: int = 0
+
+    def scope(self, tid: int) -> tuple[LogHistogram, ...]:
+        hists = self.scopes.get(tid)
+        if hists is None:
+            hists = (LogHistogram(), LogHistogram(), LogHistogram(), LogHistogram())
+            self.scopes[tid] = hists
+        return hists
+
+    def point(self, tid: int) -> PointTally:
+        tally = self.points.get(tid)
+        if tally is None:
+            tally = PointTally()
+            self.points[tid] = tally
+        return tally
+
+    def merge(self, other: "StreamAccumulator") -> None:
+        for tid, theirs in other.scopes.items():
+            for mine, h in zip(self.scope(tid), theirs):
+                mine.merge(h)
+        for tid, tally in other.points.items():
+            self.point(tid).merge(tally, cap=MAX_POINT_ARGS)
+        self.names.update(other.names)
+        self.orphan_enters += other.orphan_enters
+        self.orphan_exits += other.orphan_exits
+        self.records += other.records
+
+    def scope_stats(self) -> list[ScopeStats]:
+        out = [
+            ScopeStats(
+                name=self.names.get(tid, f"id_{tid}"),
+                tsc=tsc.to_metric(),
+                cycles=cyc.to_metric(),
+                cache_misses=cmiss.to_metric(),
+                branch_misses=bmiss.to_metric(),
+                id=tid,
+            )
+            for tid, (tsc, cyc, cmiss, bmiss) in self.scopes.items()
+        ]
+        out.sort(key=lambda s: s.tsc.total, reverse=True)
+        return out
+
+
+class StreamingScopeStats:
+    """Single-pass statistics engine. Pass `feed` as the `on_record`
+    sink of `parse_sessions`, then call `finish` with the returned
+    sessions.
+
+    Enter records wait on a per-(cpu, id) stack holding only their
+    four counter values; each exit pops its enter and the deltas go
+    straight into the scope's histograms. Pending stacks are dropped
+    (and counted as orphan enters) at every session boundary, exactly
+    like the list-based path pairs within one session. Memory is
+    O(scopes × buckets) plus whatever one session leaves unpaired.
+
+    Three accumulators are kept: the last session alone, every
+    completed session, and every session — enough to serve both the
+    default last-dump view and `--all-sessions` (including its
+    fallback when nothing completed) without retaining per-session
+    state.
+    """
+
+    def __init__(self) -> None:
+        self.completed = StreamAccumulator()
+        self.everything = StreamAccumulator()
+        self.last = StreamAccumulator()
+        self._session: Session | None = None
+        self._pending: dict[tuple[int, int], list[tuple[int, int, int, int]]] = defaultdict(list)
+
+    def _roll(self, session: Session | None) -> None:
+        prev = self._session
+        if prev is not None:
+            cur = self.last
+            cur.orphan_enters += sum(len(v) for v in self._pending.values())
+            cur.names = dict(prev.names)
+            cur.records = prev.record_count
+            self.everything.merge(cur)
+            if prev.done and prev.mode != "none":
+                self.completed.merge(cur)
+        self._pending.clear()
+        self._session = session
+        if session is not None:
+            self.last = StreamAccumulator()
+
+    def feed(self, session: Session, rec: Record) -> None:
+        if session is not self._session:
+            self._roll(session)
+        acc = self.last
+        kind = rec.kind
+        if kind == KIND_TRACE_ENTER:
+            self._pending[(rec.cpu, rec.id)].append(
+                (rec.tsc, rec.cycles, rec.cache_misses, rec.branch_misses)
+            )
+        elif kind == KIND_TRACE_EXIT:
+            stack = self._pending.get((rec.cpu, rec.id))
+            if not stack:
+                acc.orphan_exits += 1
+                return
+            tsc, cyc, cmiss, bmiss = stack.pop()
+            dtsc = rec.tsc - tsc
+            if dtsc < 0:
+                warn(f"negative tsc delta on id={rec.id} cpu={rec.cpu}, skipping")
+                return
+            h_tsc, h_cyc, h_cmiss, h_bmiss = acc.scope(rec.id)
+            h_tsc.add(dtsc)
+            h_cyc.add(max(0, rec.cycles - cyc))
+            h_cmiss.add(max(0, rec.cache_misses - cmiss))
+            h_bmiss.add(max(0, rec.branch_misses - bmiss))
+        elif kind == KIND_TRACE_POINT:
+            acc.point(rec.id).add(rec.arg, cap=MAX_POINT_ARGS)
+
+    def finish(self, sessions: list[Session]) -> None:
+        """Close the final session. Sessions that produced no records
+        never reached `feed`; they contribute nothing but their
+        metadata, which the caller still has in `sessions`."""
+        if sessions and sessions[-1] is not self._session:
+            # Trailing record-less session: it is the "last" one.
+            self._roll(sessions[-1])
+        self._roll(None)
+
+
+# Assumed TSC rate for `--timeline` timestamps when neither
+# `--tsc-mhz` nor the capture gives one.
+DEFAULT_TSC_MHZ = 1000.0
+
+
+class TimelineWriter:
+    """`--timeline` sink: writes a Chrome Trace Event Format document
+    (loadable in Perfetto or chrome://tracing) while the capture is
+    parsed. Pass `feed` as the `on_record` sink of `parse_sessions`,
+    then call `finish` with the returned sessions.
+
+    Every CPU is a thread of one `kprof` process. A paired scope
+    becomes a complete (`X`) event on its CPU carrying the PMC deltas,
+    trace points and samples become instant events, and the PMC
+    snapshots of every trace record feed a per-CPU counter track.
+    Each rolling dump is marked with a global instant event at its
+    first record. Timestamps are `tsc / tsc_mhz` microseconds; without
+    an explicit `tsc_mhz` each session's `tsc_hz=` header is used, or
+    `DEFAULT_TSC_MHZ` if it has none.
+
+    Only unpaired enters are held, one per open scope, so memory does
+    not grow with the capture. Pairing is LIFO per (cpu, id) like
+    every other report; with `stitch` a scope open across a rolling
+    dump becomes one event spanning the gap (see `OpenScopes`)."""
+
+    def __init__(self, out: IO[str], tsc_mhz: float | None = None, stitch: bool = False) -> None:
+        self.out = out
+        self.tsc_mhz = tsc_mhz
+        self._mhz = tsc_mhz or DEFAULT_TSC_MHZ
+        self.orphan_exits = 0
+        self._session: Session | None = None
+        self._sessions = 0
+        self._cpus: set[int] = set()
+        self._scopes = OpenScopes(stitch)
+        self._first = True
+        out.write('{"traceEvents":[\n')
+        self._event({"name": "process_name", "ph": "M", "pid": 1, "args": {"name": "kprof"}})
+
+    def _event(self, ev: dict) -> None:
+        if not self._first:
+            self.out.write(",\n")
+        self._first = False
+        self.out.write(json.dumps(ev, separators=(",", ":")))
+
+    def _ts(self, tsc: int) -> float:
+        return round(tsc / self._mhz, 3)
+
+    def _roll(self, session: Session | None) -> None:
+        if self._session is not None:
+            self._scopes.end_session()
+        self._session = session
+
+    def feed(self, session: Session, rec: Record) -> None:
+        if session is not self._session:
+            self._roll(session)
+            self._sessions += 1
+            if not self.tsc_mhz and session.tsc_hz:
+                self._mhz = session.tsc_hz / 1e6
+            self._event({
+                "name": f"dump {self._sessions} reason={session.reason}",
+                "cat": "session", "ph": "i", "s": "g", "pid": 1, "tid": rec.cpu,
+                "ts": self._ts(rec.tsc),
+            })
+        cpu = rec.cpu
+        if cpu not in self._cpus:
+            self._cpus.add(cpu)
+            self._event({
+                "name": "thread_name", "ph": "M", "pid": 1, "tid": cpu,
+                "args": {"name": f"cpu{cpu}"},
+            })
+
+        kind = rec.kind
+        if kind in (KIND_TRACE_ENTER, KIND_TRACE_EXIT, KIND_TRACE_POINT) and (
+            rec.cycles or rec.cache_misses or rec.branch_misses
+        ):
+            self._event({
+                "name": f"cpu{cpu} pmc", "ph": "C", "pid": 1, "ts": self._ts(rec.tsc),
+                "args": {
+                    "cycles": rec.cycles,
+                    "cache_misses": rec.cache_misses,
+                    "branch_misses": rec.branch_misses,
+                },
+            })
+
+        if kind == KIND_TRACE_ENTER:
+            self._scopes.push(rec, rec)
+        elif kind == KIND_TRACE_EXIT:
+            enter = self._scopes.pop(rec)
+            if enter is None:
+                self.orphan_exits += 1
+                return
+            if rec.tsc < enter.tsc:
+                return
+            self._event({
+                "name": session.names.get(rec.id, f"id_{rec.id}"),
+                "cat": "scope", "ph": "X", "pid": 1, "tid": cpu,
+                "ts": self._ts(enter.tsc),
+                "dur": round((rec.tsc - enter.tsc) / self._mhz, 3),
+                "args": {
+                    "cycles": max(0, rec.cycles - enter.cycles),
+                    "cache_misses": max(0, rec.cache_misses - enter.cache_misses),
+                    "branch_misses": max(0, rec.branch_misses - enter.branch_misses),
+                },
+            })
+        elif kind == KIND_TRACE_POINT:
+            self._event({
+                "name": session.names.get(rec.id, f"id_{rec.id}"),
+                "cat": "point", "ph": "i", "s": "t", "pid": 1, "tid": cpu,
+                "ts": self._ts(rec.tsc), "args": {"arg": f"0x{rec.arg:x}"},
+            })
+        elif kind == KIND_SAMPLE:
+            self._event({
+                "name": rec.sym or f"0x{rec.ip:x}",
+                "cat": "sample", "ph": "i", "s": "t", "pid": 1, "tid": cpu,
+                "ts": self._ts(rec.tsc), "args": {"ip": f"0x{rec.ip:x}"},
+            })
+
+    def finish(self, sessions: list[Session]) -> None:
+        self._roll(None)
+        other = {
+            "tsc_mhz": self._mhz,
+            "sessions": len(sessions),
+            "mode": sessions[-1].mode if sessions else "",
+            "orphan_enters": self._scopes.finish(),
+            "orphan_exits": self.orphan_exits,
+            "stitched": self._scopes.stitched,
+        }
+        self.out.write('\n],"displayTimeUnit":"ns","otherData":')
+        self.out.write(json.dumps(other, separators=(",", ":")))
+        self.out.write("}\n")
+
+
+@dataclass
+class ScopeCall:
+    """One paired call of a scope, located in the capture: its CPU, its
+    enter/exit tsc, the indices of the sessions holding the enter and
+    the exit (they differ for a call stitched across a dump) and its
+    PMC deltas."""
+    id: int
+    cpu: int
+    enter_tsc: int
+    exit_tsc: int
+    first_session: int
+    last_session: int
+    cycles: int
+    cache_misses: int
+    branch_misses: int
+
+    @property
+    def tsc(self) -> int:
+        return self.exit_tsc - self.enter_tsc
+
+    def contains(self, session: int, tsc: int) -> bool:
+        return self.first_session <= session <= self.last_session and (
+            self.enter_tsc <= tsc <= self.exit_tsc
+        )
+
+
+def _scope_call(enter: Record, exit: Record, first: int, last: int) -> ScopeCall:
+    return ScopeCall(
+        id=exit.id,
+        cpu=exit.cpu,
+        enter_tsc=enter.tsc,
+        exit_tsc=exit.tsc,
+        first_session=first,
+        last_session=last,
+        cycles=max(0, exit.cycles - enter.cycles),
+        cache_misses=max(0, exit.cache_misses - enter.cache_misses),
+        branch_misses=max(0, exit.branch_misses - enter.branch_misses),
+    )
+
+
+class OutlierFinder:
+    """`--outliers` selection: the `k` slowest (by tsc) calls of the
+    scope named `scope` (or `id_<n>`). A record sink: feed it every
+    record in capture order. Calls go through a min-heap capped at `k`
+    entries per session, so memory is O(k) per session plus the open
+    scopes however many calls the capture holds, and `slowest` can
+    still pick among whichever sessions the report settles on once the
+    capture has been read. Ties keep the earlier call. Pairing follows
+    `OpenScopes`.
+
+    `ScopeCall.first_session` / `last_session` index `sessions`, the
+    sessions that had records, in capture order."""
+
+    def __init__(self, scope: str, k: int, stitch: bool = False) -> None:
+        self.scope = scope
+        self.k = k
+        self.sessions: list[Session] = []
+        self._known: list[bool] = []
+        self._heaps: list[list[tuple[int, int, ScopeCall]]] = []
+        self._calls: list[int] = []
+        self._seq = 0
+        self._scopes = OpenScopes(stitch)
+        self._ids: set[int] = set()
+
+    def _roll(self, session: Session) -> None:
+        if self.sessions:
+            self._scopes.end_session()
+        self.sessions.append(session)
+        self._heaps.append([])
+        self._calls.append(0)
+        self._ids = {nid for nid, name in session.names.items() if name == self.scope}
+        m = re.fullmatch(r"id_(\d+)", self.scope)
+        if m:
+            self._ids.add(int(m.group(1)))
+        self._known.append(bool(self._ids))
+
+    def feed(self, session: Session, rec: Record) -> None:
+        if not self.sessions or session is not self.sessions[-1]:
+            self._roll(session)
+        index = len(self.sessions) - 1
+        if rec.kind == KIND_TRACE_ENTER:
+            self._scopes.push(rec, (rec, index))
+        elif rec.kind == KIND_TRACE_EXIT:
+            opened = self._scopes.pop(rec)
+            if opened is None or rec.id not in self._ids:
+                return
+            enter, first = opened
+            if rec.tsc < enter.tsc:
+                return
+            call = _scope_call(enter, rec, first, index)
+            self._calls[index] += 1
+            self._seq += 1
+            item = (call.tsc, -self._seq, call)
+            heap = self._heaps[index]
+            if len(heap) < self.k:
+                heapq.heappush(heap, item)
+            else:
+                heapq.heappushpop(heap, item)
+
+    def finish(self, sessions: list[Session] | None = None) -> None:
+        self._scopes.finish()
+
+    def knows(self, include: set[int] | None = None) -> bool:
+        """Whether any session indexed by `include` (default all) names
+        the scope."""
+        return any(k for i, k in enumerate(self._known) if include is None or i in include)
+
+    def slowest(self, include: set[int] | None = None) -> tuple[list[ScopeCall], int]:
+        """The `k` slowest calls that began and ended in the sessions
+        indexed by `include` (default all), slowest first, and how
+        many calls ended in those sessions."""
+        indexes = [i for i in range(len(self.sessions)) if include is None or i in include]
+        items = [
+            item for i in indexes for item in self._heaps[i]
+            if include is None or item[2].first_session in include
+        ]
+        top = heapq.nlargest(self.k, items)
+        return [call for _, _, call in top], sum(self._calls[i] for i in indexes)
+
+
+@dataclass
+class ContextEvent:
+    """Something recorded inside an outlier's window: a nested scope
+    call (`call`) or a trace point (`arg`)."""
+    cpu: int
+    tsc: int
+    name: str
+    call: ScopeCall | None = None
+    arg: int = 0
+
+
+class OutlierContext:
+    """For each outlier, every trace point and every paired scope call
+    (other than the outlier itself) that lies inside its enter..exit
+    window, on any CPU, ordered by tsc, in `events`. A record sink for
+    the second pass over the capture: sessions are counted as
+    `OutlierFinder` counts them, those not in `include` (default all)
+    are skipped, and pairing is the same."""
+
+    def __init__(
+        self, outliers: list[ScopeCall], stitch: bool = False, include: set[int] | None = None,
+    ) -> None:
+        self.outliers = outliers
+        self.events: list[list[ContextEvent]] = [[] for _ in outliers]
+        self.include = include
+        self._lo = min((c.enter_tsc for c in outliers), default=0)
+        self._hi = max((c.exit_tsc for c in outliers), default=-1)
+        self._scopes = OpenScopes(stitch)
+        self._session: Session | None = None
+        self._index = -1
+        self._active = False
+
+    def _roll(self, session: Session) -> None:
+        if self._active:
+            self._scopes.end_session()
+        self._session = session
+        self._index += 1
+        self._active = self.include is None or self._index in self.include
+
+    def feed(self, session: Session, rec: Record) -> None:
+        if session is not self._session:
+            self._roll(session)
+        if not self._active or not self.outliers:
+            return
+        index = self._index
+        kind = rec.kind
+        if kind == KIND_TRACE_ENTER:
+            self._scopes.push(rec, (rec, index))
+        elif kind == KIND_TRACE_EXIT:
+            opened = self._scopes.pop(rec)
+            if opened is None:
+                return
+            enter, first = opened
+            if enter.tsc < self._lo or rec.tsc > self._hi or rec.tsc < enter.tsc:
+                return
+            call = None
+            for events, outlier in zip(self.events, self.outliers):
+                if not (outlier.contains(first, enter.tsc) and outlier.contains(index, rec.tsc)):
+                    continue
+                if (rec.id, rec.cpu, enter.tsc, rec.tsc) == (
+                    outlier.id, outlier.cpu, outlier.enter_tsc, outlier.exit_tsc,
+                ):
+                    continue
+                call = call or _scope_call(enter, rec, first, index)
+                events.append(ContextEvent(
+                    cpu=rec.cpu, tsc=enter.tsc,
+                    name=session.names.get(rec.id, f"id_{rec.id}"), call=call,
+                ))
+        elif kind == KIND_TRACE_POINT and self._lo <= rec.tsc <= self._hi:
+            for events, outlier in zip(self.events, self.outliers):
+                if outlier.contains(index, rec.tsc):
+                    events.append(ContextEvent(
+                        cpu=rec.cpu, tsc=rec.tsc,
+                        name=session.names.get(rec.id, f"id_{rec.id}"), arg=rec.arg,
+                    ))
+
+    def finish(self, sessions: list[Session] | None = None) -> None:
+        for events in self.events:
+            events.sort(key=lambda ev: ev.tsc)
+
+
+def collect_outlier_context(
+    sessions: list[Session], outliers: list[ScopeCall], stitch: bool = False,
+) -> list[list[ContextEvent]]:
+    """`OutlierContext` of `outliers` over in-memory `sessions`."""
+    context = OutlierContext(outliers, stitch)
+    for session in sessions:
+        for rec in session.records:
+            context.feed(session, rec)
+    context.finish(sessions)
+    return context.events
+
+
+def report_outliers(
+    sessions: list[Session],
+    scope: str,
+    k: int,
+    time_unit: TimeUnit = TICKS,
+    stitch: bool = False,
+    path: str | None = None,
+    finder: OutlierFinder | None = None,
+) -> int:
+    """`--outliers` over the selected `sessions`. Without `finder`,
+    both passes run over the sessions' records. With `path` and a
+    `finder` already fed by a streamed pass over it (see `scan`), the
+    capture is never held: the outliers are picked from the finder's
+    heaps for `sessions`, and a second streamed pass over `path`
+    collects their context. That first pass pairs every session,
+    selected or not, so a scope stitched across a dropped incomplete
+    session is not paired as it would be in memory."""
+    if finder is None:
+        finder = OutlierFinder(scope, k, stitch)
+        for session in sessions:
+            for rec in session.records:
+                finder.feed(session, rec)
+        finder.finish(sessions)
+    # Session numbers in the report count the selected sessions.
+    position = {id(s): n for n, s in enumerate(sessions)}
+    order = {i: position[id(s)] for i, s in enumerate(finder.sessions) if id(s) in position}
+    if not finder.knows(set(order)):
+        print(f"parse_kprof.py: error: no trace scope named {scope!r}", file=sys.stderr)
+        return 2
+    outliers, calls = finder.slowest(set(order))
+    if path is None:
+        context = collect_outlier_context(sessions, outliers, stitch)
+    else:
+        sink = OutlierContext(outliers, stitch, set(order))
+        with record_warnings(echo=False):
+            # The first pass already warned about the same lines.
+            scan(path, sink)
+        context = sink.events
+    outliers = [
+        replace(c, first_session=order[c.first_session], last_session=order[c.last_session])
+        for c in outliers
+    ]
+    render_outliers(scope, calls, outliers, context, time_unit)
+    return 0
+
+
+def render_outliers(
+    scope: str,
+    calls: int,
+    outliers: list[ScopeCall],
+    context: list[list[ContextEvent]],
+    time_unit: TimeUnit = TICKS,
+) -> None:
+    """Each outlier with its PMC deltas, then its window: events on
+    the outlier's own CPU first, then the other CPUs', each with its
+    tsc offset from the outlier's enter."""
+    print(f"=== Outliers: {scope} ({len(outliers)} slowest of {calls} calls) ===")
+    if time_unit.converted:
+        clock = time_unit.clock
+        print(f"tsc rate: {clock.hz / 1e6:.3f} MHz ({clock.source})")
+    if not outliers:
+        print("(no paired calls)")
+        return
+    fmt = time_unit.fmt
+    unit = "" if time_unit.name == "ticks" else f"_{time_unit.name}"
+    for rank, (call, events) in enumerate(zip(outliers, context), 1):
+        where = f"session={call.first_session + 1}"
+        if call.last_session != call.first_session:
+            where = f"sessions={call.first_session + 1}-{call.last_session + 1}"
+        print()
+        print(
+            f"#{rank} cpu={call.cpu} window={call.enter_tsc}..{call.exit_tsc} {where} "
+            f"tsc{unit}={fmt(call.tsc)} cycles={call.cycles} "
+            f"cache_misses={call.cache_misses} branch_misses={call.branch_misses}"
+        )
+        if not events:
+            print("  (nothing else recorded in this window)")
+            continue
+        for same_cpu in (True, False):
+            for ev in events:
+                if (ev.cpu == call.cpu) != same_cpu:
+                    continue
+                offset = f"+{fmt(ev.tsc - call.enter_tsc)}"
+                if ev.call is not None:
+                    c = ev.call
+                    detail = (
+                        f"scope {ev.name} tsc{unit}={fmt(c.tsc)} cycles={c.cycles} "
+                        f"cache_misses={c.cache_misses} branch_misses={c.branch_misses}"
+                    )
+                else:
+                    detail = f"point {ev.name} arg=0x{ev.arg:x}"
+                print(f"  cpu={ev.cpu:<3} {offset:>14}  {detail}")
+
+
+def all_records(sessions: list[Session]) -> Iterable[Record]:
+    for session in sessions:
+        yield from session.records
+
+
+def report_trace(
+    sessions: list[Session],
+    self_time: bool = False,
+    time_unit: TimeUnit = TICKS,
+    stitch: bool = False,
+    steady: SteadyState | None = None,
+) -> None:
+    stats, orphan_enters, orphan_exits, stitched = compute_pooled_scope_stats(sessions, stitch, steady)
+    self_stats, calls = compute_self_scope_stats(sessions, stitch) if self_time else (None, None)
+    render_trace(
+        stats, orphan_enters, orphan_exits,
+        collect_trace_points(sessions), merged_names(sessions),
+        self_stats, calls, time_unit, stitched,
+    )
+
+
+def render_trace(
+    stats: list[ScopeStats],
+    orphan_enters: int,
+    orphan_exits: int,
+    points: dict[int, PointTally],
+    names: dict[int, str],
+    self_stats: list[ScopeStats] | None = None,
+    calls: dict[tuple[int, ...], CallNode] | None = None,
+    time_unit: TimeUnit = TICKS,
+    stitched: int = 0,
+) -> None:
     print("=== Trace scopes (paired enter/exit) ===")
+    if time_unit.converted:
+        clock = time_unit.clock
+        print(f"tsc rate: {clock.hz / 1e6:.3f} MHz ({clock.source})")
     if not stats:
         print("(no paired scopes)")
     else:
         # Two tables: one for wall-time (tsc) and one per PMC metric
         # so columns stay narrow enough to read in a terminal.
-        _render_metric_table("tsc", stats, lambda s: s.tsc)
+        _render_metric_table(time_unit.title("tsc"), stats, lambda s: s.tsc, time_unit.fmt)
         print()
         _render_metric_table("cycles (PMC)", stats, lambda s: s.cycles)
         print()
@@ -308,22 +2195,67 @@ def report_trace(session: Session) -> None:
         print()
         _render_metric_table("branch_misses (PMC)", stats, lambda s: s.branch_misses)
         print()
+        if any(s.derived is not None for s in stats):
+            render_derived(stats)
+            print()
         for s in stats:
+            wall = ""
+            if time_unit.converted:
+                unit = time_unit.name
+                wall = (
+                    f" tsc_med_{unit}={time_unit.fmt(s.tsc.median)}"
+                    f" tsc_total_{unit}={time_unit.fmt(s.tsc.total)}"
+                )
+            if s.warmup is not None:
+                wall += f" warmup_calls={s.warmup.calls}"
             print(
                 f"[KPROF-SUMMARY] scope={s.name} count={s.tsc.count} "
                 f"tsc_med={s.tsc.median} tsc_total={s.tsc.total} "
                 f"cyc_med={s.cycles.median} cyc_total={s.cycles.total} "
                 f"cmiss_med={s.cache_misses.median} cmiss_total={s.cache_misses.total} "
                 f"bmiss_med={s.branch_misses.median} bmiss_total={s.branch_misses.total}"
+                f"{wall}"
             )
-    if orphan_enters or orphan_exits:
+        if any(s.warmup is not None for s in stats):
+            print()
+            render_warmup(stats, time_unit)
+    if self_stats is not None and calls is not None:
+        print()
+        render_self_time(self_stats, calls, names, time_unit)
+    if orphan_enters or orphan_exits or stitched:
         print()
+    if orphan_enters or orphan_exits:
         print(f"orphans: enters={orphan_enters} exits={orphan_exits}")
+    if stitched:
+        print(f"stitched across dumps: {stitched}")
+
+    render_trace_points(points, names)
+
 
-    report_trace_points(session)
+def render_warmup(stats: list[ScopeStats], time_unit: TimeUnit = TICKS) -> None:
+    """Scopes whose leading calls `detect_warmup` excluded from the
+    steady-state stats, with the tsc median on either side of the
+    change point."""
+    print("=== Warmup (excluded from the stats above) ===")
+    warm = [s for s in stats if s.warmup is not None and s.warmup.calls]
+    if not warm:
+        print("(no warmup detected)")
+        return
+    header = (
+        f"{'name':<32} {'calls':>8} {'windows':>8} "
+        f"{'warmup_med':>12} {'steady_med':>12} {'end_tsc':>16}"
+    )
+    print(header)
+    print("-" * len(header))
+    for s in warm:
+        w = s.warmup
+        print(
+            f"{s.name:<32} {w.calls:>8} {f'{w.windows}/{len(w.series)}':>8} "
+            f"{time_unit.fmt(w.median):>12} {time_unit.fmt(s.tsc.median):>12} {w.end_tsc:>16}"
+        )
 
 
-def _render_metric_table(title: str, stats: list[ScopeStats], pick) -> None:
+def _render_metric_table(title: str, stats: list[ScopeStats], pick, fmt=str) -> None:
     print(f"--- {title} ---")
     header = (
         f"{'name':<32} {'count':>8} {'min':>12} {'median':>12} "
@@ -334,161 +2266,1049 @@ def _render_metric_table(title: str, stats: list[ScopeStats], pick) -> None:
     for s in stats:
         m = pick(s)
         print(
-            f"{s.name:<32} {m.count:>8d} {m.min_v:>12d} {m.median:>12d} "
-            f"{m.p95:>14d} {m.p99:>14d} {m.max_v:>14d} {m.total:>16d}"
+            f"{s.name:<32} {m.count:>8d} {fmt(m.min_v):>12} {fmt(m.median):>12} "
+            f"{fmt(m.p95):>14} {fmt(m.p99):>14} {fmt(m.max_v):>14} {fmt(m.total):>16}"
         )
 
 
-def report_trace_points(session: Session) -> None:
+def render_derived(stats: list[ScopeStats]) -> None:
+    """Median and p95 of each `DerivedStats` ratio per scope; for
+    cycles/tsc the pooled ratio replaces p95."""
+    print("--- derived (per call) ---")
+    header = (
+        f"{'name':<32} {'cyc/tsc':>9} {'pooled':>9} "
+        f"{'cmiss/kcyc':>11} {'p95':>9} {'bmiss/call':>11} {'p95':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for s in stats:
+        d = s.derived
+        if d is None:
+            continue
+        print(
+            f"{s.name:<32} {d.cycles_per_tsc.median:>9.3f} {d.cycles_per_tsc.pooled:>9.3f} "
+            f"{d.cmiss_per_kcycle.median:>11.2f} {d.cmiss_per_kcycle.p95:>9.2f} "
+            f"{d.bmiss_per_call.median:>11.1f} {d.bmiss_per_call.p95:>9.1f}"
+        )
+
+
+def render_self_time(
+    self_stats: list[ScopeStats],
+    calls: dict[tuple[int, ...], CallNode],
+    names: dict[int, str],
+    time_unit: TimeUnit = TICKS,
+) -> None:
+    print("=== Trace scopes (self, nested scopes excluded) ===")
+    if not self_stats:
+        print("(no paired scopes)")
+        return
+    _render_metric_table(time_unit.title("self tsc"), self_stats, lambda s: s.tsc, time_unit.fmt)
+    print()
+    _render_metric_table("self cycles (PMC)", self_stats, lambda s: s.cycles)
+    print()
+    _render_metric_table("self cache_misses (PMC)", self_stats, lambda s: s.cache_misses)
+    print()
+    _render_metric_table("self branch_misses (PMC)", self_stats, lambda s: s.branch_misses)
+    print()
+    render_call_tree(calls, names, time_unit)
+
+
+def render_call_tree(
+    calls: dict[tuple[int, ...], CallNode],
+    names: dict[int, str],
+    time_unit: TimeUnit = TICKS,
+) -> None:
+    """Indented scope call tree. `count` is the number of calls along
+    that edge; a scope that never closed shows `-`."""
+    print(f"--- {time_unit.title('call tree (tsc)')} ---")
+    fmt = time_unit.fmt
+    header = f"{'count':>8} {'total':>16} {'self':>16}  scope"
+    print(header)
+    print("-" * len(header))
+    children = call_tree_children(calls)
+    todo = list(reversed(children.get((), [])))
+    while todo:
+        path = todo.pop()
+        name = "  " * (len(path) - 1) + names.get(path[-1], f"id_{path[-1]}")
+        node = calls.get(path)
+        if node is None:
+            print(f"{'-':>8} {'-':>16} {'-':>16}  {name}")
+        else:
+            print(f"{node.count:>8d} {fmt(node.tsc):>16} {fmt(node.self_tsc):>16}  {name}")
+        todo.extend(reversed(children.get(path, [])))
+
+
+def report_trace_points(sessions: list[Session]) -> None:
+    render_trace_points(collect_trace_points(sessions), merged_names(sessions))
+
+
+def render_trace_points(points: dict[int, PointTally], names: dict[int, str]) -> None:
     # Trace points (kind=3).
-    points: dict[int, list[int]] = defaultdict(list)
-    for rec in session.records:
-        if rec.kind == KIND_TRACE_POINT:
-            points[rec.id].append(rec.arg)
     if points:
         print()
         print("=== Trace points (single-shot) ===")
-        for tid, args in sorted(points.items(), key=lambda kv: -len(kv[1])):
-            name = session.names.get(tid, f"id_{tid}")
-            print(f"{name}: count={len(args)}")
-            distinct = Counter(args)
+        for tid, tally in sorted(points.items(), key=lambda kv: -kv[1].count):
+            name = names.get(tid, f"id_{tid}")
+            print(f"{name}: count={tally.count}")
+            distinct = tally.args
             if len(distinct) > 1:
                 top = distinct.most_common(10)
                 for arg_val, cnt in top:
                     print(f"  arg=0x{arg_val:x} count={cnt}")
-            print(f"[KPROF-SUMMARY] trace_point={name} count={len(args)} distinct_args={len(distinct)}")
+            n_distinct = f"{len(distinct)}+" if tally.saturated else f"{len(distinct)}"
+            print(f"[KPROF-SUMMARY] trace_point={name} count={tally.count} distinct_args={n_distinct}")
 
 
-def report_sample(session: Session) -> None:
-    samples = [r for r in session.records if r.kind == KIND_SAMPLE]
+@dataclass
+class SampleStack:
+    """One PMU sample: the interrupted `ip` followed by the return
+    addresses of its callers, outward, with the kernel-resolved symbol
+    of each ("" when the dump carries none)."""
+    cpu: int
+    ips: list[int]
+    syms: list[str]
+
+
+def collect_sample_stacks(records: Iterable[Record]) -> list[SampleStack]:
+    """Assemble samples from a `sample` record plus the
+    `sample_frame` records (arg = depth 1, 2, ...) that follow it on
+    the same CPU. A frame whose depth does not continue the stack is
+    dropped; any other record ends the stack in progress, as in
+    `flamegraph.parse_stacks`."""
+    out: list[SampleStack] = []
+    open_stacks: dict[int, SampleStack] = {}
+    for rec in records:
+        kind = rec.kind
+        if kind == KIND_SAMPLE:
+            stack = SampleStack(cpu=rec.cpu, ips=[rec.ip], syms=[rec.sym])
+            open_stacks[rec.cpu] = stack
+            out.append(stack)
+        elif kind == KIND_SAMPLE_FRAME:
+            stack = open_stacks.get(rec.cpu)
+            if stack is not None and rec.arg == len(stack.ips):
+                stack.ips.append(rec.ip)
+                stack.syms.append(rec.sym)
+        else:
+            open_stacks.pop(rec.cpu, None)
+    return out
+
+
+@dataclass
+class SampleRow:
+    """One line of the sample histogram: samples whose leaf is `label`
+    (`self_count`, also split per CPU) and samples with `label`
+    anywhere on their stack (`total`)."""
+    label: str
+    self_count: int = 0
+    total: int = 0
+    per_cpu: Counter = field(default_factory=Counter)
+
+
+def _sample_label(ip: int, sym: str, by: str) -> str:
+    if by == "ip":
+        return f"0x{ip:016x} {sym}" if sym else f"0x{ip:016x}"
+    return sym if sym and sym != "?" else f"0x{ip:x}"
+
+
+def aggregate_samples(
+    stacks: list[SampleStack], by: str = "sym", lines: Any = None,
+) -> list[SampleRow]:
+    """Sample histogram keyed `by` the leaf's symbol, the leaf's `ip`,
+    the `caller->leaf` edge (`<root>` for a leaf without frames), or —
+    through a `kprof_lines.LineIndex` — the leaf's source `line` or
+    basic `block`. Unresolved symbols and addresses fall back to the
+    ip. `total` counts each sample once per key on its stack, so
+    recursion is not double-counted; for `caller` it counts the edge
+    anywhere on the stack. Rows are ordered by self count, then total."""
+    rows: dict[str, SampleRow] = {}
+
+    def row(label: str) -> SampleRow:
+        r = rows.get(label)
+        if r is None:
+            r = rows[label] = SampleRow(label)
+        return r
+
+    sym_by = "ip" if by == "ip" else "sym"
+    for stack in stacks:
+        if by in SAMPLE_BY_LINES:
+            labels = [lines.label(ip, by) or f"0x{ip:x}" for ip in stack.ips]
+        else:
+            labels = [_sample_label(ip, sym, sym_by) for ip, sym in zip(stack.ips, stack.syms)]
+        if by == "caller":
+            callers = labels[1:] + ["<root>"]
+            keys = [f"{caller}->{callee}" for callee, caller in zip(labels, callers)]
+        else:
+            keys = labels
+        leaf = row(keys[0])
+        leaf.self_count += 1
+        leaf.per_cpu[stack.cpu] += 1
+        for key in dict.fromkeys(keys):
+            row(key).total += 1
+    return sorted(rows.values(), key=lambda r: (-r.self_count, -r.total))
+
+
+# `--by line` / `--by block` need `--lines DB` (see `kprof_lines.py`).
+SAMPLE_BY_LINES = ("line", "block")
+SAMPLE_BY = ("sym", "ip", "caller") + SAMPLE_BY_LINES
+SAMPLE_TOP = 20
+
+
+def _render_sample_self(
+    rows: list[SampleRow], by: str, total: int, cpus: list[int], top: int, what: str = "",
+) -> None:
+    width = max([len("name"), len(by)] + [len(r.label) for r in rows[:top]])
+    cpu_cols = "".join(f" {f'cpu{c}':>7}" for c in cpus)
+    header = (
+        f"{by:<{width}} {'self':>8} {'self%':>7} {'total':>8} {'total%':>7}{cpu_cols}"
+    )
+    print(f"--- top {min(top, len(rows))}{what} by self samples ---")
+    print(header)
+    print("-" * len(header))
+    for r in rows[:top]:
+        self_pct = r.self_count * 100.0 / total
+        total_pct = r.total * 100.0 / total
+        split = "".join(f" {r.per_cpu[c]:>7}" for c in cpus)
+        print(
+            f"{r.label:<{width}} {r.self_count:>8} {self_pct:>6.2f}% "
+            f"{r.total:>8} {total_pct:>6.2f}%{split}"
+        )
+
+
+def report_sample(
+    sessions: list[Session], by: str = "sym", top: int = SAMPLE_TOP, lines: Any = None,
+) -> None:
+    """`--sample`. With `lines` (a `kprof_lines.LineIndex`), the KASLR
+    slide is inferred from the samples' `sym=` names, and per-line and
+    per-basic-block hotspot tables follow the main one."""
+    stacks = collect_sample_stacks(all_records(sessions))
     print("=== PMU sample histogram ===")
-    if not samples:
+    if not stacks:
         print("(no samples)")
         return
 
-    per_cpu: Counter[int] = Counter()
-    ip_hist: Counter[int] = Counter()
-    for r in samples:
-        per_cpu[r.cpu] += 1
-        ip_hist[r.ip] += 1
-
-    total = len(samples)
-    print(f"total samples: {total}")
+    per_cpu: Counter[int] = Counter(st.cpu for st in stacks)
+    total = len(stacks)
+    framed = sum(1 for st in stacks if len(st.ips) > 1)
+    print(f"total samples: {total} ({framed} with caller frames)")
     for cpu in sorted(per_cpu):
         print(f"  cpu{cpu}: {per_cpu[cpu]}")
+    if lines is not None:
+        slide = lines.infer_slide(
+            (ip, sym) for st in stacks for ip, sym in zip(st.ips, st.syms) if sym
+        )
+        source = f"{lines.db_path} arch={lines.arch or '?'} commit={lines.commit or '?'}"
+        if slide is None:
+            warn("no sample symbol matches the indexer database; assuming KASLR slide 0")
+            print(f"lines: {source}, slide 0x0 (assumed)")
+        else:
+            lines.slide = slide.slide
+            print(
+                f"lines: {source}, slide 0x{slide.slide:x} "
+                f"({slide.matched}/{slide.candidates} symbolized frames agree)"
+            )
     print()
-    print(f"{'ip':<20} {'count':>10} {'pct':>8}")
-    print("-" * 40)
-    for ip, cnt in ip_hist.most_common(20):
-        pct = (cnt / total) * 100.0
-        print(f"0x{ip:016x}  {cnt:>10d} {pct:>7.2f}%")
-        print(f"[KPROF-SUMMARY] sample ip=0x{ip:x} count={cnt} pct={pct:.2f}")
 
+    rows = aggregate_samples(stacks, by, lines)
+    cpus = sorted(per_cpu)
+    _render_sample_self(rows, by, total, cpus, top)
 
-def report_raw(session: Session) -> None:
-    for r in session.records:
+    if framed:
+        by_total = sorted(rows, key=lambda r: -r.total)[:top]
+        print()
+        print(f"--- top {len(by_total)} by total (inclusive) samples ---")
+        width = max([len(by)] + [len(r.label) for r in by_total])
+        header = f"{by:<{width}} {'total':>8} {'total%':>7} {'self':>8}"
+        print(header)
+        print("-" * len(header))
+        for r in by_total:
+            print(
+                f"{r.label:<{width}} {r.total:>8} {r.total * 100.0 / total:>6.2f}% "
+                f"{r.self_count:>8}"
+            )
+
+    if lines is not None:
+        for extra, what in (("line", " source lines"), ("block", " basic blocks")):
+            if extra != by:
+                print()
+                _render_sample_self(
+                    aggregate_samples(stacks, extra, lines), extra, total, cpus, top, what,
+                )
+
+    print()
+    for r in rows[:top]:
+        key = r.label.replace(" ", " sym=", 1) if by == "ip" else r.label
+        print(
+            f"[KPROF-SUMMARY] sample {by}={key} "
+            f"self={r.self_count} total={r.total} "
+            f"pct={r.self_count * 100.0 / total:.2f}"
+        )
+
+
+def report_raw(sessions: list[Session]) -> None:
+    for r in all_records(sessions):
         print(json.dumps(r.to_json()))
 
 
-def report_summary(session: Session) -> None:
+def _report_session_header(session: Session) -> None:
     print(f"session: cpus={session.cpus} mode={session.mode} reason={session.reason}")
-    print(f"names: {len(session.names)} | records: {len(session.records)}")
+    print(f"names: {len(session.names)} | records: {session.record_count}")
     for cpu, block in sorted(session.cpu_blocks.items()):
         marker = "" if block.closed else " (UNCLOSED)"
         print(f"  cpu{cpu}: declared={block.declared_records} overflowed={block.overflowed}{marker}")
+
+
+def report_summary(
+    sessions: list[Session],
+    self_time: bool = False,
+    time_unit: TimeUnit = TICKS,
+    stitch: bool = False,
+    steady: SteadyState | None = None,
+    sample_by: str = "sym",
+    sample_top: int = SAMPLE_TOP,
+    sample_lines: Any = None,
+) -> None:
+    for session in sessions:
+        _report_session_header(session)
     print()
-    if session.mode == "trace":
-        report_trace(session)
-    elif session.mode == "sample":
-        report_sample(session)
+    mode = sessions[-1].mode
+    if mode == "trace":
+        report_trace(sessions, self_time, time_unit, stitch, steady)
+    elif mode == "sample":
+        report_sample(sessions, sample_by, sample_top, sample_lines)
     else:
         # Auto: show whatever data is present.
-        if any(r.kind in (KIND_TRACE_ENTER, KIND_TRACE_EXIT, KIND_TRACE_POINT) for r in session.records):
-            report_trace(session)
-        if any(r.kind == KIND_SAMPLE for r in session.records):
-            report_sample(session)
+        if any(r.kind in (KIND_TRACE_ENTER, KIND_TRACE_EXIT, KIND_TRACE_POINT) for r in all_records(sessions)):
+            report_trace(sessions, self_time, time_unit, stitch, steady)
+        if any(r.kind == KIND_SAMPLE for r in all_records(sessions)):
+            report_sample(sessions, sample_by, sample_top, sample_lines)
+
+
+def report_sessions(
+    sessions: list[Session],
+    self_time: bool = False,
+    time_unit: TimeUnit = TICKS,
+    stitch: bool = False,
+    steady: SteadyState | None = None,
+) -> None:
+    """Per-session tsc table for every cycle, then the pooled trace
+    report. Useful to eyeball whether one rolling dump is an outlier
+    before trusting the pooled medians. `steady` applies to the pooled
+    report only."""
+    for idx, session in enumerate(sessions):
+        stats, orphan_enters, orphan_exits = compute_scope_stats(session)
+        print(
+            f"=== Session {idx + 1}/{len(sessions)}: reason={session.reason} "
+            f"records={session.record_count} "
+            f"orphans={orphan_enters}/{orphan_exits} ==="
+        )
+        if stats:
+            _render_metric_table(time_unit.title("tsc"), stats, lambda s: s.tsc, time_unit.fmt)
+        else:
+            print("(no paired scopes)")
+        print()
+    print(f"=== Pooled over {len(sessions)} session(s) ===")
+    report_trace(sessions, self_time, time_unit, stitch, steady)
+
+
+def _ns_json(m: MetricStats, clock: TscClock) -> dict:
+    """`m` (tsc ticks) as whole nanoseconds."""
+    def ns(ticks: int) -> int:
+        return round(clock.convert(ticks, "ns"))
+
+    return {
+        "total":  ns(m.total),
+        "min":    ns(m.min_v),
+        "median": ns(m.median),
+        "p95":    ns(m.p95),
+        "p99":    ns(m.p99),
+        "max":    ns(m.max_v),
+    }
 
 
-def usage() -> None:
-    print(
-        "usage: parse_kprof.py <path|-> [--trace|--sample|--raw|--json]",
-        file=sys.stderr,
-    )
+def _scope_json(
+    stats: list[ScopeStats],
+    self_stats: list[ScopeStats] | None = None,
+    clock: TscClock | None = None,
+) -> list[dict]:
+    out = [
+        {
+            "name":  s.name,
+            "count": s.tsc.count,
+            "tsc":   s.tsc.to_json(),
+            "cycles": s.cycles.to_json(),
+            "cache_misses":  s.cache_misses.to_json(),
+            "branch_misses": s.branch_misses.to_json(),
+        }
+        for s in stats
+    ]
+    if clock is not None:
+        for entry, s in zip(out, stats):
+            entry["ns"] = _ns_json(s.tsc, clock)
+    for entry, s in zip(out, stats):
+        if s.derived is not None:
+            entry["derived"] = s.derived.to_json()
+        if s.warmup is not None:
+            entry["warmup"] = s.warmup.to_json()
+    if self_stats is not None:
+        own = {s.id: s for s in self_stats}
+        for entry, incl in zip(out, stats):
+            s = own.get(incl.id)
+            if s is None:
+                continue
+            entry["self"] = {
+                "tsc":   s.tsc.to_json(),
+                "cycles": s.cycles.to_json(),
+                "cache_misses":  s.cache_misses.to_json(),
+                "branch_misses": s.branch_misses.to_json(),
+            }
+            if clock is not None:
+                entry["self"]["ns"] = _ns_json(s.tsc, clock)
+    return out
+
+
+def _clock_json(doc: dict, clock: TscClock | None) -> None:
+    if clock is not None:
+        doc["tsc_hz"] = round(clock.hz)
+        doc["tsc_hz_source"] = clock.source
+
+
+def _call_tree_json(calls: dict[tuple[int, ...], CallNode], names: dict[int, str]) -> list[dict]:
+    children = call_tree_children(calls)
+    empty = CallNode()
+
+    def node_json(path: tuple[int, ...]) -> dict:
+        node = calls.get(path, empty)
+        return {
+            "name":  names.get(path[-1], f"id_{path[-1]}"),
+            "count": node.count,
+            "tsc_total":  node.tsc,
+            "self_total": node.self_tsc,
+            "children": [node_json(child) for child in children.get(path, [])],
+        }
 
+    return [node_json(path) for path in children.get((), [])]
 
-def report_json(session: Session) -> None:
+
+def json_report(
+    sessions: list[Session],
+    per_session: bool = False,
+    self_time: bool = False,
+    clock: TscClock | None = None,
+    stitch: bool = False,
+    steady: SteadyState | None = None,
+) -> dict:
     """Machine-readable scope summary for CI drift-detection pipelines.
-    Emits a single JSON document with session metadata + per-scope
-    stats (tsc / cycles / cache_misses / branch_misses medians and
-    totals). Mirrors the data shown by `--trace` / `[KPROF-SUMMARY]`
-    lines, in a form trivial to diff across runs."""
-    stats, orphan_enters, orphan_exits = compute_scope_stats(session)
+    Builds the single document `--json` prints: session metadata +
+    per-scope stats (tsc / cycles / cache_misses / branch_misses
+    medians and totals). Mirrors the data shown by `--trace` / `[KPROF-SUMMARY]`
+    lines, in a form trivial to diff across runs.
+
+    With `per_session`, `scopes` holds the pooled stats and a
+    `sessions` array carries the same document for each cycle.
+
+    With `self_time`, every scope also carries a `self` object with
+    the same four metrics computed over exclusive deltas, and the
+    pooled document gains a `call_tree` of nested scope paths with
+    per-edge call counts and tsc totals.
+
+    With a `clock`, the document records the TSC rate (`tsc_hz`,
+    `tsc_hz_source`) and every scope's tsc stats are repeated in
+    nanoseconds under `ns`, which stays comparable across hosts with
+    different TSC rates.
+
+    With `stitch`, pooled pairing carries open enters across session
+    boundaries and `stitched` reports how many pairs that recovered;
+    the per-session documents are always paired on their own.
+
+    With `steady`, the pooled scope stats leave out each scope's
+    warmup calls, every scope carries a `warmup` object (calls and
+    windows excluded, the change-point `end_tsc`, the warmup median
+    and the `[start_tsc, calls, median]` window series it was found
+    in), and `steady_state` records the window setting. Regression
+    baselines are recorded this way. Per-session documents keep every
+    call."""
+    stats, orphan_enters, orphan_exits, stitched = compute_pooled_scope_stats(sessions, stitch, steady)
+    self_stats, calls = compute_self_scope_stats(sessions, stitch) if self_time else (None, None)
+    last = sessions[-1]
     doc = {
-        "mode":    session.mode,
-        "cpus":    session.cpus,
-        "reason":  session.reason,
-        "records": len(session.records),
+        "mode":    last.mode,
+        "cpus":    last.cpus,
+        "reason":  last.reason,
+        "records": sum(s.record_count for s in sessions),
         "orphan_enters": orphan_enters,
         "orphan_exits":  orphan_exits,
-        "scopes": [
-            {
-                "name":  s.name,
-                "count": s.tsc.count,
-                "tsc":   s.tsc.to_json(),
-                "cycles": s.cycles.to_json(),
-                "cache_misses":  s.cache_misses.to_json(),
-                "branch_misses": s.branch_misses.to_json(),
-            }
-            for s in stats
-        ],
+        "scopes": _scope_json(stats, self_stats, clock),
     }
+    if stitch:
+        doc["stitched"] = stitched
+    if steady is not None:
+        doc["steady_state"] = {"window_tsc": steady.window_tsc, "windows": WARMUP_WINDOWS}
+    _clock_json(doc, clock)
+    if calls is not None:
+        doc["call_tree"] = _call_tree_json(calls, merged_names(sessions))
+    if per_session:
+        doc["session_count"] = len(sessions)
+        per: list[dict] = []
+        for session in sessions:
+            s_stats, s_enters, s_exits = compute_scope_stats(session)
+            s_self = compute_self_scope_stats([session])[0] if self_time else None
+            per.append({
+                "cpus":    session.cpus,
+                "reason":  session.reason,
+                "records": session.record_count,
+                "done":    session.done,
+                "orphan_enters": s_enters,
+                "orphan_exits":  s_exits,
+                "scopes": _scope_json(s_stats, s_self, clock),
+            })
+        doc["sessions"] = per
+    return doc
+
+
+def report_json(
+    sessions: list[Session],
+    per_session: bool = False,
+    self_time: bool = False,
+    clock: TscClock | None = None,
+    stitch: bool = False,
+    steady: SteadyState | None = None,
+) -> None:
+    """`--json`: print the `json_report` document."""
+    doc = json_report(sessions, per_session, self_time, clock, stitch, steady)
     print(json.dumps(doc, indent=2))
 
 
+def report_json_stream(
+    acc: StreamAccumulator,
+    last: Session,
+    session_count: int | None = None,
+    clock: TscClock | None = None,
+) -> None:
+    """`report_json` for the streaming engine. Same schema, with
+    `engine: "stream"` marking the quantiles as histogram estimates.
+    The per-session breakdown is not available — keeping it would
+    make memory grow with the number of sessions — so pooled output
+    carries only `session_count` alongside the scopes."""
+    doc = {
+        "mode":    last.mode,
+        "cpus":    last.cpus,
+        "reason":  last.reason,
+        "records": acc.records,
+        "orphan_enters": acc.orphan_enters,
+        "orphan_exits":  acc.orphan_exits,
+        "engine":  "stream",
+        "scopes": _scope_json(acc.scope_stats(), clock=clock),
+    }
+    _clock_json(doc, clock)
+    if session_count is not None:
+        doc["session_count"] = session_count
+    print(json.dumps(doc, indent=2))
+
+
+# `--follow`: how often a quiet capture file is polled, the call
+# count below which a scope does not count towards `--stable`, and how
+# many cycles in a row must stay within `--stable` before stopping.
+FOLLOW_POLL = 0.25
+FOLLOW_MIN_CALLS = 50
+FOLLOW_STABLE_CYCLES = 3
+
+
+def tail_lines(path: str, poll: float = FOLLOW_POLL, idle: float = 0.0) -> Iterable[str]:
+    """Lines of the capture at `path` as they are written, like
+    `tail -f` from the start of the file. A FIFO ends when its writer
+    closes it; a regular file ends after `idle` seconds without new
+    data (never if 0), counted only once a `[KPROF]` line has arrived,
+    so a build and boot that print nothing for a while don't end it
+    early. A file that shrinks — QEMU restarted and truncated it — is
+    read again from the top. A partial last line is held until its
+    newline arrives."""
+    fifo = stat.S_ISFIFO(os.stat(path).st_mode)
+    prefix = KPROF_PREFIX.encode()
+    with open(path, "rb") as fh:
+        partial = b""
+        quiet = 0.0
+        started = False
+        while True:
+            chunk = fh.readline()
+            if chunk:
+                quiet = 0.0
+                partial += chunk
+                if partial.endswith(b"\n"):
+                    started = started or prefix in partial
+                    yield partial.decode("utf-8", "replace")
+                    partial = b""
+                continue
+            if fifo or (idle and started and quiet >= idle):
+                break
+            if not fifo:
+                try:
+                    if os.stat(path).st_size < fh.tell():
+                        fh.seek(0)
+                        partial = b""
+                        started = False
+                except OSError:
+                    pass
+            time.sleep(poll)
+            quiet += poll
+        if partial:
+            yield partial.decode("utf-8", "replace")
+
+
+def completed_cycles(stream: Iterable[str]) -> Iterable[Session]:
+    """Each `[KPROF] begin…done` cycle of `stream` as a parsed session,
+    as soon as its `done` line arrives. Cycles cut off by a new
+    `begin`, and disabled (mode=none) ones, are skipped."""
+    lines: list[str] | None = None
+    for line in iter_kprof_lines(stream):
+        verb = line[len(KPROF_PREFIX):].split(None, 1)[:1]
+        if verb == ["begin"]:
+            lines = [line]
+        elif lines is not None:
+            lines.append(line)
+            if verb == ["done"]:
+                session = parse_session(lines)
+                lines = None
+                if session is not None and session.mode != "none":
+                    yield session
+
+
+def render_follow(
+    stats: list[ScopeStats],
+    last: dict[str, ScopeStats],
+    prev: dict[str, int],
+    time_unit: TimeUnit = TICKS,
+) -> list[str]:
+    """The `--follow` table: pooled count / median / p99 per scope,
+    the median of the newest cycle alone, and how far the pooled
+    median moved since the previous cycle."""
+    fmt = time_unit.fmt
+    header = (
+        f"{'name':<32} {'count':>8} {'median':>12} {'p99':>12} "
+        f"{'last_med':>12} {'moved':>8}"
+    )
+    rows = [header, "-" * len(header)]
+    for st in stats:
+        m = st.tsc
+        newest = last.get(st.name)
+        moved = ""
+        if st.name in prev and prev[st.name] > 0:
+            moved = f"{(m.median - prev[st.name]) * 100.0 / prev[st.name]:+.1f}%"
+        rows.append(
+            f"{st.name:<32} {m.count:>8d} {fmt(m.median):>12} {fmt(m.p99):>12} "
+            f"{fmt(newest.tsc.median) if newest else '-':>12} {moved:>8}"
+        )
+    return rows
+
+
+def follow_capture(
+    stream: Iterable[str],
+    label: str,
+    units: str = "ticks",
+    tsc_mhz: float | None = None,
+    snapshots: IO[str] | None = None,
+    stable: float | None = None,
+) -> int:
+    """`--follow`: report each cycle of a capture that is still being
+    written as soon as it completes.
+
+    Cycles are pooled into a `StreamAccumulator`, so memory stays flat
+    however long the run; pooled quantiles carry the `LogHistogram`
+    error bound, the newest cycle's median is exact. On a terminal the
+    table is redrawn in place, otherwise one table per cycle is
+    printed. `snapshots` gets one JSON line per cycle with the pooled
+    scopes. With `stable` (percent), following stops once no scope
+    with `FOLLOW_MIN_CALLS` calls has moved its pooled median by that
+    much for `FOLLOW_STABLE_CYCLES` cycles in a row."""
+    out = sys.stdout
+    redraw = out.isatty()
+    pooled = StreamAccumulator()
+    prev: dict[str, int] = {}
+    drawn = 0
+    calm = 0
+    cycles = 0
+    time_unit = TimeUnit(units)
+    for session in completed_cycles(stream):
+        cycles += 1
+        engine = StreamingScopeStats()
+        for rec in session.records:
+            engine.feed(session, rec)
+        engine.finish([session])
+        pooled.merge(engine.last)
+        stats = pooled.scope_stats()
+        last = {st.name: st for st in compute_scope_stats(session)[0]}
+
+        if time_unit.clock is None:
+            time_unit = TimeUnit(units, resolve_tsc_clock([session], tsc_mhz))
+            if time_unit.clock is None and units != "ticks" and cycles == 1:
+                warn(f"no TSC rate known yet, showing ticks instead of {units}")
+
+        moved = [
+            abs(st.tsc.median - prev[st.name]) * 100.0 / prev[st.name]
+            for st in stats
+            if st.tsc.count >= FOLLOW_MIN_CALLS and prev.get(st.name)
+        ]
+        if stable is not None and moved and max(moved) < stable:
+            calm += 1
+        else:
+            calm = 0
+
+        status = (
+            f"=== {label}: cycle {cycles} reason={session.reason} "
+            f"records={pooled.records} ==="
+        )
+        rows = [status] + (render_follow(stats, last, prev, time_unit) if stats else ["(no paired scopes)"])
+        if stable is not None:
+            rows.append(f"stable for {calm}/{FOLLOW_STABLE_CYCLES} cycles (within {stable:g}%)")
+        if redraw and drawn:
+            out.write(f"\x1b[{drawn}F\x1b[J")
+        elif drawn:
+            out.write("\n")
+        out.write("\n".join(rows) + "\n")
+        out.flush()
+        drawn = len(rows)
+
+        if snapshots is not None:
+            doc = {
+                "cycle": cycles,
+                "time": round(time.time(), 3),
+                "reason": session.reason,
+                "records": pooled.records,
+                "engine": "stream",
+                "scopes": _scope_json(stats, clock=time_unit.clock),
+            }
+            _clock_json(doc, time_unit.clock)
+            snapshots.write(json.dumps(doc, separators=(",", ":")) + "\n")
+            snapshots.flush()
+
+        prev = {st.name: st.tsc.median for st in stats}
+        if stable is not None and calm >= FOLLOW_STABLE_CYCLES:
+            print(f"stable after {cycles} cycles, stopping")
+            return 0
+
+    if not cycles:
+        print("no completed kprof cycle seen", file=sys.stderr)
+        return 2
+    return 0
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(
+        prog="parse_kprof.py",
+        description="Post-process a Zag [KPROF] serial capture.",
+    )
+    ap.add_argument("path", help="serial capture (optionally gzip/xz/bzip2), or - for stdin")
+    modes = ap.add_mutually_exclusive_group()
+    modes.add_argument("--trace", dest="mode", action="store_const", const="--trace",
+                       help="paired-scope and trace-point statistics")
+    modes.add_argument("--sample", dest="mode", action="store_const", const="--sample",
+                       help="PMU sample histogram")
+    modes.add_argument("--raw", dest="mode", action="store_const", const="--raw",
+                       help="one JSON object per record")
+    modes.add_argument("--json", dest="mode", action="store_const", const="--json",
+                       help="machine-readable scope summary")
+    modes.add_argument("--sessions", dest="mode", action="store_const", const="--sessions",
+                       help="per-session tsc tables followed by the pooled trace report")
+    modes.add_argument("--timeline", dest="mode", action="store_const", const="--timeline",
+                       help="Chrome Trace Event JSON of every session, streamed "
+                            "(Perfetto / chrome://tracing)")
+    modes.add_argument("--follow", dest="mode", action="store_const", const="--follow",
+                       help="tail a capture that is still being written (file or "
+                            "FIFO) and refresh pooled scope stats after every cycle")
+    modes.add_argument("--sqlite", metavar="DB",
+                       help="append every session, its records and paired scope "
+                            "calls to the SQLite database DB")
+    modes.add_argument("--outliers", metavar="SCOPE",
+                       help="the --top slowest calls of SCOPE with their PMC "
+                            "deltas and everything recorded during each one")
+    ap.add_argument("--snapshots", metavar="PATH",
+                    help="--follow: append a JSON line of the pooled scopes per cycle")
+    ap.add_argument("--stable", type=float, metavar="PCT",
+                    help="--follow: stop once no scope's pooled median moved "
+                         f"by PCT%% for {FOLLOW_STABLE_CYCLES} cycles in a row")
+    ap.add_argument("--idle", type=float, default=0.0, metavar="SECONDS",
+                    help="--follow: stop after SECONDS without new data, counted "
+                         "from the first [KPROF] line (default: follow until "
+                         "interrupted or a FIFO closes)")
+    ap.add_argument("--top", type=int, metavar="K",
+                    help="number of calls --outliers lists (default 10) or of "
+                         f"rows per --sample table (default {SAMPLE_TOP})")
+    ap.add_argument("--by", choices=SAMPLE_BY, default="sym",
+                    help="key the sample histogram by leaf symbol (default), leaf "
+                         "ip, caller -> leaf edge, or (with --lines) source line "
+                         "or basic block")
+    ap.add_argument("--lines", metavar="DB",
+                    help="tools/indexer database of the sampled kernel: infer the "
+                         "KASLR slide and add per-line and per-basic-block sample "
+                         "tables (see kprof_lines.py)")
+    ap.add_argument("--all-sessions", action="store_true",
+                    help="pool every completed begin…done cycle instead of "
+                         "reporting only the last one")
+    ap.add_argument("--stream", action="store_true",
+                    help="single-pass histogram statistics in bounded memory "
+                         "(--trace/--json only; quantiles within "
+                         f"{100.0 / (1 << HIST_SIG_BITS):.2f}%%)")
+    ap.add_argument("--jobs", "-j", type=int, default=1, metavar="N",
+                    help="parse the capture file in N processes (not with "
+                         "--stream, --timeline, --outliers or stdin)")
+    ap.add_argument("--backend", choices=BACKENDS, default="python",
+                    help="statistics backend; numpy pairs and ranks whole "
+                         "columns at once (requires NumPy)")
+    ap.add_argument("--tsc-mhz", type=float, metavar="MHZ",
+                    help="TSC rate; overrides the capture's tsc_hz= header "
+                         f"(--timeline falls back to {DEFAULT_TSC_MHZ:g})")
+    ap.add_argument("--cpu-mhz", type=float, metavar="MHZ",
+                    help="core clock the cycles PMC counts at; without a TSC "
+                         "rate, calibrate one from paired scopes' cycles vs tsc")
+    ap.add_argument("--units", choices=UNITS, default="ticks",
+                    help="print tsc values in raw ticks (default) or converted "
+                         "to ns / us; --json carries ns whenever a rate is known")
+    ap.add_argument("--self", dest="self_time", action="store_true",
+                    help="also report exclusive (self) time per scope and the "
+                         "scope call tree (not with --raw/--sample/--stream)")
+    ap.add_argument("--steady-state", action="store_true",
+                    help="detect each scope's warmup calls (change point on "
+                         "rolling window medians) and leave them out of the "
+                         "scope stats; --self tables keep every call")
+    ap.add_argument("--window-tsc", type=int, default=0, metavar="TICKS",
+                    help="--steady-state window width in TSC ticks (default: "
+                         f"{WARMUP_WINDOWS} windows of equal call count per scope)")
+    ap.add_argument("--no-stitch", dest="stitch", action="store_false",
+                    help="pair pooled sessions (and --timeline) within each "
+                         "dump instead of carrying open enters across dump "
+                         "boundaries; --stream always pairs per dump")
+    ap.add_argument("--no-cache", dest="cache", action="store_false",
+                    help="neither read nor write the parsed-capture sidecar "
+                         "(<path>.kpcache); --stream, --timeline, --outliers and "
+                         "stdin never use it")
+    ap.set_defaults(mode="")
+    return ap
+
+
 def main(argv: list[str]) -> int:
-    if len(argv) < 2:
-        usage()
+    ap = build_arg_parser()
+    try:
+        args = ap.parse_args(argv[1:])
+    except SystemExit as exc:
+        return int(exc.code or 0)
+    if args.outliers is not None:
+        args.mode = "--outliers"
+    elif args.sqlite is not None:
+        args.mode = "--sqlite"
+
+    if args.stream and args.mode not in ("--trace", "--json"):
+        ap.print_usage(sys.stderr)
+        print("parse_kprof.py: error: --stream requires --trace or --json", file=sys.stderr)
+        return 2
+
+    if args.self_time and (args.stream or args.mode in ("--raw", "--sample", "--timeline", "--outliers", "--sqlite")):
+        ap.print_usage(sys.stderr)
+        print("parse_kprof.py: error: --self needs the exact trace engine and a "
+              "trace report", file=sys.stderr)
         return 2
 
-    path = argv[1]
-    mode_flag = ""
-    if len(argv) >= 3:
-        mode_flag = argv[2]
-        if mode_flag not in ("--trace", "--sample", "--raw", "--json"):
-            usage()
+    if args.steady_state and (args.stream or args.mode in ("--raw", "--sample", "--timeline", "--outliers", "--sqlite")):
+        ap.print_usage(sys.stderr)
+        print("parse_kprof.py: error: --steady-state needs the exact trace engine and "
+              "a trace report", file=sys.stderr)
+        return 2
+
+    if args.top is not None and args.top < 1:
+        ap.print_usage(sys.stderr)
+        print("parse_kprof.py: error: --top must be at least 1", file=sys.stderr)
+        return 2
+
+    if args.window_tsc and not args.steady_state or args.window_tsc < 0:
+        ap.print_usage(sys.stderr)
+        print("parse_kprof.py: error: --window-tsc takes a positive width and "
+              "--steady-state", file=sys.stderr)
+        return 2
+
+    try:
+        set_backend(args.backend)
+    except ImportError as exc:
+        print(f"parse_kprof.py: error: --backend {args.backend} unavailable: {exc}", file=sys.stderr)
+        return 2
+
+    if args.jobs > 1 and (args.stream or args.path == "-" or args.mode in ("--timeline", "--outliers")):
+        ap.print_usage(sys.stderr)
+        print("parse_kprof.py: error: --jobs needs a capture file and no --stream, "
+              "--timeline or --outliers", file=sys.stderr)
+        return 2
+
+    lines = None
+    if args.by in SAMPLE_BY_LINES and not args.lines:
+        ap.print_usage(sys.stderr)
+        print(f"parse_kprof.py: error: --by {args.by} needs --lines DB", file=sys.stderr)
+        return 2
+    if args.lines and args.mode in ("", "--sample"):
+        import sqlite3
+
+        import kprof_lines
+
+        try:
+            lines = kprof_lines.LineIndex(args.lines)
+        except (sqlite3.Error, ValueError) as exc:
+            print(f"parse_kprof.py: error: --lines {args.lines}: {exc}", file=sys.stderr)
+            return 2
+
+    for flag, value in (("--tsc-mhz", args.tsc_mhz), ("--cpu-mhz", args.cpu_mhz)):
+        if value is not None and value <= 0:
+            ap.print_usage(sys.stderr)
+            print(f"parse_kprof.py: error: {flag} must be positive", file=sys.stderr)
             return 2
 
-    if path == "-":
-        stream = sys.stdin
-        session = parse_session(stream)
+    follow_only = args.snapshots is not None or args.stable is not None or args.idle
+    if args.mode == "--follow" and (
+        args.stream or args.jobs > 1 or args.self_time or args.steady_state
+    ) or args.mode != "--follow" and follow_only:
+        ap.print_usage(sys.stderr)
+        print("parse_kprof.py: error: --snapshots/--stable/--idle need --follow, which "
+              "takes no --stream/--jobs/--self/--steady-state", file=sys.stderr)
+        return 2
+
+    if args.mode == "--follow":
+        if args.path != "-" and is_compressed(args.path):
+            print("parse_kprof.py: error: --follow needs an uncompressed capture", file=sys.stderr)
+            return 2
+        stream = sys.stdin if args.path == "-" else tail_lines(args.path, idle=args.idle)
+        snapshots = open(args.snapshots, "a", encoding="utf-8") if args.snapshots else None
+        try:
+            return follow_capture(
+                stream, args.path, args.units, args.tsc_mhz, snapshots, args.stable,
+            )
+        except KeyboardInterrupt:
+            return 0
+        finally:
+            if snapshots is not None:
+                snapshots.close()
+
+    if args.mode == "--timeline":
+        sessions = scan(args.path, TimelineWriter(sys.stdout, args.tsc_mhz, args.stitch))
+        if not sessions:
+            print("no kprof session detected", file=sys.stderr)
+            return 2
+        return 0
+
+    engine = StreamingScopeStats() if args.stream else None
+    on_record = engine.feed if engine is not None else None
+    finder = None
+    if args.mode == "--outliers" and args.path != "-":
+        # Two streamed passes instead of loading the capture (see
+        # `report_outliers`); scope stats only to calibrate against.
+        finder = OutlierFinder(args.outliers, args.top or 10, args.all_sessions and args.stitch)
+        if args.cpu_mhz:
+            engine = StreamingScopeStats()
+        sink = finder if engine is None else Fanout(finder, engine)
+        with open_capture(args.path) as fh:
+            sessions = parse_sessions(fh, sink.feed)
+        finder.finish(sessions)
+    elif engine is None and args.path != "-":
+        sessions = load_capture(args.path, args.jobs, args.cache)
     else:
-        with open(path, "r", encoding="utf-8", errors="replace") as fh:
-            session = parse_session(fh)
+        with open_capture(args.path) as fh:
+            sessions = parse_sessions(fh, on_record)
 
-    if session is None:
+    if not sessions:
         print("no kprof session detected", file=sys.stderr)
         return 2
 
-    if session.mode == "none":
-        print("kprof session was disabled (mode=none)")
+    if args.mode == "--sqlite":
+        import kprof_sqlite
+
+        try:
+            counts = kprof_sqlite.export(args.sqlite, args.path, sessions, args.stitch)
+        except OverflowError as exc:
+            # A field wider than 64 bits; the export was rolled back.
+            print(f"parse_kprof.py: error: --sqlite: {exc}", file=sys.stderr)
+            return 2
+        print(
+            f"{args.sqlite}: {counts['sessions']} session(s), {counts['records']} records, "
+            f"{counts['scopes']} scope calls"
+        )
         return 0
 
-    if not session.done:
-        warn("missing [KPROF] done line — output may be truncated")
-
-    if mode_flag == "--raw":
-        report_raw(session)
-    elif mode_flag == "--trace":
-        report_trace(session)
-    elif mode_flag == "--sample":
-        report_sample(session)
-    elif mode_flag == "--json":
-        report_json(session)
+    pooled = args.all_sessions or args.mode == "--sessions"
+    if pooled:
+        selected = completed_sessions(sessions)
+        if not selected:
+            print("kprof session was disabled (mode=none)")
+            return 0
     else:
-        report_summary(session)
+        session = sessions[-1]
+        if session.mode == "none":
+            print("kprof session was disabled (mode=none)")
+            return 0
+        if not session.done:
+            warn("missing [KPROF] done line — output may be truncated")
+        selected = [session]
+
+    acc = None
+    if engine is not None:
+        engine.finish(sessions)
+        if not pooled:
+            acc = engine.last
+        elif all(s.done for s in selected):
+            acc = engine.completed
+        else:
+            acc = engine.everything
+
+    clock = None
+    if args.mode not in ("--raw", "--sample"):
+        clock = resolve_tsc_clock(
+            selected, args.tsc_mhz, args.cpu_mhz,
+            acc.scope_stats() if acc is not None else None,
+        )
+        if args.units != "ticks" and clock is None:
+            if args.cpu_mhz:
+                hint = "calibrating one from --cpu-mhz was refused; pass --tsc-mhz"
+            else:
+                hint = "pass --tsc-mhz, or --cpu-mhz to calibrate from PMC cycles"
+            print(f"parse_kprof.py: error: --units {args.units} needs a TSC rate: the "
+                  f"capture has no tsc_hz= and {hint}", file=sys.stderr)
+            return 2
+    time_unit = TimeUnit(args.units, clock)
+
+    if acc is not None and finder is None:
+        if args.mode == "--json":
+            report_json_stream(acc, selected[-1], len(selected) if pooled else None, clock)
+        else:
+            render_trace(
+                acc.scope_stats(), acc.orphan_enters, acc.orphan_exits,
+                acc.points, acc.names, time_unit=time_unit,
+            )
+        return 0
+
+    stitch = pooled and args.stitch
+    steady = SteadyState(args.window_tsc) if args.steady_state else None
+    if args.mode == "--raw":
+        report_raw(selected)
+    elif args.mode == "--trace":
+        report_trace(selected, args.self_time, time_unit, stitch, steady)
+    elif args.mode == "--sample":
+        report_sample(selected, args.by, args.top or SAMPLE_TOP, lines)
+    elif args.mode == "--json":
+        report_json(
+            selected, per_session=pooled, self_time=args.self_time,
+            clock=clock, stitch=stitch, steady=steady,
+        )
+    elif args.mode == "--outliers":
+        return report_outliers(
+            selected, args.outliers, args.top or 10, time_unit, stitch,
+            args.path if finder is not None else None, finder,
+        )
+    elif args.mode == "--sessions":
+        report_sessions(selected, args.self_time, time_unit, stitch, steady)
+    else:
+        report_summary(
+            selected, args.self_time, time_unit, stitch, steady,
+            args.by, args.top or SAMPLE_TOP, lines,
+        )
 
     return 0
 
 
 if __name__ == "__main__":
+    # Helper modules (kprof_columnar) import this one by name; make
+    # that resolve to the running script rather than a second copy.
+    sys.modules.setdefault("parse_kprof", sys.modules[__name__])
     sys.exit(main(sys.argv))
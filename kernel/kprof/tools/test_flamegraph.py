@@ -0,0 +1,257 @@
+"""Checks for `flamegraph.py` on the sample-mode fixture.
+
+`test_fixtures/sample_stack_output.txt` holds six sampled stacks on
+two CPUs, folded:
+
+    syscallDispatch;sysProcCreate;memcpyFast  2   (cpu0)
+    syscallDispatch;sysProcCreate             1   (cpu0)
+    syscallDispatch;ipcSend;memcpyFast        1   (cpu1)
+    idle                                      2   (one per CPU)
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+from collections import Counter
+
+import pytest
+
+from flamegraph import (
+    CHART_MAX_SPAN,
+    ChartFrame,
+    FrameDelta,
+    add_base,
+    build_tree,
+    chart_frames,
+    cpu_trees,
+    diff_fill,
+    expand_paths,
+    fold,
+    fold_inputs,
+    frame_deltas,
+    layout,
+    read_folded,
+    render_chart,
+    render_per_cpu,
+    write_folded,
+)
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(TOOLS, "test_fixtures")
+STACKS = "sample_stack_output.txt"
+SAMPLE_BASELINE = os.path.join(TOOLS, "..", "..", "..", "baselines", "shm_cycle_sample.log")
+
+FOLDED = Counter({
+    ("syscallDispatch", "sysProcCreate", "memcpyFast"): 2,
+    ("syscallDispatch", "sysProcCreate"): 1,
+    ("syscallDispatch", "ipcSend", "memcpyFast"): 1,
+    ("idle",): 2,
+})
+
+
+def run_flamegraph(*args: str, check: bool = True) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, os.path.join(TOOLS, "flamegraph.py"), *args],
+        capture_output=True, text=True, check=check,
+    )
+
+
+@pytest.fixture
+def capture(tmp_path):
+    """A private copy of the fixture, so its cache sidecar lands in
+    `tmp_path`."""
+    path = tmp_path / STACKS
+    shutil.copy(os.path.join(FIXTURES, STACKS), path)
+    return str(path)
+
+
+class TestFolded:
+    """`--emit-folded` output is kept and merged later; reading it back
+    must give the same counts."""
+
+    def test_fold(self, capture):
+        assert fold_inputs([capture]) == FOLDED
+
+    @pytest.mark.parametrize("per_cpu", [False, True])
+    def test_emit_then_read_round_trips(self, capture, tmp_path, per_cpu):
+        view = ["--per-cpu"] if per_cpu else []
+        emitted = tmp_path / "run.folded"
+        emitted.write_text(run_flamegraph("--emit-folded", *view, capture).stdout)
+        assert read_folded(str(emitted)) == fold_inputs([capture], per_cpu=per_cpu)
+        again = run_flamegraph("--emit-folded", "--folded", str(emitted)).stdout
+        assert again == emitted.read_text()
+
+    def test_write_read_round_trips(self, tmp_path):
+        path = tmp_path / "w.folded"
+        with open(path, "w") as out:
+            write_folded(FOLDED, out)
+        assert read_folded(str(path)) == FOLDED
+
+    def test_malformed_lines_are_skipped(self, tmp_path, capsys):
+        path = tmp_path / "bad.folded"
+        path.write_text("a;b 3\nno count here\n\nc;d x\n7\na;b 2\nidle 1\n")
+        assert read_folded(str(path)) == Counter({("a", "b"): 5, ("idle",): 1})
+        err = capsys.readouterr().err
+        for lineno in (2, 4, 5):
+            assert f"{path}:{lineno}: not a folded stack line" in err
+        # Blank lines are not malformed.
+        assert f"{path}:3:" not in err
+
+    def test_parallel_merge_matches_serial(self, capture, tmp_path):
+        paths = [capture]
+        if os.path.exists(SAMPLE_BASELINE):
+            paths.append(str(tmp_path / "baseline.log"))
+            shutil.copy(SAMPLE_BASELINE, paths[-1])
+        else:
+            paths.append(str(tmp_path / "again.txt"))
+            shutil.copy(capture, paths[-1])
+        serial = fold_inputs(paths)
+        assert serial == sum((fold_inputs([p]) for p in paths), Counter())
+        assert fold_inputs(paths, jobs=2) == serial
+        assert fold_inputs(paths, jobs=2, per_cpu=True) == fold_inputs(paths, per_cpu=True)
+
+    def test_glob_expands_sorted(self, tmp_path):
+        for name in ("b.folded", "a.folded"):
+            (tmp_path / name).write_text("idle 1\n")
+        assert expand_paths([str(tmp_path / "*.folded")]) == [
+            str(tmp_path / "a.folded"), str(tmp_path / "b.folded"),
+        ]
+
+    def test_glob_matching_nothing_fails(self, tmp_path):
+        pattern = str(tmp_path / "nightly" / "*.folded")
+        with pytest.raises(FileNotFoundError):
+            expand_paths([pattern])
+        proc = run_flamegraph("--folded", pattern, check=False)
+        assert proc.returncode == 2
+        assert f"no such capture: {pattern}" in proc.stderr
+
+
+# Leaf-first stacks with their (cpu, tsc). The sampling period is 100
+# (the median gap; the equal-tsc pair adds none), so a sample is drawn
+# for at most CHART_MAX_SPAN * 100 ticks.
+CHART_STACKS = [
+    (["c", "b", "a"], (0, 100)),
+    # Shares a;b with the previous sample: those two runs continue.
+    (["d", "b", "a"], (0, 200)),
+    (["d", "b", "a"], (0, 300)),
+    # 700 ticks later: the runs above were capped at 300 + 400 and
+    # this starts new ones despite the identical stack.
+    (["d", "b", "a"], (0, 1000)),
+    # Same tsc: the previous sample gets no width, `a` carries on.
+    (["e", "a"], (0, 1000)),
+    # Other CPU, same names: never merged across lanes. Listed out of
+    # tsc order; each CPU is sorted first.
+    (["x"], (1, 250)),
+    (["c", "b", "a"], (1, 150)),
+]
+
+
+class TestPerCpu:
+    def test_chart_frames(self):
+        assert CHART_MAX_SPAN == 4
+        stacks = [s for s, _ in CHART_STACKS]
+        origins = [o for _, o in CHART_STACKS]
+        assert chart_frames(stacks, origins) == [
+            ChartFrame("c", 0, 2, 100, 200),
+            ChartFrame("a", 0, 0, 100, 700, samples=3),
+            ChartFrame("b", 0, 1, 100, 700, samples=3),
+            ChartFrame("d", 0, 2, 200, 700, samples=2),
+            ChartFrame("b", 0, 1, 1000, 1000),
+            ChartFrame("d", 0, 2, 1000, 1000),
+            # The last sample runs for one period.
+            ChartFrame("a", 0, 0, 1000, 1100, samples=2),
+            ChartFrame("e", 0, 1, 1000, 1100),
+            ChartFrame("a", 1, 0, 150, 250),
+            ChartFrame("b", 1, 1, 150, 250),
+            ChartFrame("c", 1, 2, 150, 250),
+            ChartFrame("x", 1, 0, 250, 350),
+        ]
+
+    def test_chart_single_sample(self):
+        assert chart_frames([["a"]], [(3, 50)]) == [ChartFrame("a", 3, 0, 50, 51)]
+
+    def test_cpu_trees(self, capture):
+        trees = cpu_trees(build_tree(fold_inputs([capture], per_cpu=True)))
+        assert [(cpu, node.name, node.count) for cpu, node in trees] == [
+            (0, "cpu0", 4), (1, "cpu1", 2),
+        ]
+        assert trees[0][1].children["syscallDispatch"].count == 3
+        svg = render_per_cpu(trees)
+        assert "cpu0 — 4 samples (66.7%)" in svg
+        assert "cpu1 — 2 samples (33.3%)" in svg
+
+    def test_cpu_trees_refuses_plain_fold(self, capture, tmp_path):
+        assert cpu_trees(build_tree(fold([["a"]], [(2, 0)])))[0][0] == 2
+        with pytest.raises(ValueError, match="is not a per-CPU frame"):
+            cpu_trees(build_tree(fold([["a"]])))
+        # Folded input written without --per-cpu.
+        plain = tmp_path / "plain.folded"
+        plain.write_text(run_flamegraph("--emit-folded", capture).stdout)
+        proc = run_flamegraph("--per-cpu", "--folded", str(plain), check=False)
+        assert proc.returncode == 2
+        assert "error: --per-cpu: stack root 'idle' is not a per-CPU frame" in proc.stderr
+
+    def test_render_chart(self, capture):
+        svg = run_flamegraph("--chart", capture).stdout
+        # tsc_hz=1e9 on the begin line: 1000..5000 ticks is 4 µs.
+        assert "Kprof flame chart (6 samples on 2 CPUs over 0.004 ms)" in svg
+        assert "cpu0 — 4 samples" in svg and "cpu1 — 2 samples" in svg
+        assert render_chart([]) == "<!-- no samples -->\n"
+
+
+# 8 base samples against 12 new ones: the base is scaled by 1.5.
+# `b` and `main` keep their normalized share, `gone` is base-only.
+DIFF_BASE = Counter({("main", "a"): 2, ("main", "b"): 2, ("main", "gone"): 4})
+DIFF_NEW = Counter({("main", "a"): 6, ("main", "b"): 3, ("main", "c"): 3})
+
+
+class TestDiff:
+    def test_add_base(self):
+        tree = build_tree(DIFF_NEW)
+        add_base(tree, DIFF_BASE)
+        assert (tree.count, tree.base) == (12, 8)
+        main = tree.children["main"]
+        assert main.base == 8
+        assert {name: (n.count, n.base) for name, n in main.children.items()} == {
+            "a": (6, 2), "b": (3, 2), "c": (3, 0),
+        }
+
+    def test_fill_is_scaled(self):
+        tree = build_tree(DIFF_NEW)
+        add_base(tree, DIFF_BASE)
+        fill = diff_fill(tree.count / tree.base)
+        colors = {f.name: fill(f) for f in layout(tree, 1.0)}
+        assert colors == {
+            "main": "hsl(0,80%,100%)",
+            # 6 new against 3 normalized: +50% of the larger.
+            "a": "hsl(0,80%,75%)",
+            "b": "hsl(0,80%,100%)",
+            "c": "hsl(0,80%,50%)",
+        }
+        # Fewer samples than the base at equal totals: blue.
+        shrunk = build_tree(Counter({("main", "a"): 1, ("main", "b"): 3}))
+        add_base(shrunk, Counter({("main", "a"): 2, ("main", "b"): 2}))
+        a = [f for f in layout(shrunk, 1.0) if f.name == "a"][0]
+        assert diff_fill(shrunk.count / shrunk.base)(a) == "hsl(220,80%,75%)"
+
+    def test_frame_deltas(self):
+        rows = frame_deltas(DIFF_BASE, DIFF_NEW, 12 / 8)
+        # `gone` moved most; `a` and `c` tie and sort by name; `b` and
+        # `main` did not move and are left out.
+        assert rows == [
+            FrameDelta("gone", base_self=6.0, new_self=0, base_total=6.0, new_total=0),
+            FrameDelta("a", base_self=3.0, new_self=6, base_total=3.0, new_total=6),
+            FrameDelta("c", base_self=0.0, new_self=3, base_total=0.0, new_total=3),
+        ]
+        assert [(r.self_delta, r.total_delta) for r in rows] == [(-6, -6), (3, 3), (3, 3)]
+
+    def test_frame_deltas_self_and_total_differ(self):
+        # `b` keeps its samples but stops being a leaf: only its self
+        # count moves, so it ranks after `c` on the inclusive change.
+        base = Counter({("a", "b"): 4})
+        new = Counter({("a", "b", "c"): 4})
+        rows = frame_deltas(base, new, 1.0)
+        assert [(r.name, r.self_delta, r.total_delta) for r in rows] == [
+            ("c", 4, 4), ("b", -4, 0),
+        ]
@@ -0,0 +1,160 @@
+"""Checks for `kprof_lines` against a hand-built indexer database.
+
+The database holds only the tables and columns `LineIndex` reads.
+Link addresses sit in the kernel's upper half, so they are stored
+bit-cast to signed the way the indexer does.
+"""
+
+import sqlite3
+
+import pytest
+
+from kprof_lines import SLIDE_ALIGN, LineIndex, Slide, open_index
+
+BASE = 0xFFFFFFFF80000000
+SLIDE = 0x3A00000
+
+# (link offset, size, qualified name); `dup` is ambiguous.
+SYMBOLS = [
+    (0x100, 0x40, "kern.sched.pick"),
+    (0x200, 0x30, "kern.ipc.send"),
+    (0x300, 0x10, "kern.a.dup"),
+    (0x400, 0x10, "kern.b.dup"),
+]
+# (offset, mnemonic, operands) for `pick`.
+INSTS = [
+    (0x100, "push", "rbp"),
+    (0x101, "cmp", "edi,0x3"),
+    (0x104, "je", "ffffffff80000120 <kern.sched.pick+0x20>"),
+    (0x106, "mov", "eax,edi"),
+    (0x120, "mov", "eax,0x1"),
+    # Calls return here: no split.
+    (0x123, "call", "ffffffff80000200 <kern.ipc.send>"),
+    (0x128, "ret", ""),
+    (0x129, "nop", ""),
+]
+# (lo, hi inclusive, line) in kernel/sched.zig; 0x140.. has no line.
+LINES = [(0x100, 0x11F, 10), (0x120, 0x13F, 12)]
+
+
+def _signed(v: int) -> int:
+    return v - (1 << 64) if v >= 1 << 63 else v
+
+
+def build_db(path, complete: bool = True) -> str:
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE file (id INTEGER PRIMARY KEY, path TEXT NOT NULL);
+        CREATE TABLE entity (id INTEGER PRIMARY KEY, qualified_name TEXT NOT NULL);
+        CREATE TABLE bin_symbol (addr INTEGER PRIMARY KEY, entity_id INTEGER NOT NULL,
+                                 size INTEGER NOT NULL);
+        CREATE TABLE bin_inst (addr INTEGER PRIMARY KEY, mnemonic TEXT NOT NULL,
+                               operands TEXT NOT NULL);
+        CREATE TABLE dwarf_line (addr_lo INTEGER PRIMARY KEY, addr_hi INTEGER NOT NULL,
+                                 file_id INTEGER NOT NULL, line INTEGER NOT NULL);
+    """)
+    conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+        ("arch", "x86_64"), ("commit_sha", "abc123"),
+        ("schema_complete", "true" if complete else "false"),
+    ])
+    conn.execute("INSERT INTO file VALUES (1, 'kernel/sched.zig')")
+    for eid, (off, size, name) in enumerate(SYMBOLS, 1):
+        conn.execute("INSERT INTO entity VALUES (?, ?)", (eid, name))
+        conn.execute("INSERT INTO bin_symbol VALUES (?, ?, ?)", (_signed(BASE + off), eid, size))
+    conn.executemany("INSERT INTO bin_inst VALUES (?, ?, ?)", [
+        (_signed(BASE + off), mnemonic, operands) for off, mnemonic, operands in INSTS
+    ])
+    conn.executemany("INSERT INTO dwarf_line VALUES (?, ?, 1, ?)", [
+        (_signed(BASE + lo), _signed(BASE + hi), line) for lo, hi, line in LINES
+    ])
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+def ip(off: int) -> int:
+    """Runtime address of link offset `off` under `SLIDE`."""
+    return BASE + off + SLIDE
+
+
+# `pick` sampled at both ends pins the slide to exactly `SLIDE`.
+SAMPLES = [(ip(0x100), "pick"), (ip(0x13F), "pick"), (ip(0x210), "send"), (ip(0x210), "send")]
+
+
+@pytest.fixture
+def db(tmp_path):
+    return build_db(tmp_path / "index.db")
+
+
+class TestInferSlide:
+    def test_recovers_known_slide(self, db):
+        assert LineIndex(db).infer_slide(SAMPLES) == Slide(slide=SLIDE, matched=4, candidates=4)
+
+    def test_outvoted_sample_is_unmatched(self, db):
+        # Fits `pick` only under a slide one page lower.
+        stray = (ip(0x100) - SLIDE_ALIGN - 0x20, "pick")
+        assert LineIndex(db).infer_slide(SAMPLES + [stray]) == Slide(
+            slide=SLIDE, matched=4, candidates=5,
+        )
+
+    def test_ambiguous_and_unknown_syms_are_ignored(self, db):
+        # Enough to outvote SAMPLES if they were used.
+        noise = [(ip(0x300) + 5 * SLIDE_ALIGN, "dup")] * 10
+        noise += [(ip(0x100) + 7 * SLIDE_ALIGN, "nope")] * 10
+        noise += [(ip(0x100) + 9 * SLIDE_ALIGN, "")] * 10
+        assert LineIndex(db).infer_slide(SAMPLES + noise) == Slide(
+            slide=SLIDE, matched=4, candidates=4,
+        )
+        assert LineIndex(db).infer_slide(noise) is None
+
+    def test_prefers_aligned_slide(self, db):
+        # One sample allows any slide in a 0x40-wide window that
+        # contains exactly one page boundary.
+        sample = (ip(0x100) + 0x20, "pick")
+        slide = LineIndex(db).infer_slide([sample])
+        assert slide == Slide(slide=SLIDE, matched=1, candidates=1)
+
+
+class TestLookups:
+    @pytest.fixture
+    def index(self, db):
+        index, slide = open_index(db, SAMPLES)
+        assert slide is not None and index.slide == SLIDE
+        return index
+
+    def test_metadata(self, index):
+        assert (index.arch, index.commit) == ("x86_64", "abc123")
+
+    def test_line(self, index):
+        assert index.line(ip(0x100)) == "kernel/sched.zig:10"
+        assert index.line(ip(0x11F)) == "kernel/sched.zig:10"
+        assert index.line(ip(0x125)) == "kernel/sched.zig:12"
+        assert index.line(ip(0x140)) is None
+        assert index.label(ip(0x125), "line") == "kernel/sched.zig:12"
+
+    def test_block_leaders(self, index):
+        expected = {
+            0x100: "pick+0x0",
+            0x105: "pick+0x0",
+            # After the conditional jump.
+            0x106: "pick+0x6",
+            0x11F: "pick+0x6",
+            # Jump target; the call does not split it.
+            0x120: "pick+0x20",
+            0x128: "pick+0x20",
+            # After the return.
+            0x129: "pick+0x29",
+            0x13F: "pick+0x29",
+            # Function entries without instructions are leaders too.
+            0x21F: "send+0x0",
+        }
+        assert {off: index.block(ip(off)) for off in expected} == expected
+        assert index.block(ip(0x140)) is None
+        assert index.label(ip(0x106), "block") == "pick+0x6"
+
+
+def test_incomplete_schema_is_refused(tmp_path):
+    path = build_db(tmp_path / "partial.db", complete=False)
+    with pytest.raises(ValueError, match="incomplete"):
+        LineIndex(path)
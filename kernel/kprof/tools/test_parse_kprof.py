@@ -0,0 +1,696 @@
+"""Fixture-based checks for the kprof host tools.
+
+`test_fixtures/` holds one small trace capture in both framings:
+`sample_trace_output.txt` (text `rec` lines, plus one malformed line)
+and `sample_binary_output.txt` (the same records in `blk` payloads).
+Every parse path has to agree on them. `sample_stack_output.txt` is a
+sample-mode capture with caller frames. Run with
+
+    python -m pytest kernel/kprof/tools
+"""
+
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+import kprof_cache
+import parse_kprof
+from parse_kprof import (
+    CALIBRATE_MIN_RATIO,
+    HIST_SIG_BITS,
+    WARMUP_MIN_CALLS,
+    WARMUP_WINDOWS,
+    LogHistogram,
+    ScopeStats,
+    calibrate_tsc_hz,
+    derived_from_deltas,
+    detect_warmup,
+    percentile,
+)
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(TOOLS, "test_fixtures")
+TEXT = "sample_trace_output.txt"
+BINARY = "sample_binary_output.txt"
+SAMPLES = "sample_stack_output.txt"
+TRACE_BASELINE = os.path.join(TOOLS, "..", "..", "..", "baselines", "shm_cycle_trace.log")
+PROF_TESTS = os.path.join(TOOLS, "..", "..", "..", "tests", "prof")
+
+# Two rolling dumps of one CPU: both `foo` calls open in the first and
+# close in the second. A third, name-less dump starts over at tsc 5.
+STITCH_CAPTURE = """\
+[KPROF] begin cpus=1 mode=trace reason=rolling
+[KPROF] name id=1 name=foo
+[KPROF] cpu_begin cpu=0 records=2
+[KPROF] rec cpu=0 tsc=100 kind=1 id=1 ip=0x0 arg=0x0 cyc=10 cmiss=0 bmiss=0
+[KPROF] rec cpu=0 tsc=150 kind=1 id=1 ip=0x0 arg=0x0 cyc=10 cmiss=0 bmiss=0
+[KPROF] cpu_end cpu=0
+[KPROF] done
+[KPROF] begin cpus=1 mode=trace reason=rolling
+[KPROF] name id=1 name=foo
+[KPROF] cpu_begin cpu=0 records=2
+[KPROF] rec cpu=0 tsc=200 kind=2 id=1 ip=0x0 arg=0x0 cyc=30 cmiss=0 bmiss=0
+[KPROF] rec cpu=0 tsc=300 kind=2 id=1 ip=0x0 arg=0x0 cyc=50 cmiss=0 bmiss=0
+[KPROF] cpu_end cpu=0
+[KPROF] done
+[KPROF] begin cpus=1 mode=trace reason=rolling
+[KPROF] cpu_begin cpu=0 records=1
+[KPROF] rec cpu=0 tsc=5 kind=1 id=1 ip=0x0 arg=0x0 cyc=10 cmiss=0 bmiss=0
+[KPROF] cpu_end cpu=0
+[KPROF] done
+"""
+
+
+def run_parse(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, os.path.join(TOOLS, "parse_kprof.py"), *args],
+        capture_output=True, text=True, check=True,
+    )
+
+
+@pytest.fixture
+def captures(tmp_path):
+    """Private copies of both fixtures, so cache sidecars start absent
+    and land in `tmp_path`."""
+    for name in (TEXT, BINARY):
+        shutil.copy(os.path.join(FIXTURES, name), tmp_path / name)
+    return tmp_path
+
+
+class TestFramingParity:
+    """Text and binary framings of one capture give the same report on
+    every parse path."""
+
+    @pytest.mark.parametrize("args", [
+        ["--no-cache"],
+        [],
+        ["--jobs", "2", "--no-cache"],
+        ["--jobs", "2"],
+        ["--all-sessions", "--no-cache"],
+    ])
+    def test_json_matches_reference(self, captures, args):
+        reference = run_parse("--json", "--no-cache", str(captures / TEXT)).stdout
+        for name in (TEXT, BINARY):
+            # Twice: the first run writes the sidecar, the second reads it.
+            for _ in range(2):
+                out = run_parse("--json", *args, str(captures / name)).stdout
+                if "--all-sessions" in args:
+                    assert json.loads(out)["records"] == json.loads(reference)["records"]
+                else:
+                    assert out == reference, f"{name} {args} differs from the text parse"
+
+    def test_jobs_drops_block_without_rec_size(self, captures):
+        path = captures / "no_rec_size.txt"
+        text = (captures / BINARY).read_text()
+        # Only cpu1's block loses its size; cpu0's must still decode.
+        head, sep, tail = text.partition("cpu_begin cpu=1 ")
+        path.write_text(head + sep + tail.replace(" rec_size=64", "", 1))
+        serial = run_parse("--json", "--no-cache", str(path))
+        for jobs in ("2", "4"):
+            parallel = run_parse("--json", "--no-cache", "--jobs", jobs, str(path))
+            assert parallel.stdout == serial.stdout, f"--jobs {jobs}"
+        assert "cpu1: binary block without rec_size" in serial.stderr
+        assert 0 < json.loads(serial.stdout)["records"] < 25
+
+    def test_record_count_skips_malformed_lines(self, captures):
+        for name in (TEXT, BINARY):
+            doc = json.loads(run_parse("--json", "--no-cache", str(captures / name)).stdout)
+            assert doc["records"] == 25, name
+
+    def test_numpy_backend_matches_python(self, captures):
+        pytest.importorskip("numpy")
+        for path in (str(captures / TEXT), str(captures / BINARY), TRACE_BASELINE):
+            if not os.path.exists(path):
+                continue
+            for mode in (["--json"], ["--json", "--all-sessions"], ["--trace", "--self"]):
+                python = run_parse(*mode, "--no-cache", path).stdout
+                numpy = run_parse(*mode, "--no-cache", "--backend", "numpy", path).stdout
+                assert numpy == python, f"{os.path.basename(path)} {mode}"
+
+
+class TestCache:
+    """The `.kpcache` sidecar is invisible in the output."""
+
+    def test_hit_replays_parse_warnings(self, captures):
+        path = str(captures / TEXT)
+        miss = run_parse("--json", path)
+        assert os.path.exists(kprof_cache.cache_path(path))
+        hit = run_parse("--json", path)
+        assert "garbageline_should_warn" in miss.stderr
+        assert (hit.stdout, hit.stderr) == (miss.stdout, miss.stderr)
+
+    def test_changed_content_invalidates(self, captures):
+        path = captures / TEXT
+        before = run_parse("--json", str(path)).stdout
+        # Same size, different tsc: only the content hash can tell.
+        text = path.read_text()
+        path.write_text(text.replace("tsc=1150", "tsc=1160", 1))
+        after = run_parse("--json", str(path)).stdout
+        assert after != before
+        assert after == run_parse("--json", "--no-cache", str(path)).stdout
+
+    def test_touch_keeps_cache(self, captures):
+        path = str(captures / TEXT)
+        parse_kprof.load_capture(path)
+        os.utime(path, ns=(0, 0))
+        assert kprof_cache.load(path) is not None
+
+    def test_unpackable_values_are_not_cached(self, captures):
+        path = captures / "wide.txt"
+        text = (captures / TEXT).read_text()
+        path.write_text(text.replace("rec cpu=0 tsc=1000 ", "rec cpu=300 tsc=-5 ", 1))
+        cached = run_parse("--json", str(path)).stdout
+        assert cached == run_parse("--json", "--no-cache", str(path)).stdout
+        assert not os.path.exists(kprof_cache.cache_path(str(path)))
+
+
+class TestStitching:
+    """Scopes that straddle a rolling dump pair only with stitching."""
+
+    def test_pairs_across_dumps(self, tmp_path):
+        path = tmp_path / "stitch.log"
+        path.write_text(STITCH_CAPTURE)
+        doc = json.loads(run_parse("--json", "--all-sessions", str(path)).stdout)
+        assert doc["stitched"] == 2
+        assert [(s["name"], s["count"], s["tsc"]["total"]) for s in doc["scopes"]] == [
+            ("foo", 2, 250),
+        ]
+        # The third dump's tsc went backwards: its enter is an orphan,
+        # not a continuation.
+        assert doc["orphan_enters"] == 1
+
+    def test_no_stitch_leaves_orphans(self, tmp_path):
+        path = tmp_path / "stitch.log"
+        path.write_text(STITCH_CAPTURE)
+        doc = json.loads(
+            run_parse("--json", "--all-sessions", "--no-stitch", str(path)).stdout
+        )
+        assert doc["scopes"] == []
+        assert (doc["orphan_enters"], doc["orphan_exits"]) == (3, 2)
+
+
+# (cpu, tsc, kind, id) in emission order: cpu0 nests outer > inner(2)
+# > leaf, cpu1's lines are interleaved with it and close inner(3)
+# while leaf is still open above it. Ids 2 and 3 share a name.
+NESTED = [
+    (0, 0, 1, 1), (0, 10, 1, 2), (1, 15, 1, 3), (0, 20, 1, 4), (1, 25, 1, 4),
+    (0, 30, 2, 4), (1, 45, 2, 3), (0, 50, 2, 2), (1, 55, 2, 4), (0, 60, 1, 2),
+    (0, 70, 2, 2), (0, 100, 2, 1),
+]
+
+
+def nested_capture() -> str:
+    lines = ["[KPROF] begin cpus=2 mode=trace reason=root_exit"]
+    lines += [f"[KPROF] name id={i} name={n}"
+              for i, n in ((1, "outer"), (2, "inner"), (3, "inner"), (4, "leaf"))]
+    lines += [f"[KPROF] rec cpu={c} tsc={t} kind={k} id={i} ip=0x0 arg=0x0 "
+              f"cyc={2 * t} cmiss=0 bmiss=0" for c, t, k, i in NESTED]
+    lines.append("[KPROF] done")
+    return "\n".join(lines) + "\n"
+
+
+class TestSelfTime:
+    """`--self` exclusive stats and the scope call tree."""
+
+    def test_call_tree(self):
+        sessions = parse_kprof.parse_sessions(nested_capture().splitlines())
+        tree = parse_kprof.collect_scope_tree(sessions)
+        assert {path: (n.count, n.tsc, n.self_tsc) for path, n in tree.calls.items()} == {
+            (1, 2, 4): (1, 10, 10),
+            (1, 2): (2, 50, 40),
+            (1,): (1, 100, 50),
+            (3,): (1, 30, 30),
+            # Closing inner(3) re-parented leaf to cpu1's root.
+            (4,): (1, 30, 30),
+        }
+        own = tree.self_deltas
+        assert dict(own.tsc) == {4: [10, 30], 3: [30], 2: [30, 10], 1: [50]}
+        assert dict(own.cycles) == {4: [20, 60], 3: [60], 2: [60, 20], 1: [100]}
+        assert (own.orphan_enters, own.orphan_exits) == (0, 0)
+
+    def test_json_keeps_ids_apart(self, tmp_path):
+        path = tmp_path / "nested.log"
+        path.write_text(nested_capture())
+        doc = json.loads(run_parse("--json", "--self", "--no-cache", str(path)).stdout)
+        assert [
+            (s["name"], s["count"], s["tsc"]["total"], s["self"]["tsc"]["total"])
+            for s in doc["scopes"]
+        ] == [
+            ("outer", 1, 100, 50),
+            ("inner", 2, 50, 40),
+            ("leaf", 2, 40, 40),
+            ("inner", 1, 30, 30),
+        ]
+
+
+# Two dumps. `work` (id 1) on cpu0 costs 50, 300, 100, 300 and 20 in
+# the first and 850 in the second; `lock` (id 2) and the `irq` point
+# (id 3) on cpu1 fall inside the first 300-tick call.
+OUTLIER_CAPTURE = """\
+[KPROF] begin cpus=2 mode=trace reason=rolling
+[KPROF] name id=1 name=work
+[KPROF] name id=2 name=lock
+[KPROF] name id=3 name=irq
+[KPROF] cpu_begin cpu=0 records=11
+[KPROF] rec cpu=0 tsc=0 kind=1 id=1 ip=0x0 arg=0x0 cyc=0 cmiss=0 bmiss=0
+[KPROF] rec cpu=0 tsc=50 kind=2 id=1 ip=0x0 arg=0x0 cyc=40 cmiss=0 bmiss=0
+[KPROF] rec cpu=0 tsc=100 kind=1 id=1 ip=0x0 arg=0x0 cyc=100 cmiss=1 bmiss=0
+[KPROF] rec cpu=0 tsc=400 kind=2 id=1 ip=0x0 arg=0x0 cyc=370 cmiss=9 bmiss=2
+[KPROF] rec cpu=0 tsc=500 kind=1 id=1 ip=0x0 arg=0x0 cyc=0 cmiss=0 bmiss=0
+[KPROF] rec cpu=0 tsc=600 kind=2 id=1 ip=0x0 arg=0x0 cyc=0 cmiss=0 bmiss=0
+[KPROF] rec cpu=0 tsc=700 kind=1 id=1 ip=0x0 arg=0x0 cyc=0 cmiss=0 bmiss=0
+[KPROF] rec cpu=0 tsc=800 kind=3 id=3 ip=0x0 arg=0x9 cyc=0 cmiss=0 bmiss=0
+[KPROF] rec cpu=0 tsc=1000 kind=2 id=1 ip=0x0 arg=0x0 cyc=0 cmiss=0 bmiss=0
+[KPROF] rec cpu=0 tsc=1100 kind=1 id=1 ip=0x0 arg=0x0 cyc=0 cmiss=0 bmiss=0
+[KPROF] rec cpu=0 tsc=1120 kind=2 id=1 ip=0x0 arg=0x0 cyc=0 cmiss=0 bmiss=0
+[KPROF] cpu_end cpu=0
+[KPROF] cpu_begin cpu=1 records=6
+[KPROF] rec cpu=1 tsc=150 kind=1 id=2 ip=0x0 arg=0x0 cyc=0 cmiss=0 bmiss=0
+[KPROF] rec cpu=1 tsc=200 kind=3 id=3 ip=0x0 arg=0x7 cyc=0 cmiss=0 bmiss=0
+[KPROF] rec cpu=1 tsc=250 kind=2 id=2 ip=0x0 arg=0x0 cyc=0 cmiss=0 bmiss=0
+[KPROF] rec cpu=1 tsc=720 kind=1 id=2 ip=0x0 arg=0x0 cyc=0 cmiss=0 bmiss=0
+[KPROF] rec cpu=1 tsc=1050 kind=3 id=3 ip=0x0 arg=0x8 cyc=0 cmiss=0 bmiss=0
+[KPROF] rec cpu=1 tsc=1500 kind=2 id=2 ip=0x0 arg=0x0 cyc=0 cmiss=0 bmiss=0
+[KPROF] cpu_end cpu=1
+[KPROF] done
+[KPROF] begin cpus=2 mode=trace reason=rolling
+[KPROF] name id=1 name=work
+[KPROF] cpu_begin cpu=0 records=2
+[KPROF] rec cpu=0 tsc=50 kind=1 id=1 ip=0x0 arg=0x0 cyc=0 cmiss=0 bmiss=0
+[KPROF] rec cpu=0 tsc=900 kind=2 id=1 ip=0x0 arg=0x0 cyc=0 cmiss=0 bmiss=0
+[KPROF] cpu_end cpu=0
+[KPROF] done
+"""
+
+
+class TestOutliers:
+    """`--outliers`: the k slowest calls of a scope and their windows."""
+
+    def finder(self, k: int) -> tuple[parse_kprof.OutlierFinder, list]:
+        sessions = parse_kprof.parse_sessions(OUTLIER_CAPTURE.splitlines())
+        finder = parse_kprof.OutlierFinder("work", k)
+        for session in sessions:
+            for rec in session.records:
+                finder.feed(session, rec)
+        finder.finish(sessions)
+        return finder, sessions
+
+    def test_slowest_first_and_ties_keep_earlier(self):
+        finder, _ = self.finder(3)
+        calls, total = finder.slowest()
+        assert total == 6
+        assert [(c.first_session, c.enter_tsc, c.tsc) for c in calls] == [
+            (1, 50, 850), (0, 100, 300), (0, 700, 300),
+        ]
+        assert (calls[1].cycles, calls[1].cache_misses, calls[1].branch_misses) == (270, 8, 2)
+        # k=1 per session: the later 300-tick call is evicted, not the
+        # earlier one.
+        finder, _ = self.finder(1)
+        assert [(c.enter_tsc, c.tsc) for c in finder.slowest({0})[0]] == [(100, 300)]
+
+    def test_include_filters_sessions(self):
+        finder, _ = self.finder(2)
+        calls, total = finder.slowest({0})
+        assert total == 5
+        assert [(c.enter_tsc, c.tsc) for c in calls] == [(100, 300), (700, 300)]
+        calls, total = finder.slowest({1})
+        assert (total, [c.tsc for c in calls]) == (1, [850])
+        assert finder.knows({1})
+        assert not parse_kprof.OutlierFinder("nope", 2).knows()
+
+    def test_context_on_other_cpus(self):
+        finder, sessions = self.finder(2)
+        calls, _ = finder.slowest({0})
+        context = parse_kprof.collect_outlier_context(sessions[:1], calls)
+        assert [[(ev.cpu, ev.tsc, ev.name, ev.arg, ev.call and ev.call.tsc) for ev in events]
+                for events in context] == [
+            # `lock` and the point on cpu1, inside 100..400.
+            [(1, 150, "lock", 0, 100), (1, 200, "irq", 7, None)],
+            # cpu1's `lock` at 720 exits after 1000: not inside.
+            [(0, 800, "irq", 9, None)],
+        ]
+
+    def test_streamed_matches_in_memory(self, tmp_path):
+        path = tmp_path / "outliers.log"
+        path.write_text(OUTLIER_CAPTURE)
+        for args, heading in (
+            # Only the last dump by default.
+            (["--top", "2"], "(1 slowest of 1 calls)"),
+            (["--top", "3", "--all-sessions"], "(3 slowest of 6 calls)"),
+        ):
+            streamed = run_parse("--outliers", "work", *args, str(path)).stdout
+            in_memory = subprocess.run(
+                [sys.executable, os.path.join(TOOLS, "parse_kprof.py"), "--outliers", "work",
+                 *args, "-"],
+                input=OUTLIER_CAPTURE, capture_output=True, text=True, check=True,
+            ).stdout
+            assert streamed == in_memory, args
+            assert f"=== Outliers: work {heading} ===" in streamed
+
+
+class TestSampleHistogram:
+    """`--sample --by` on `sample_stack_output.txt`: six stacks on two
+    CPUs, all but `idle` under `syscallDispatch`."""
+
+    def rows(self, by: str) -> list[tuple[str, int, int]]:
+        sessions = parse_kprof.load_capture(os.path.join(FIXTURES, SAMPLES), cache=False)
+        stacks = parse_kprof.collect_sample_stacks(parse_kprof.all_records(sessions))
+        rows = parse_kprof.aggregate_samples(stacks, by)
+        return [(r.label, r.self_count, r.total, dict(r.per_cpu)) for r in rows]
+
+    def test_by_sym(self):
+        assert self.rows("sym") == [
+            ("memcpyFast", 3, 3, {0: 2, 1: 1}),
+            ("idle", 2, 2, {0: 1, 1: 1}),
+            ("sysProcCreate", 1, 3, {0: 1}),
+            ("syscallDispatch", 0, 4, {}),
+            ("ipcSend", 0, 1, {}),
+        ]
+
+    def test_by_caller(self):
+        assert self.rows("caller") == [
+            ("sysProcCreate->memcpyFast", 2, 2, {0: 2}),
+            ("<root>->idle", 2, 2, {0: 1, 1: 1}),
+            ("syscallDispatch->sysProcCreate", 1, 3, {0: 1}),
+            ("ipcSend->memcpyFast", 1, 1, {1: 1}),
+            ("<root>->syscallDispatch", 0, 4, {}),
+            ("syscallDispatch->ipcSend", 0, 1, {}),
+        ]
+
+    def test_by_ip(self):
+        rows = self.rows("ip")
+        # The memcpyFast leaves split by sampled instruction.
+        assert rows[:3] == [
+            ("0xffffffff80001010 memcpyFast", 2, 2, {0: 1, 1: 1}),
+            ("0xffffffff80005050 idle", 2, 2, {0: 1, 1: 1}),
+            ("0xffffffff80001018 memcpyFast", 1, 1, {0: 1}),
+        ]
+
+    def test_recursion_counts_total_once(self):
+        stack = parse_kprof.SampleStack(cpu=0, ips=[3, 2, 1], syms=["f", "f", "main"])
+        rows = parse_kprof.aggregate_samples([stack], "sym")
+        assert [(r.label, r.self_count, r.total) for r in rows] == [("f", 1, 1), ("main", 0, 1)]
+
+
+class TestSqliteExport:
+    """`--sqlite` round-trips the text fixture."""
+
+    def export(self, tmp_path, capture):
+        import kprof_sqlite
+
+        db = str(tmp_path / "out.db")
+        sessions = parse_kprof.load_capture(str(capture), cache=False)
+        counts = kprof_sqlite.export(db, str(capture), sessions)
+        return counts, sqlite3.connect(db)
+
+    def test_round_trip(self, captures, tmp_path):
+        counts, conn = self.export(tmp_path, captures / TEXT)
+        expected = {"sessions": 1, "names": 5, "cpu_blocks": 2, "records": 25, "scopes": 7}
+        assert counts == expected
+        for table, n in expected.items():
+            assert conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone() == (n,), table
+        assert conn.execute(
+            "SELECT cpu, enter_tsc, exit_tsc, tsc FROM scopes WHERE name = 'sys_proc_create'"
+        ).fetchall() == [(0, 1400, 2400, 1000)]
+        # Kernel addresses come back through two's complement.
+        assert conn.execute(
+            "SELECT printf('0x%x', ip) FROM records WHERE cpu = 1 AND tsc = 4010"
+        ).fetchone() == ("0xffffffff80200abc",)
+
+    def test_wide_counters_wrap(self, captures, tmp_path):
+        path = captures / "wide.txt"
+        text = (captures / TEXT).read_text()
+        path.write_text(text.replace("tsc=2400 kind=2 id=2", f"tsc={2**64 - 1} kind=2 id=2", 1))
+        counts, conn = self.export(tmp_path, path)
+        assert counts["records"] == 25
+        assert conn.execute(
+            "SELECT exit_tsc, tsc FROM scopes WHERE name = 'sys_proc_create'"
+        ).fetchone() == (-1, 2**64 - 1 - 1400 - 2**64)
+
+    def test_oversized_value_is_a_cli_error(self, captures, tmp_path):
+        path = captures / "huge.txt"
+        text = (captures / TEXT).read_text()
+        path.write_text(text.replace("tsc=2400 kind=2 id=2", f"tsc={2**64} kind=2 id=2", 1))
+        db = tmp_path / "out.db"
+        proc = subprocess.run(
+            [sys.executable, os.path.join(TOOLS, "parse_kprof.py"), "--sqlite", str(db), str(path)],
+            capture_output=True, text=True,
+        )
+        assert proc.returncode == 2
+        assert "error: --sqlite:" in proc.stderr
+        assert "Traceback" not in proc.stderr
+        # Rolled back: no partial capture is left behind.
+        assert sqlite3.connect(db).execute("SELECT COUNT(*) FROM captures").fetchone() == (0,)
+
+
+def warmup_series(cold: int, calls: int = 128, cold_cost: int = 1000, warm_cost: int = 200):
+    """`calls` calls 100 ticks apart whose first `cold` cost `cold_cost`
+    and the rest `warm_cost`, each +-2% (deterministic), given in
+    shuffled order."""
+    rng = random.Random(cold)
+    idx = list(range(calls))
+    rng.shuffle(idx)
+    at = [i * 100 for i in idx]
+    deltas = [
+        (cold_cost if i < cold else warm_cost) * rng.randint(98, 102) // 100 for i in idx
+    ]
+    return at, deltas
+
+
+class TestDerived:
+    """Per-call PMC ratios, and the tag `compare_baseline` derives from them."""
+
+    def test_ratios(self):
+        # The third call has no tsc delta, the fourth no cycles.
+        d = derived_from_deltas(
+            tsc=[100, 200, 0, 50], cycles=[100, 100, 10, 0],
+            cache_misses=[1, 2, 3, 4], branch_misses=[0, 4, 2, 6],
+        )
+        cpt = d.cycles_per_tsc
+        assert (cpt.count, cpt.min_v, cpt.median, cpt.max_v) == (3, 0.0, 0.5, 1.0)
+        assert cpt.pooled == pytest.approx(200 / 350)
+        cmiss = d.cmiss_per_kcycle
+        assert (cmiss.count, cmiss.min_v, cmiss.median, cmiss.max_v) == (3, 10.0, 20.0, 300.0)
+        assert cmiss.pooled == pytest.approx(6000 / 210)
+        bmiss = d.bmiss_per_call
+        assert (bmiss.count, bmiss.pooled, bmiss.median, bmiss.max_v) == (4, 3.0, 3.0, 6.0)
+
+    def test_zero_denominators(self):
+        d = derived_from_deltas(tsc=[0, 0], cycles=[5, 5], cache_misses=[1, 1],
+                                branch_misses=[0, 0])
+        assert d.cycles_per_tsc.to_json() == {
+            "count": 0, "pooled": 0.0, "min": 0.0, "median": 0.0, "p95": 0.0, "p99": 0.0,
+            "max": 0.0,
+        }
+        assert d.cmiss_per_kcycle.median == 200.0
+
+    def test_no_pmc_data(self):
+        assert derived_from_deltas([100, 200], [0, 0], [0, 0], [0, 0]) is None
+
+    @staticmethod
+    def dumped(cmiss: float, bmiss: float, cpt: float) -> dict:
+        return {"derived": {
+            "cmiss_per_kcycle": {"median": cmiss},
+            "bmiss_per_call": {"median": bmiss},
+            "cycles_per_tsc": {"median": cpt},
+        }}
+
+    @pytest.mark.parametrize("current, tag", [
+        # Largest move wins: cmiss +50% over cycles/tsc -10%.
+        ((15.0, 2.1, 0.9), "  [memory-bound]"),
+        ((10.0, 3.0, 1.0), "  [control-flow-bound]"),
+        ((11.0, 2.0, 0.5), "  [halted / clocked down]"),
+        # Every move below CLASSIFY_FLOOR.
+        ((10.5, 2.1, 0.95), "  [no derived ratio moved]"),
+    ])
+    def test_classify(self, monkeypatch, current, tag):
+        monkeypatch.syspath_prepend(PROF_TESTS)
+        import compare_baseline
+
+        assert compare_baseline.classify(self.dumped(10.0, 2.0, 1.0), self.dumped(*current)) == tag
+        assert compare_baseline.classify({}, self.dumped(*current)) == ""
+
+
+class TestWarmup:
+    """`--steady-state` change point on synthetic cost series."""
+
+    def test_cold_start_step(self):
+        # 128 calls in 16 windows of 8: the first four windows are cold.
+        assert WARMUP_WINDOWS == 16
+        at, deltas = warmup_series(cold=32)
+        w = detect_warmup(at, deltas)
+        assert (w.windows, w.calls, w.end_tsc) == (4, 32, 3200)
+        assert 980 <= w.median <= 1020
+        assert [t < 3200 for t in at] == [not k for k in w.keep]
+
+    def test_fixed_width_windows(self):
+        at, deltas = warmup_series(cold=24)
+        w = detect_warmup(at, deltas, window_tsc=400)
+        # 4 calls per window; six cold windows.
+        assert len(w.series) == 32
+        assert (w.windows, w.calls, w.end_tsc) == (6, 24, 2400)
+
+    def test_flat_series_has_no_warmup(self):
+        at, deltas = warmup_series(cold=0)
+        w = detect_warmup(at, deltas)
+        assert (w.windows, w.calls, w.end_tsc, w.median) == (0, 0, 0, 0)
+        assert all(w.keep)
+
+    def test_small_shift_is_not_warmup(self):
+        # A 5% step is below WARMUP_SHIFT.
+        at, deltas = warmup_series(cold=32, cold_cost=210)
+        assert detect_warmup(at, deltas).windows == 0
+
+    def test_too_few_calls_never_split(self):
+        at, deltas = warmup_series(cold=16, calls=WARMUP_MIN_CALLS - 1)
+        w = detect_warmup(at, deltas)
+        assert (w.windows, w.calls) == (0, 0)
+        assert all(w.keep)
+        at, deltas = warmup_series(cold=16, calls=WARMUP_MIN_CALLS)
+        assert detect_warmup(at, deltas).windows > 0
+
+
+def scope(name: str, calls: int, tsc: int, cycles: int) -> ScopeStats:
+    """Pooled stats of `calls` identical calls costing `tsc` and
+    `cycles` each."""
+    metric = parse_kprof._metric_from
+    return ScopeStats(
+        name, metric([tsc] * calls), metric([cycles] * calls), metric([0] * calls),
+        metric([0] * calls),
+    )
+
+
+class TestCalibration:
+    """`--cpu-mhz` TSC calibration skips scopes in which the core halted."""
+
+    def test_weighted_by_calls_over_running_scopes(self):
+        assert CALIBRATE_MIN_RATIO == 0.5
+        stats = [
+            # Halted: would pull the rate up 5x.
+            scope("idle", 1000, 5000, 1000),
+            scope("fast", 10, 1000, 1000),
+            scope("slow", 30, 1000, 800),
+        ]
+        hz = calibrate_tsc_hz(stats, 2000)
+        assert hz == pytest.approx(2e9 * (10 * 1.0 + 30 * 1.25) / 40)
+
+    def test_every_scope_halted_is_refused(self):
+        with parse_kprof.record_warnings() as seen:
+            assert calibrate_tsc_hz([scope("idle", 10, 5000, 1000)], 2000) == 0
+        assert "not calibrating" in seen[0]
+
+    def test_no_pmc_cycles(self):
+        with parse_kprof.record_warnings() as seen:
+            assert calibrate_tsc_hz([scope("sample", 10, 1000, 0)], 2000) == 0
+        assert seen == []
+
+    @pytest.mark.parametrize("exit_cycles", [60, 210])
+    def test_cli(self, tmp_path, exit_cycles):
+        # One call: 200 ticks, 50 or 200 cycles.
+        path = tmp_path / "one.log"
+        path.write_text(
+            "[KPROF] begin cpus=1 mode=trace reason=root_exit\n"
+            "[KPROF] name id=1 name=foo\n"
+            "[KPROF] rec cpu=0 tsc=100 kind=1 id=1 ip=0x0 arg=0x0 cyc=10 cmiss=0 bmiss=0\n"
+            f"[KPROF] rec cpu=0 tsc=300 kind=2 id=1 ip=0x0 arg=0x0 cyc={exit_cycles} "
+            "cmiss=0 bmiss=0\n"
+            "[KPROF] done\n"
+        )
+        proc = subprocess.run(
+            [sys.executable, os.path.join(TOOLS, "parse_kprof.py"), "--json", "--no-cache",
+             "--cpu-mhz", "3000", "--units", "ns", str(path)],
+            capture_output=True, text=True,
+        )
+        if exit_cycles == 60:
+            assert proc.returncode == 2
+            assert "calibrating one from --cpu-mhz was refused; pass --tsc-mhz" in proc.stderr
+        else:
+            doc = json.loads(proc.stdout)
+            assert (doc["tsc_hz"], doc["tsc_hz_source"]) == (3_000_000_000, "calibrated")
+
+
+class TestFollow:
+    """`--follow` reads a capture that is still being written."""
+
+    # A cycle cut off by the next `begin`, a complete one, and one the
+    # stream ends inside.
+    STREAM = """\
+boot noise
+[KPROF] begin cpus=1 mode=trace reason=rolling
+[KPROF] name id=1 name=cut
+[KPROF] rec cpu=0 tsc=100 kind=1 id=1 ip=0x0 arg=0x0 cyc=10 cmiss=0 bmiss=0
+[KPROF] begin cpus=1 mode=trace reason=root_exit
+[KPROF] name id=2 name=whole
+[KPROF] rec cpu=0 tsc=200 kind=1 id=2 ip=0x0 arg=0x0 cyc=10 cmiss=0 bmiss=0
+[KPROF] rec cpu=0 tsc=260 kind=2 id=2 ip=0x0 arg=0x0 cyc=40 cmiss=0 bmiss=0
+[KPROF] done
+[KPROF] begin cpus=1 mode=trace reason=rolling
+[KPROF] rec cpu=0 tsc=300 kind=1 id=2 ip=0x0 arg=0x0 cyc=10 cmiss=0 bmiss=0
+"""
+
+    def test_only_complete_cycles(self):
+        sessions = list(parse_kprof.completed_cycles(self.STREAM.splitlines(keepends=True)))
+        assert len(sessions) == 1
+        (session,) = sessions
+        assert (session.reason, session.names, session.record_count) == (
+            "root_exit", {2: "whole"}, 2,
+        )
+
+    def test_disabled_cycle_is_skipped(self):
+        lines = ["[KPROF] begin cpus=1 mode=none reason=root_exit\n", "[KPROF] done\n"]
+        assert list(parse_kprof.completed_cycles(lines)) == []
+
+    def test_tail_ends_when_idle(self, tmp_path):
+        path = tmp_path / "serial.log"
+        path.write_text(self.STREAM + "[KPROF] do")
+        lines = list(parse_kprof.tail_lines(str(path), poll=0.01, idle=0.05))
+        assert "".join(lines) == self.STREAM + "[KPROF] do"
+
+
+class TestLogHistogram:
+    """Quantiles stay within the documented relative error."""
+
+    @pytest.mark.parametrize("seed", [1, 2, 3])
+    def test_error_bound(self, seed):
+        rng = random.Random(seed)
+        values = [int(rng.lognormvariate(10, 2)) for _ in range(5000)]
+        hist = LogHistogram()
+        for v in values:
+            hist.add(v)
+        got = hist.to_metric()
+        values.sort()
+        bound = 2.0 ** -HIST_SIG_BITS
+        assert (got.count, got.total, got.min_v, got.max_v) == (
+            len(values), sum(values), values[0], values[-1],
+        )
+        for name, pct in (("p95", 95), ("p99", 99)):
+            exact = percentile(values, pct)
+            assert abs(getattr(got, name) - exact) <= exact * bound + 1, name
+        n = len(values)
+        exact_median = (values[(n - 1) // 2] + values[n // 2]) / 2
+        assert abs(got.median - exact_median) <= exact_median * bound + 1
+
+    def test_small_values_exact(self):
+        hist = LogHistogram()
+        for v in range(1 << HIST_SIG_BITS):
+            hist.add(v)
+        values = list(range(1 << HIST_SIG_BITS))
+        got = hist.to_metric()
+        assert got.p95 == percentile(values, 95)
+        assert got.p99 == percentile(values, 99)
+
+    def test_merge_equals_single(self):
+        rng = random.Random(7)
+        values = [rng.randrange(1 << 40) for _ in range(2000)]
+        whole, left, right = LogHistogram(), LogHistogram(), LogHistogram()
+        for i, v in enumerate(values):
+            whole.add(v)
+            (left if i % 2 else right).add(v)
+        left.merge(right)
+        assert left.to_metric() == whole.to_metric()
@@ -11,6 +11,18 @@ Reports (and gates on) two metrics per scope:
   - median TSC per call   — wall-time-ish cost of a scope invocation
   - median cycles per call — cycles retired per scope invocation
 
+When both dumps know their TSC rate (`parse_kprof.py` adds an `ns`
+block to every scope), the wall-time check compares nanoseconds
+instead of raw ticks, so a baseline recorded on one host stays valid
+on another with a different TSC frequency.
+
+When both dumps carry the `derived` per-call ratios (trace captures
+with PMC data), every regression is tagged with the ratio that moved
+most: cache misses per 1k cycles (memory-bound), branch mispredicts
+per call (control-flow-bound) or a drop in cycles per tsc tick
+(halted / clocked down). `--derived-threshold` additionally gates on
+the median of the first two.
+
 Scopes absent from the baseline but present in current are treated
 as informational (printed, not gating) — first-run additions to the
 profile shouldn't fail CI. Scopes present in baseline but missing
@@ -19,24 +31,76 @@ removed, or the workload didn't exercise it this run. Either way
 the baseline should be updated explicitly rather than silently
 failing the gate.
 
+Baselines are recorded with `parse_kprof.py --steady-state`, so the
+medians exclude each scope's warmup calls. A pair of dumps where only
+one side was made that way is still compared, with a note to refresh
+the baseline.
+
 Low-sample scopes (count below NOISY_FLOOR in either run) are
 skipped — noise on a handful of samples dominates any real trend.
 
+Either side may also be a raw serial capture instead of a JSON dump;
+it is parsed in-process through the `kprof` package exactly as
+`parse_kprof.py --json --all-sessions --steady-state` would, without
+the intermediate file. Either file may be gzip/xz/bzip2 compressed.
+
 Usage:
-    compare_baseline.py <baseline.json> <current.json> [--threshold 0.20]
+    compare_baseline.py <baseline.json|capture.log> <current.json|capture.log>
+                        [--threshold 0.20]
+                        [--derived-threshold 0.30]
 """
 
 from __future__ import annotations
 
 import argparse
 import json
+import os
 import sys
 
 NOISY_FLOOR = 50
 
+# Derived ratios that can be gated, with what a rise in each suggests.
+DERIVED_GATED = (
+    ("cmiss_per_kcycle", "memory-bound"),
+    ("bmiss_per_call", "control-flow-bound"),
+)
+# Relative change a ratio needs before it is used to classify.
+CLASSIFY_FLOOR = 0.10
+
+KPROF_TOOLS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "kernel", "kprof", "tools",
+)
+
+
+def import_kprof():
+    if KPROF_TOOLS not in sys.path:
+        sys.path.insert(0, KPROF_TOOLS)
+    import kprof
+
+    return kprof
+
+
+def capture_doc(path: str) -> dict:
+    """The `--json --all-sessions --steady-state` document of a raw
+    capture, built in-process."""
+    kprof = import_kprof()
+    sessions = kprof.completed_sessions(kprof.load_capture(path))
+    if not sessions:
+        sys.exit(f"compare_baseline.py: {path}: no completed kprof session")
+    return kprof.json_report(
+        sessions, per_session=True, clock=kprof.resolve_tsc_clock(sessions),
+        stitch=True, steady=kprof.SteadyState(),
+    )
+
 
 def load(path: str) -> dict:
-    with open(path, "r", encoding="utf-8") as fh:
+    # `open_capture` undoes any gzip/xz/bzip2 compression.
+    open_capture = import_kprof().open_capture
+    with open_capture(path) as fh:
+        is_json = fh.read(64).lstrip()[:1] == "{"
+    if not is_json:
+        return capture_doc(path)
+    with open_capture(path) as fh:
         return json.load(fh)
 
 
@@ -50,6 +114,26 @@ def pct_delta(baseline: int, current: int) -> float:
     return (current - baseline) / baseline
 
 
+def classify(b: dict, c: dict) -> str:
+    """Short tag for why scope `c` got slower than `b`, from the
+    derived ratio that moved the most; empty without derived data."""
+    bd, cd = b.get("derived"), c.get("derived")
+    if not bd or not cd:
+        return ""
+    moves = [
+        (pct_delta(bd[key]["median"], cd[key]["median"]), tag)
+        for key, tag in DERIVED_GATED
+    ]
+    # Fewer cycles per tick means time passed with the core halted or
+    # clocked down rather than doing more work.
+    moves.append((-pct_delta(bd["cycles_per_tsc"]["median"], cd["cycles_per_tsc"]["median"]),
+                  "halted / clocked down"))
+    delta, tag = max(moves)
+    if delta < CLASSIFY_FLOOR:
+        return "  [no derived ratio moved]"
+    return f"  [{tag}]"
+
+
 def main() -> int:
     ap = argparse.ArgumentParser()
     ap.add_argument("baseline")
@@ -60,14 +144,30 @@ def main() -> int:
         default=0.20,
         help="Fractional regression tolerated on median per-call cost (default 0.20 = 20%%).",
     )
+    ap.add_argument(
+        "--derived-threshold",
+        type=float,
+        default=None,
+        help="Also fail when the median cache misses per 1k cycles or branch "
+             "mispredicts per call rise by more than this fraction.",
+    )
     args = ap.parse_args()
 
-    base = scope_map(load(args.baseline))
-    curr = scope_map(load(args.current))
+    base_doc = load(args.baseline)
+    curr_doc = load(args.current)
+    base = scope_map(base_doc)
+    curr = scope_map(curr_doc)
 
     regressions: list[str] = []
     info: list[str] = []
 
+    if ("steady_state" in base_doc) != ("steady_state" in curr_doc):
+        which = "baseline" if "steady_state" in base_doc else "current"
+        info.append(
+            f"  [warmup] only the {which} dump excludes warmup calls; "
+            "re-record the baseline with --update-baseline"
+        )
+
     for name in sorted(set(base) | set(curr)):
         if name not in base:
             info.append(f"  [new]    {name}")
@@ -83,14 +183,26 @@ def main() -> int:
             info.append(f"  [noisy]  {name} (counts {b_count} → {c_count})")
             continue
 
-        for metric in ("tsc", "cycles"):
+        wall = "ns" if "ns" in b and "ns" in c else "tsc"
+        for metric in (wall, "cycles"):
             bm = b[metric]["median"]
             cm = c[metric]["median"]
             d = pct_delta(bm, cm)
             if d > args.threshold:
                 regressions.append(
                     f"  {name}.{metric}.median  {bm} → {cm}  (+{d * 100:.1f}%)"
+                    f"{classify(b, c)}"
                 )
+        if args.derived_threshold is not None and "derived" in b and "derived" in c:
+            for key, tag in DERIVED_GATED:
+                bm = b["derived"][key]["median"]
+                cm = c["derived"][key]["median"]
+                d = pct_delta(bm, cm)
+                if d > args.derived_threshold:
+                    regressions.append(
+                        f"  {name}.derived.{key}.median  {bm} → {cm}  "
+                        f"(+{d * 100:.1f}%)  [{tag}]"
+                    )
 
     if info:
         print("Informational:")
@@ -11,7 +11,14 @@
 #      rolling dump fires every time a per-CPU log fills, so a few
 #      seconds is enough to get multiple [KPROF] begin…done cycles
 #      into the serial capture.
-#   4. Feed the capture through kernel/kprof/tools/parse_kprof.py --json.
+#   4. Compress the capture into tests/prof/current/<workload>.log.gz
+#      (kept for re-analysis with parse_kprof.py / flamegraph.py,
+#      which read compressed captures directly) and feed it through
+#      kernel/kprof/tools/parse_kprof.py --json --all-sessions
+#      --steady-state, pooling every completed rolling dump so each
+#      boot contributes all of its samples, not just the last cycle's,
+#      and leaving each scope's warmup calls (cold caches, first-touch
+#      faults) out of the gated stats.
 #   5. Compare the scope medians to the committed baseline under
 #      tests/prof/baselines/<workload>.json.
 #
@@ -22,6 +29,16 @@
 #   --compare-baseline  Default. Runs the workload, compares, exits
 #                       non-zero on regression.
 #
+# Environment:
+#   RUN_SECONDS         QEMU run window per workload (default 20).
+#   THRESHOLD           Fractional regression tolerated (default 0.20).
+#   CAPTURE_COMPRESS    gzip (default), xz, or none for the stored
+#                       serial capture.
+#   STOP_WHEN_STABLE    Percent. Watch the capture live with
+#                       parse_kprof.py --follow and stop QEMU early once
+#                       no scope median moves by more than this for a
+#                       few cycles (RUN_SECONDS stays the upper bound).
+#
 # Positional args are workload names. Default set (cheap + stable):
 #   yield ipc fault spawn
 #
@@ -41,6 +58,18 @@ CURRENT_DIR="$SCRIPT_DIR/current"
 
 RUN_SECONDS="${RUN_SECONDS:-20}"
 THRESHOLD="${THRESHOLD:-0.20}"
+CAPTURE_COMPRESS="${CAPTURE_COMPRESS:-gzip}"
+STOP_WHEN_STABLE="${STOP_WHEN_STABLE:-}"
+
+case "$CAPTURE_COMPRESS" in
+    gzip) CAPTURE_EXT=".gz" ;;
+    xz) CAPTURE_EXT=".xz" ;;
+    none) CAPTURE_EXT="" ;;
+    *)
+        echo "unknown CAPTURE_COMPRESS: $CAPTURE_COMPRESS (gzip, xz, none)" >&2
+        exit 2
+        ;;
+esac
 
 MODE="compare"
 WORKLOADS=()
@@ -49,7 +78,7 @@ for arg in "$@"; do
         --compare-baseline) MODE="compare" ;;
         --update-baseline) MODE="update" ;;
         --help|-h)
-            sed -n '2,35p' "$0"
+            sed -n '2,48p' "$0"
             exit 0
             ;;
         --*)
@@ -84,9 +113,9 @@ run_workload() {
     fi
 
     # Boot for RUN_SECONDS, capturing serial. Killing QEMU truncates the
-    # tail mid-record — that's fine, parse_kprof.py treats the last
-    # incomplete [KPROF] begin…done pair as a warning, not an error,
-    # and we only use fully-closed cycles for stats.
+    # tail mid-record — that's fine, parse_kprof.py --all-sessions
+    # drops the last incomplete [KPROF] begin…done pair with a warning
+    # and pools only fully-closed cycles for stats.
     local qemu_log
     qemu_log=$(mktemp)
     (cd "$ZAG_ROOT" && timeout --kill-after=5 "$RUN_SECONDS" \
@@ -95,7 +124,20 @@ run_workload() {
             -Dkernel_profile=trace \
             -Doptimize=ReleaseFast \
             -- -display none \
-        > "$qemu_log" 2>&1) || true
+        > "$qemu_log" 2>&1) &
+    local qemu_job=$!
+    if [[ -n "$STOP_WHEN_STABLE" ]]; then
+        # Returns once the medians settle, or when the log goes quiet
+        # because the timeout above already ended the run. --idle only
+        # counts from the first [KPROF] line, so the silent build and
+        # boot can't end it early; the outer timeout covers a run that
+        # never gets that far.
+        timeout $((RUN_SECONDS + 10)) \
+            python3 "$PARSE_KPROF" "$qemu_log" --follow --idle 5 \
+                --stable "$STOP_WHEN_STABLE" || true
+        pkill -f "qemu-system-x86_64" 2>/dev/null || true
+    fi
+    wait "$qemu_job" || true
     pkill -f "qemu-system-x86_64" 2>/dev/null || true
 
     if ! grep -q '^\[KPROF\] begin' "$qemu_log"; then
@@ -105,13 +147,19 @@ run_workload() {
         return 1
     fi
 
+    local capture="$CURRENT_DIR/$workload.log$CAPTURE_EXT"
+    case "$CAPTURE_COMPRESS" in
+        gzip) gzip -c "$qemu_log" > "$capture" ;;
+        xz) xz -c "$qemu_log" > "$capture" ;;
+        none) cp "$qemu_log" "$capture" ;;
+    esac
+    rm -f "$qemu_log"
+
     local current_json="$CURRENT_DIR/$workload.json"
-    if ! python3 "$PARSE_KPROF" "$qemu_log" --json > "$current_json"; then
+    if ! python3 "$PARSE_KPROF" "$capture" --json --all-sessions --steady-state > "$current_json"; then
         echo "[FAIL] $workload: parse_kprof --json failed"
-        rm -f "$qemu_log"
         return 1
     fi
-    rm -f "$qemu_log"
 
     local baseline_json="$BASELINE_DIR/$workload.json"
     if [[ "$MODE" == "update" ]]; then